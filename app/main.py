@@ -1,26 +1,109 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks
-import subprocess
-import tempfile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
 import os
 import uuid
-import shutil
+import json
 import asyncio
+import time
 from pydantic import BaseModel
 import logging
-from typing import Optional
-import docker
-import json
+from typing import Any, Dict, List, Optional, Tuple
 
-from services.code_manager import generate_and_validate_code, validate_existing_code
-
-app = FastAPI(title="Secure Python Code Execution API")
+from services.code_manager import (
+    generate_and_validate_code,
+    validate_existing_code,
+    generation_cache,
+    validation_cache,
+    generation_flights,
+    validation_flights,
+    validation_tier_stats,
+    llm_calls,
+)
+from services import llm_client, metrics, static_analysis
+from services.cache import normalize_code
+from services.backends import BackendRouter
+from services.jobs import JobError, JobManager, QueueFullError, create_store
+from services.reaper import Reaper
+from services.result_cache import ExecutionResultCache
+from services.scheduler import AdmissionRejected
+from services.sessions import SessionFailed, SessionLimitReached, SessionManager, SessionNotFound
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create Docker client
-docker_client = docker.from_env()
+# Batch execution limits
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", str(os.cpu_count() or 4)))
+
+# Allow /execute requests to opt into running code while validation is in flight
+SPECULATIVE_EXECUTION_ENABLED = os.getenv("SPECULATIVE_EXECUTION_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Results of requests marked cacheable, keyed by code, image digest and limits
+# (the digest is looked up on the docker daemon that runs the snippet)
+execution_cache = ExecutionResultCache()
+
+# Routes executions to the least-loaded healthy docker daemon; each daemon has its
+# own container pool, fork servers and admission scheduler
+sandbox_executor = BackendRouter(result_cache=execution_cache)
+
+# Reclaims sandbox containers and temp dirs leaked by failed cleanups or crashes
+reaper = Reaper(sandbox_executor.clients)
+
+# Interactive sessions keep one sandbox and interpreter namespace alive across calls
+session_manager = SessionManager(sandbox_executor)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm_client.startup()
+    await sandbox_executor.start()
+    await reaper.start()
+    await session_manager.start()
+    await job_manager.start()
+    try:
+        yield
+    finally:
+        await job_manager.stop()
+        await session_manager.stop()
+        await reaper.stop()
+        await sandbox_executor.stop()
+        await llm_client.shutdown()
+
+app = FastAPI(title="Secure Python Code Execution API", lifespan=lifespan)
+
+class RequestLatencyMiddleware:
+    """Records how long each response takes, by route template and status."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = {"code": 500}
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = scope.get("route")
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"],
+            )
+
+app.add_middleware(RequestLatencyMiddleware)
 
 # Define request models
 class CodeExecutionRequest(BaseModel):
@@ -29,12 +112,20 @@ class CodeExecutionRequest(BaseModel):
     memory_limit: str = "100m"  # Default memory limit
     cpu_limit: float = 0.5  # Default CPU limit (half a core)
     validate_code: bool = True  # Whether to validate code with Together AI
+    priority: int = 0  # Higher runs first when waiting for capacity
+    include_timings: bool = False  # Return a per-stage latency breakdown
+    speculative: bool = False  # Start running while validation is in flight
+    cacheable: bool = False  # Code is deterministic; reuse a cached result if there is one
 
 class QueryExecutionRequest(BaseModel):
     query: str
     timeout: int = 15  # Default timeout in seconds
     memory_limit: str = "100m"  # Default memory limit
     cpu_limit: float = 0.5  # Default CPU limit (half a core)
+    bypass_generation_cache: bool = False  # Always ask Together AI for fresh code
+    priority: int = 0  # Higher runs first when waiting for capacity
+    include_timings: bool = False  # Return a per-stage latency breakdown
+    cacheable: bool = False  # Generated code is deterministic; reuse a cached result if there is one
 
 # Define response models
 class CodeExecutionResponse(BaseModel):
@@ -45,6 +136,13 @@ class CodeExecutionResponse(BaseModel):
     original_code: str
     executed_code: str
     validation_result: Optional[str] = None
+    validation_cached: bool = False
+    speculative: bool = False  # Output came from a run started before validation finished
+    result_cached: bool = False  # Served from the execution result cache without running
+    timed_out: bool = False  # Killed after exceeding the timeout; output is partial
+    truncated: bool = False  # Output exceeded OUTPUT_MAX_BYTES and was cut
+    resources: Optional[Dict[str, Any]] = None  # Peak memory, CPU time, OOM kill and output bytes of the run
+    timings: Optional[Dict[str, float]] = None  # Seconds per stage, if requested
 
 class QueryExecutionResponse(BaseModel):
     query: str
@@ -54,6 +152,246 @@ class QueryExecutionResponse(BaseModel):
     exit_code: int
     execution_time: float
     validation_result: Optional[str] = None
+    generation_cached: bool = False
+    result_cached: bool = False  # Served from the execution result cache without running
+    timed_out: bool = False  # Killed after exceeding the timeout; output is partial
+    truncated: bool = False  # Output exceeded OUTPUT_MAX_BYTES and was cut
+    resources: Optional[Dict[str, Any]] = None  # Peak memory, CPU time, OOM kill and output bytes of the run
+    timings: Optional[Dict[str, float]] = None  # Seconds per stage, if requested
+
+def _validation_rejected(validation_result: str) -> HTTPException:
+    """Counts a rejected snippet and builds the error returned for it."""
+    metrics.VALIDATION_REJECTIONS.inc(source="validation")
+    return HTTPException(
+        status_code=400, 
+        detail=f"Code validation failed: {validation_result}"
+    )
+
+async def _prepare_code(request: CodeExecutionRequest, execution_id: str):
+    """
+    Validates submitted code if requested.
+    
+    Returns:
+        Tuple of (executed_code, validation_result, validation_cached)
+    
+    Raises:
+        HTTPException: If the code is deemed unsafe
+    """
+    executed_code = request.code
+    validation_result = None
+    validation_cached = False
+    
+    # Validate code if requested
+    if request.validate_code:
+        logger.info(f"Validating code with ID: {execution_id}")
+        executed_code, is_safe, validation_result, validation_cached = await validate_existing_code(request.code)
+        
+        if not is_safe:
+            raise _validation_rejected(validation_result)
+    
+    return executed_code, validation_result, validation_cached
+
+async def _prepare_query(request: QueryExecutionRequest, execution_id: str):
+    """
+    Generates and validates code for a query.
+    
+    Returns:
+        Tuple of (generated_code, validation_result, generation_cached)
+    
+    Raises:
+        HTTPException: If no code could be generated or it is deemed unsafe
+    """
+    logger.info(f"Processing query execution with ID: {execution_id}")
+    
+    # Generate and validate code in a single step
+    logger.info(f"Generating and validating code for query: {request.query}")
+    generated_code, is_safe, validation_result, generation_cached = await generate_and_validate_code(
+        request.query, bypass_cache=request.bypass_generation_cache
+    )
+    
+    if not generated_code:
+        raise HTTPException(
+            status_code=400,
+            detail="Failed to generate code from query"
+        )
+        
+    if not is_safe:
+        metrics.VALIDATION_REJECTIONS.inc(source="generation")
+        logger.warning(f"Generated code for query '{request.query}' was deemed unsafe: {validation_result}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Generated code validation failed: {validation_result}"
+        )
+    
+    return generated_code, validation_result, generation_cached
+
+def _admission_error(e: Exception) -> HTTPException:
+    """Maps scheduler errors to HTTP errors."""
+    if isinstance(e, AdmissionRejected):
+        return HTTPException(
+            status_code=429,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    return HTTPException(status_code=400, detail=str(e))
+
+async def _admit(request):
+    """Reserves capacity before a streaming response starts."""
+    try:
+        return await sandbox_executor.admit(request.memory_limit, request.cpu_limit, request.priority)
+    except (AdmissionRejected, ValueError) as e:
+        raise _admission_error(e)
+
+def _sse(event: str, data: dict) -> str:
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _stream_response(code: str, request, execution_id: str, prefix: str, start: dict, reservation) -> StreamingResponse:
+    """Streams an admitted execution as Server-Sent Events."""
+    # stream() releases the reservation once it has started; until then it is ours
+    handed_over = False
+    
+    async def events():
+        nonlocal handed_over
+        try:
+            yield _sse("start", start)
+            handed_over = True
+            async for event, payload in sandbox_executor.stream(
+                code,
+                timeout=request.timeout,
+                memory_limit=request.memory_limit,
+                cpu_limit=request.cpu_limit,
+                execution_id=execution_id,
+                prefix=prefix,
+                reservation=reservation,
+            ):
+                if event in ("stdout", "stderr"):
+                    payload = {"data": payload}
+                yield _sse(event, payload)
+        finally:
+            if not handed_over:
+                # The client disconnected after the start event
+                reservation.release()
+    
+    def release_unclaimed():
+        # The body was never iterated, e.g. the client disconnected first
+        if not handed_over:
+            reservation.release()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release_unclaimed),
+    )
+
+async def _execute_prepared(
+    request: CodeExecutionRequest,
+    executed_code: str,
+    validation_result: Optional[str],
+    validation_cached: bool,
+    execution_id: str,
+) -> CodeExecutionResponse:
+    """Runs already validated code and builds the /execute response."""
+    logger.info(f"Executing code with ID: {execution_id}")
+    
+    try:
+        result = await sandbox_executor.run(
+            executed_code,
+            timeout=request.timeout,
+            memory_limit=request.memory_limit,
+            cpu_limit=request.cpu_limit,
+            execution_id=execution_id,
+            prefix="code_exec",
+            priority=request.priority,
+            cacheable=request.cacheable,
+        )
+    except (AdmissionRejected, ValueError) as e:
+        raise _admission_error(e)
+    except Exception as e:
+        logger.error(f"Container execution error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Execution error: {str(e)}")
+    
+    return CodeExecutionResponse(
+        stdout=result.stdout,
+        stderr=result.stderr,
+        exit_code=result.exit_code,
+        execution_time=result.execution_time,
+        original_code=request.code,
+        executed_code=executed_code,
+        validation_result=validation_result,
+        validation_cached=validation_cached,
+        result_cached=result.cached,
+        timed_out=result.timed_out,
+        truncated=result.truncated,
+        resources=result.resources
+    )
+
+async def _execute_speculative(request: CodeExecutionRequest, execution_id: str) -> CodeExecutionResponse:
+    """
+    Runs the submitted code while it is still being validated.
+    
+    The sandbox has no network, a read-only filesystem and no capabilities,
+    so running code before the verdict is in only costs capacity. The output
+    is released only if validation passes with the code unchanged; rewritten
+    code is run again and rejected code has its run killed and discarded.
+    """
+    validation = asyncio.ensure_future(validate_existing_code(request.code))
+    # The static pre-screen and cache lookups finish without suspending
+    await asyncio.sleep(0)
+    if validation.done():
+        metrics.SPECULATIVE_EXECUTIONS.inc(outcome="skipped")
+        logger.info(f"Validated code with ID: {execution_id}")
+        # Raises the validation error, if any, like _prepare_code
+        executed_code, is_safe, validation_result, validation_cached = validation.result()
+        if not is_safe:
+            raise _validation_rejected(validation_result)
+        return await _execute_prepared(request, executed_code, validation_result, validation_cached, execution_id)
+    
+    logger.info(f"Speculatively executing code with ID: {execution_id}")
+    run = asyncio.ensure_future(_execute_prepared(request, request.code, None, False, execution_id))
+    # A discarded run's errors are never awaited
+    run.add_done_callback(lambda done: done.cancelled() or done.exception())
+    try:
+        executed_code, is_safe, validation_result, validation_cached = await validation
+    except BaseException:
+        run.cancel()
+        raise
+    
+    if not is_safe:
+        run.cancel()
+        metrics.SPECULATIVE_EXECUTIONS.inc(outcome="rejected")
+        raise _validation_rejected(validation_result)
+    
+    if normalize_code(executed_code) != normalize_code(request.code):
+        run.cancel()
+        metrics.SPECULATIVE_EXECUTIONS.inc(outcome="rewritten")
+        logger.info(f"Validator rewrote code, re-running ID: {execution_id}")
+        return await _execute_prepared(request, executed_code, validation_result, validation_cached, execution_id)
+    
+    response = await run
+    metrics.SPECULATIVE_EXECUTIONS.inc(outcome="released")
+    response.executed_code = executed_code
+    response.validation_result = validation_result
+    response.validation_cached = validation_cached
+    response.speculative = True
+    return response
+
+class BatchExecutionRequest(BaseModel):
+    items: List[CodeExecutionRequest]
+    parallelism: Optional[int] = None  # Defaults to BATCH_PARALLELISM
+    stream: bool = False  # Return NDJSON lines as items finish
+
+class BatchItemResult(BaseModel):
+    index: int
+    status_code: int
+    result: Optional[CodeExecutionResponse] = None
+    error: Optional[str] = None
+
+class BatchExecutionResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
 
 @app.post("/execute", response_model=CodeExecutionResponse)
 async def execute_code(request: CodeExecutionRequest):
@@ -67,103 +405,113 @@ async def execute_code(request: CodeExecutionRequest):
     - No access to host filesystem
     """
     execution_id = str(uuid.uuid4())
-    temp_dir = tempfile.mkdtemp(prefix=f"code_exec_{execution_id}_")
+    started = time.perf_counter()
+    timings = metrics.start_breakdown()
+    if request.validate_code and request.speculative and SPECULATIVE_EXECUTION_ENABLED:
+        response = await _execute_speculative(request, execution_id)
+    else:
+        executed_code, validation_result, validation_cached = await _prepare_code(request, execution_id)
+        response = await _execute_prepared(request, executed_code, validation_result, validation_cached, execution_id)
+    if request.include_timings:
+        response.timings = {**timings, "total": time.perf_counter() - started}
+    return response
+
+@app.post("/execute/batch", response_model=BatchExecutionResponse)
+async def execute_code_batch(request: BatchExecutionRequest):
+    """
+    Execute a list of code snippets concurrently.
     
-    original_code = request.code
-    executed_code = original_code
-    validation_result = None
+    Identical snippets are validated once, then items run in parallel.
+    Validation and execution both use at most the requested parallelism
+    (capped by BATCH_PARALLELISM). Each item gets
+    its own result or error; one failing item does not fail the batch. With
+    `stream` set, results are returned as NDJSON lines in completion order.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Batch contains no items")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch too large: {len(request.items)} items (max {BATCH_MAX_ITEMS})"
+        )
     
-    try:
-        # Validate code if requested
-        if request.validate_code:
-            logger.info(f"Validating code with ID: {execution_id}")
-            executed_code, is_safe, validation_result = await validate_existing_code(request.code)
-            
+    batch_id = str(uuid.uuid4())
+    parallelism = max(1, min(request.parallelism or BATCH_PARALLELISM, BATCH_PARALLELISM))
+    logger.info(f"Executing batch {batch_id}: {len(request.items)} items, parallelism {parallelism}")
+    
+    semaphore = asyncio.Semaphore(parallelism)
+    
+    async def validate(code: str) -> Tuple[str, bool, str, bool]:
+        # Bounded like execution, so a large batch does not flood the LLM connection pool
+        async with semaphore:
+            return await validate_existing_code(code)
+    
+    # Validate each distinct snippet once
+    unique_codes = list({item.code for item in request.items if item.validate_code})
+    verdicts = await asyncio.gather(*(validate(code) for code in unique_codes))
+    validations = dict(zip(unique_codes, verdicts))
+    
+    async def run_item(index: int, item: CodeExecutionRequest) -> BatchItemResult:
+        execution_id = f"{batch_id}-{index}"
+        executed_code, validation_result, validation_cached = item.code, None, False
+        if item.validate_code:
+            executed_code, is_safe, validation_result, validation_cached = validations[item.code]
             if not is_safe:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Code validation failed: {validation_result}"
+                metrics.VALIDATION_REJECTIONS.inc(source="validation")
+                return BatchItemResult(
+                    index=index,
+                    status_code=400,
+                    error=f"Code validation failed: {validation_result}"
                 )
-        
-        # Write code to temporary file
-        code_file_path = os.path.join(temp_dir, "code.py")
-        with open(code_file_path, "w") as f:
-            f.write(executed_code)
-        
-        logger.info(f"Executing code with ID: {execution_id}")
-        
-        # Run in Docker container
-        start_time = asyncio.get_event_loop().time()
-        
-        try:
-            container = docker_client.containers.run(
-                image="python-code-execution:latest",
-                command=["python", "/code/code.py"],
-                volumes={temp_dir: {"bind": "/code", "mode": "ro"}},
-                mem_limit=request.memory_limit,
-                cpu_quota=int(100000 * request.cpu_limit),  # Docker CPU quota in microseconds
-                network_mode="none",  # Disable networking
-                detach=True,
-                remove=False,  # We'll remove it manually to ensure cleanup
-                read_only=True,  # Read-only filesystem
-                cap_drop=["ALL"],  # Drop all capabilities
-                security_opt=["no-new-privileges:true"],  # Prevent privilege escalation
-            )
-            
-            # Wait for execution with timeout
-            try:
-                container.wait(timeout=request.timeout)
-            except:
-                logger.warning(f"Execution timed out for ID: {execution_id}")
-            
-            logs = container.logs(stdout=True, stderr=True)
-            exit_code = container.attrs['State']['ExitCode']
-            
-            # Try to get separate stdout/stderr if available
+        async with semaphore:
             try:
-                stdout_logs = container.logs(stdout=True, stderr=False).decode('utf-8')
-            except:
-                stdout_logs = ""
-                
-            try:
-                stderr_logs = container.logs(stdout=False, stderr=True).decode('utf-8')
-            except:
-                stderr_logs = ""
-                
-            # If separate logs failed, use combined logs
-            if not stdout_logs and not stderr_logs:
-                stdout_logs = logs.decode('utf-8')
-                stderr_logs = ""
-                
-            # Clean up container
+                result = await _execute_prepared(
+                    item, executed_code, validation_result, validation_cached, execution_id
+                )
+            except HTTPException as e:
+                return BatchItemResult(index=index, status_code=e.status_code, error=e.detail)
+        return BatchItemResult(index=index, status_code=200, result=result)
+    
+    tasks = [asyncio.ensure_future(run_item(i, item)) for i, item in enumerate(request.items)]
+    
+    if request.stream:
+        async def ndjson():
             try:
-                container.remove(force=True)
-            except:
-                logger.error(f"Failed to remove container for ID: {execution_id}")
-                
-        except Exception as e:
-            logger.error(f"Container execution error: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Execution error: {str(e)}")
-            
-        end_time = asyncio.get_event_loop().time()
-        execution_time = end_time - start_time
-        
-        return CodeExecutionResponse(
-            stdout=stdout_logs,
-            stderr=stderr_logs,
-            exit_code=exit_code,
-            execution_time=execution_time,
-            original_code=original_code,
-            executed_code=executed_code,
-            validation_result=validation_result
-        )
-        
-    finally:
-        # Clean up temporary directory
-        try:
-            shutil.rmtree(temp_dir)
-        except Exception as e:
-            logger.error(f"Failed to remove temporary directory: {str(e)}")
+                for finished in asyncio.as_completed(tasks):
+                    item_result = await finished
+                    yield json.dumps(jsonable_encoder(item_result)) + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    results = await asyncio.gather(*tasks)
+    succeeded = sum(1 for r in results if r.status_code == 200)
+    return BatchExecutionResponse(results=results, succeeded=succeeded, failed=len(results) - succeeded)
+
+@app.post("/execute/stream")
+async def execute_code_stream(request: CodeExecutionRequest):
+    """
+    Execute Python code and stream its output as Server-Sent Events.
+    
+    Emits a `start` event with the executed code, `stdout` and `stderr`
+    events as output arrives, and a final `exit` event with the exit code
+    and timing (or an `error` event).
+    """
+    execution_id = str(uuid.uuid4())
+    executed_code, validation_result, validation_cached = await _prepare_code(request, execution_id)
+    
+    reservation = await _admit(request)
+    
+    logger.info(f"Streaming execution of code with ID: {execution_id}")
+    start = {
+        "execution_id": execution_id,
+        "original_code": request.code,
+        "executed_code": executed_code,
+        "validation_result": validation_result,
+        "validation_cached": validation_cached,
+    }
+    return _stream_response(executed_code, request, execution_id, "code_exec", start, reservation)
 
 @app.post("/generate-and-execute", response_model=QueryExecutionResponse)
 async def generate_and_execute_code(request: QueryExecutionRequest):
@@ -176,108 +524,293 @@ async def generate_and_execute_code(request: QueryExecutionRequest):
     3. Returns the execution results
     """
     execution_id = str(uuid.uuid4())
-    logger.info(f"Processing query execution with ID: {execution_id}")
-    
-    # Generate and validate code in a single step
-    logger.info(f"Generating and validating code for query: {request.query}")
-    generated_code, is_safe, validation_result = await generate_and_validate_code(request.query)
+    started = time.perf_counter()
+    timings = metrics.start_breakdown()
+    generated_code, validation_result, generation_cached = await _prepare_query(request, execution_id)
+        
+    # Execute the validated code
+    logger.info(f"Executing generated code")
     
-    if not generated_code:
-        raise HTTPException(
-            status_code=400,
-            detail="Failed to generate code from query"
+    try:
+        result = await sandbox_executor.run(
+            generated_code,
+            timeout=request.timeout,
+            memory_limit=request.memory_limit,
+            cpu_limit=request.cpu_limit,
+            execution_id=execution_id,
+            prefix="query_exec",
+            priority=request.priority,
+            cacheable=request.cacheable,
         )
-        
-    if not is_safe:
-        logger.warning(f"Generated code for query '{request.query}' was deemed unsafe: {validation_result}")
+    except (AdmissionRejected, ValueError) as e:
+        raise _admission_error(e)
+    except Exception as e:
+        logger.error(f"Container execution error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Execution error: {str(e)}")
+    
+    return QueryExecutionResponse(
+        query=request.query,
+        generated_code=generated_code,
+        stdout=result.stdout,
+        stderr=result.stderr,
+        exit_code=result.exit_code,
+        execution_time=result.execution_time,
+        validation_result=validation_result,
+        generation_cached=generation_cached,
+        result_cached=result.cached,
+        timed_out=result.timed_out,
+        truncated=result.truncated,
+        resources=result.resources,
+        timings={**timings, "total": time.perf_counter() - started} if request.include_timings else None
+    )
+
+@app.post("/generate-and-execute/stream")
+async def generate_and_execute_code_stream(request: QueryExecutionRequest):
+    """
+    Generate Python code from a query and stream its execution as Server-Sent Events.
+    
+    The `start` event carries the generated code; output and exit events
+    follow as for `/execute/stream`.
+    """
+    execution_id = str(uuid.uuid4())
+    generated_code, validation_result, generation_cached = await _prepare_query(request, execution_id)
+    
+    reservation = await _admit(request)
+    
+    logger.info(f"Streaming execution of generated code with ID: {execution_id}")
+    start = {
+        "execution_id": execution_id,
+        "query": request.query,
+        "generated_code": generated_code,
+        "validation_result": validation_result,
+        "generation_cached": generation_cached,
+    }
+    return _stream_response(generated_code, request, execution_id, "query_exec", start, reservation)
+
+class JobSubmitRequest(BaseModel):
+    # Exactly one of these must be set
+    execute: Optional[CodeExecutionRequest] = None
+    generate_and_execute: Optional[QueryExecutionRequest] = None
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    status_code: Optional[int] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+def _job_response(job) -> JobResponse:
+    return JobResponse(
+        job_id=job.id,
+        kind=job.kind,
+        status=job.status,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        status_code=job.status_code,
+        result=job.result,
+        error=job.error,
+    )
+
+async def _execute_job(payload: dict) -> dict:
+    try:
+        response = await execute_code(CodeExecutionRequest(**payload))
+    except HTTPException as e:
+        raise JobError(e.status_code, e.detail)
+    return jsonable_encoder(response)
+
+async def _generate_and_execute_job(payload: dict) -> dict:
+    try:
+        response = await generate_and_execute_code(QueryExecutionRequest(**payload))
+    except HTTPException as e:
+        raise JobError(e.status_code, e.detail)
+    return jsonable_encoder(response)
+
+# Background jobs run the same flow as the synchronous endpoints
+job_manager = JobManager(
+    create_store(),
+    handlers={
+        "execute": _execute_job,
+        "generate-and-execute": _generate_and_execute_job,
+    },
+)
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(request: JobSubmitRequest):
+    """
+    Submit an execution as a background job and return its id immediately.
+    
+    Poll `GET /jobs/{job_id}` for the status and result.
+    """
+    if (request.execute is None) == (request.generate_and_execute is None):
         raise HTTPException(
             status_code=400,
-            detail=f"Generated code validation failed: {validation_result}"
+            detail="Provide exactly one of 'execute' or 'generate_and_execute'"
         )
-        
-    # Execute the validated code
-    temp_dir = tempfile.mkdtemp(prefix=f"query_exec_{execution_id}_")
+    if request.execute is not None:
+        kind, payload = "execute", request.execute
+    else:
+        kind, payload = "generate-and-execute", request.generate_and_execute
     
     try:
-        # Write code to temporary file
-        code_file_path = os.path.join(temp_dir, "code.py")
-        with open(code_file_path, "w") as f:
-            f.write(generated_code)
-        
-        logger.info(f"Executing generated code")
-        
-        # Run in Docker container
-        start_time = asyncio.get_event_loop().time()
-        
-        try:
-            container = docker_client.containers.run(
-                image="python-code-execution:latest",
-                command=["python", "/code/code.py"],
-                volumes={temp_dir: {"bind": "/code", "mode": "ro"}},
-                mem_limit=request.memory_limit,
-                cpu_quota=int(100000 * request.cpu_limit),
-                network_mode="none",
-                detach=True,
-                remove=False,
-                read_only=True,
-                cap_drop=["ALL"],
-                security_opt=["no-new-privileges:true"],
-            )
-            
-            # Wait for execution with timeout
-            try:
-                container.wait(timeout=request.timeout)
-            except:
-                logger.warning(f"Execution timed out for ID: {execution_id}")
-            
-            logs = container.logs(stdout=True, stderr=True)
-            exit_code = container.attrs['State']['ExitCode']
-            
-            # Get stdout/stderr
-            try:
-                stdout_logs = container.logs(stdout=True, stderr=False).decode('utf-8')
-            except:
-                stdout_logs = ""
-                
-            try:
-                stderr_logs = container.logs(stdout=False, stderr=True).decode('utf-8')
-            except:
-                stderr_logs = ""
-                
-            # If separate logs failed, use combined logs
-            if not stdout_logs and not stderr_logs:
-                stdout_logs = logs.decode('utf-8')
-                stderr_logs = ""
-                
-            # Clean up container
-            try:
-                container.remove(force=True)
-            except:
-                logger.error(f"Failed to remove container for ID: {execution_id}")
-                
-        except Exception as e:
-            logger.error(f"Container execution error: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Execution error: {str(e)}")
-            
-        end_time = asyncio.get_event_loop().time()
-        execution_time = end_time - start_time
-        
-        return QueryExecutionResponse(
-            query=request.query,
-            generated_code=generated_code,
-            stdout=stdout_logs,
-            stderr=stderr_logs,
-            exit_code=exit_code,
-            execution_time=execution_time,
-            validation_result=validation_result
-        )
-        
-    finally:
-        # Clean up temporary directory
-        try:
-            shutil.rmtree(temp_dir)
-        except Exception as e:
-            logger.error(f"Failed to remove temporary directory: {str(e)}")
+        job = job_manager.submit(kind, jsonable_encoder(payload))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return _job_response(job)
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Return the status of a job, and its result once finished."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+@app.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+class SessionCreateRequest(BaseModel):
+    memory_limit: Optional[str] = None  # Defaults to SESSION_MEMORY_LIMIT
+    cpu_limit: float = 0.5  # Default CPU limit (half a core)
+
+class SessionResponse(BaseModel):
+    session_id: str
+    backend: str
+    memory_limit: str
+    cpu_limit: float
+    created_at: float
+    idle_seconds: float
+    executions: int
+    busy: bool  # A snippet is running
+
+class SessionExecutionRequest(BaseModel):
+    code: str
+    timeout: int = 10  # Default timeout in seconds
+    validate_code: bool = True  # Whether to validate code with Together AI
+
+class SessionExecutionResponse(BaseModel):
+    session_id: str
+    stdout: str
+    stderr: str
+    exit_code: int
+    execution_time: float
+    executed_code: str
+    validation_result: Optional[str] = None
+    validation_cached: bool = False
+    timed_out: bool = False  # Interrupted after exceeding the timeout; the session is kept
+    truncated: bool = False  # Output exceeded OUTPUT_MAX_BYTES and was cut
+    resources: Optional[Dict[str, Any]] = None  # Peak memory of the session so far, CPU time and output bytes
+
+@app.post("/sessions", response_model=SessionResponse, status_code=201)
+async def create_session(request: SessionCreateRequest):
+    """
+    Open an interactive session backed by one long-lived sandbox.
+    
+    Snippets executed in the session share one interpreter namespace until
+    the session is closed or sits idle for SESSION_IDLE_TTL seconds.
+    """
+    try:
+        session = await session_manager.create(request.memory_limit, request.cpu_limit)
+    except SessionLimitReached as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except (AdmissionRejected, ValueError) as e:
+        raise _admission_error(e)
+    except Exception as e:
+        logger.error(f"Failed to open session: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to open session: {str(e)}")
+    return SessionResponse(**session.info())
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    """Return the limits and usage of an open session."""
+    try:
+        return SessionResponse(**session_manager.get(session_id).info())
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/sessions/{session_id}/execute", response_model=SessionExecutionResponse)
+async def execute_in_session(session_id: str, request: SessionExecutionRequest):
+    """
+    Execute a snippet against the session's interpreter namespace.
+    
+    Snippets in one session run one at a time, in the order they arrive.
+    """
+    execution_id = str(uuid.uuid4())
+    logger.info(f"Executing code with ID: {execution_id} in session {session_id}")
+    try:
+        session_manager.get(session_id)
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    executed_code, validation_result, validation_cached = await _prepare_code(request, execution_id)
+    
+    try:
+        result = await session_manager.execute(session_id, executed_code, request.timeout, execution_id)
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except SessionFailed as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        logger.error(f"Session execution error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Execution error: {str(e)}")
+    
+    return SessionExecutionResponse(
+        session_id=session_id,
+        stdout=result.stdout,
+        stderr=result.stderr,
+        exit_code=result.exit_code,
+        execution_time=result.execution_time,
+        executed_code=executed_code,
+        validation_result=validation_result,
+        validation_cached=validation_cached,
+        timed_out=result.timed_out,
+        truncated=result.truncated,
+        resources=result.resources
+    )
+
+@app.delete("/sessions/{session_id}", response_model=SessionResponse)
+async def close_session(session_id: str):
+    """Close a session and remove its sandbox, interrupting any running snippet."""
+    try:
+        session = await session_manager.close(session_id)
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return SessionResponse(**session.info())
+
+@app.get("/stats")
+async def stats():
+    """Runtime statistics for tuning the execution service."""
+    return {
+        "backends": sandbox_executor.stats(),
+        "reaper": reaper.stats(),
+        "sessions": session_manager.stats(),
+        "jobs": job_manager.stats(),
+        "validation_cache": validation_cache.stats(),
+        "validation_tiers": validation_tier_stats(),
+        "generation_cache": generation_cache.stats(),
+        "execution_cache": execution_cache.stats(),
+        "llm_client": llm_client.pool_stats(),
+        "llm_resilience": llm_calls.stats(),
+        "static_analysis": static_analysis.stats(),
+        "single_flight": {
+            "generation": generation_flights.stats(),
+            "validation": validation_flights.stats(),
+        },
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Per-stage latency histograms and counters in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,402 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import docker
+import requests
+from docker.utils import parse_bytes
+
+from services import metrics
+from services.container_pool import ContainerPool
+from services.fork_runner import FORK_RUNNER_ENABLED, ForkServerRunner
+from services.sandbox import EXECUTION_CONCURRENCY, SandboxExecutor, SandboxResult
+from services.scheduler import (
+    SCHEDULER_CPU_CAPACITY,
+    SCHEDULER_MEMORY_CAPACITY,
+    AdmissionRejected,
+    Reservation,
+    ResourceScheduler,
+)
+
+logger = logging.getLogger(__name__)
+
+# Comma separated docker endpoints, each optionally followed by "=memory:cpus" capacity,
+# e.g. "unix:///var/run/docker.sock,tcp://10.0.0.2:2375=16g:8" (empty: docker.from_env())
+DOCKER_ENDPOINTS = os.getenv("DOCKER_ENDPOINTS", "")
+# Seconds between health checks of every endpoint
+DOCKER_HEALTH_INTERVAL = float(os.getenv("DOCKER_HEALTH_INTERVAL", "10"))
+# Seconds a health check may take before it counts as a failure
+DOCKER_HEALTH_TIMEOUT = float(os.getenv("DOCKER_HEALTH_TIMEOUT", "5"))
+# Consecutive failures before an endpoint is taken out of rotation
+DOCKER_HEALTH_FAILURES = int(os.getenv("DOCKER_HEALTH_FAILURES", "3"))
+
+# Errors that mean the daemon itself could not be reached
+_CONNECTION_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+@dataclass
+class Endpoint:
+    """A docker daemon and the capacity executions may reserve on it."""
+    name: str
+    url: Optional[str]  # None for docker.from_env()
+    memory_capacity: str = SCHEDULER_MEMORY_CAPACITY
+    cpu_capacity: float = SCHEDULER_CPU_CAPACITY
+
+
+def parse_endpoints(spec: str) -> List[Endpoint]:
+    """
+    Parses an endpoint specification such as ``"unix:///var/run/docker.sock,tcp://h:2375=16g:8"``.
+
+    Args:
+        spec: Comma separated docker URLs, each optionally followed by ``=memory:cpus``
+
+    Returns:
+        List of endpoints; a single docker.from_env() endpoint if ``spec`` is empty
+    """
+    endpoints = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, capacity = item.partition("=")
+        endpoint = Endpoint(name=f"docker-{len(endpoints)}", url=url)
+        if capacity:
+            memory_capacity, _, cpu_capacity = capacity.partition(":")
+            endpoint.memory_capacity = memory_capacity or endpoint.memory_capacity
+            endpoint.cpu_capacity = float(cpu_capacity or endpoint.cpu_capacity)
+        endpoints.append(endpoint)
+    return endpoints or [Endpoint(name="local", url=None)]
+
+
+class DockerBackend:
+    """
+    One docker daemon with its own container pool, fork servers, admission
+    scheduler and executor.
+
+    The client is created on the first successful health check, so a daemon
+    that is down at startup joins the rotation once it comes up.
+    """
+
+    def __init__(self, endpoint: Endpoint, result_cache=None):
+        self.endpoint = endpoint
+        self.name = endpoint.name
+        self.result_cache = result_cache
+        self.scheduler = ResourceScheduler(
+            memory_capacity=parse_bytes(endpoint.memory_capacity),
+            cpu_capacity=endpoint.cpu_capacity,
+        )
+        self.client = None
+        self.pool: Optional[ContainerPool] = None
+        self.runner: Optional[ForkServerRunner] = None
+        self.executor: Optional[SandboxExecutor] = None
+        self.healthy = False
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.executions = 0
+        # Totals of the resource accounting reported by finished executions
+        self.usage = {"cpu_seconds": 0.0, "oom_kills": 0, "throttled_periods": 0, "output_bytes": 0}
+
+    def connect(self) -> None:
+        """Creates the docker client and the components that use it (blocking)."""
+        if self.endpoint.url is None:
+            client = docker.from_env(max_pool_size=EXECUTION_CONCURRENCY)
+        else:
+            client = docker.DockerClient(base_url=self.endpoint.url, max_pool_size=EXECUTION_CONCURRENCY)
+        self.client = client
+        self.pool = ContainerPool(client)
+        self.runner = ForkServerRunner(client) if FORK_RUNNER_ENABLED else None
+        self.executor = SandboxExecutor(
+            client, self.pool, scheduler=self.scheduler, runner=self.runner, result_cache=self.result_cache
+        )
+
+    async def start(self) -> None:
+        await self.pool.start()
+        if self.runner is not None:
+            await self.runner.start()
+
+    async def stop(self) -> None:
+        if self.executor is None:
+            return
+        await self.pool.stop()
+        if self.runner is not None:
+            await self.runner.stop()
+        self.executor.shutdown()
+
+    def ping(self) -> None:
+        """Raises if the daemon does not answer (blocking)."""
+        self.client.ping()
+
+    def load(self, memory: int = 0, cpus: float = 0.0) -> float:
+        """
+        Fraction of this daemon's capacity reserved or queued for, once
+        ``memory``/``cpus`` are added; above 1 the request would have to wait.
+        """
+        scheduler = self.scheduler
+        queued_memory, queued_cpus = scheduler.queued_demand()
+        fractions = [0.0]
+        if scheduler.memory_capacity > 0:
+            fractions.append((scheduler.reserved_memory + queued_memory + memory) / scheduler.memory_capacity)
+        if scheduler.cpu_capacity > 0:
+            fractions.append((scheduler.reserved_cpus + queued_cpus + cpus) / scheduler.cpu_capacity)
+        return max(fractions)
+
+    def in_flight(self) -> int:
+        """Executions holding or waiting for a reservation on this daemon."""
+        return self.scheduler.active + self.scheduler.queue_depth()
+
+    def can_fit(self, memory: int, cpus: float) -> bool:
+        """Whether the request could ever fit on this daemon."""
+        scheduler = self.scheduler
+        return not ((0 < scheduler.memory_capacity < memory) or (0 < scheduler.cpu_capacity < cpus))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "url": self.endpoint.url or "docker.from_env()",
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "executions": self.executions,
+            "usage": {**self.usage, "cpu_seconds": round(self.usage["cpu_seconds"], 3)},
+            "load": round(self.load(), 3),
+            "executor": self.executor.stats() if self.executor is not None else None,
+            "scheduler": self.scheduler.stats(),
+            "container_pool": self.pool.stats() if self.pool is not None else None,
+            "fork_runner": self.runner.stats() if self.runner is not None else {"enabled": False},
+        }
+
+
+class BackendRouter:
+    """
+    Routes executions across one or more docker daemons.
+
+    Each execution goes to the healthy daemon with the lowest load: daemons
+    where the request fits right now come first, then the smallest fraction
+    of reserved and queued memory/CPU after adding the request, then the
+    fewest executions in flight. A background loop pings every daemon; an endpoint
+    is taken out of rotation after ``failure_threshold`` consecutive failed
+    checks (or failed connections during executions) and returns after one
+    successful check.
+
+    Exposes the same run/stream/admit interface as SandboxExecutor.
+    """
+
+    def __init__(
+        self,
+        endpoints: Optional[List[Endpoint]] = None,
+        result_cache=None,
+        health_interval: float = DOCKER_HEALTH_INTERVAL,
+        health_timeout: float = DOCKER_HEALTH_TIMEOUT,
+        failure_threshold: int = DOCKER_HEALTH_FAILURES,
+    ):
+        endpoints = endpoints if endpoints is not None else parse_endpoints(DOCKER_ENDPOINTS)
+        self.backends = [DockerBackend(endpoint, result_cache) for endpoint in endpoints]
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.failure_threshold = failure_threshold
+        self._health_executor = ThreadPoolExecutor(
+            max_workers=max(2, len(self.backends)), thread_name_prefix="docker-health"
+        )
+        self._health_task: Optional[asyncio.Task] = None
+        self._started = set()
+
+    async def start(self) -> None:
+        """Connects to every endpoint and starts the health-check loop."""
+        await self.check_health()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.gather(*(backend.stop() for backend in self.backends), return_exceptions=True)
+        self._health_executor.shutdown(wait=False)
+
+    def clients(self) -> List[Any]:
+        """Returns the docker clients of the healthy endpoints."""
+        return [backend.client for backend in self.backends if backend.healthy]
+
+    def pick(self, memory_limit: str, cpu_limit: float) -> DockerBackend:
+        """
+        Chooses the endpoint for one execution.
+
+        Raises:
+            AdmissionRejected: If no endpoint is healthy
+            ValueError: If the request exceeds the capacity of every healthy endpoint
+        """
+        healthy = [backend for backend in self.backends if backend.healthy]
+        if not healthy:
+            raise AdmissionRejected("No healthy docker endpoint is available", int(self.health_interval) or 1)
+        memory = parse_bytes(memory_limit)
+        cpus = float(cpu_limit)
+        candidates = [backend for backend in healthy if backend.can_fit(memory, cpus)]
+        if not candidates:
+            raise ValueError(
+                f"Requested resources ({memory_limit}, {cpu_limit} CPU) exceed the capacity of every docker endpoint"
+            )
+
+        def score(backend: DockerBackend) -> Tuple[bool, float, int]:
+            load = backend.load(memory, cpus)
+            return (load > 1 + 1e-9, load, backend.in_flight())
+
+        return min(candidates, key=score)
+
+    async def admit(self, memory_limit: str, cpu_limit: float, priority: int = 0) -> Reservation:
+        """Reserves capacity on the least-loaded endpoint (see SandboxExecutor.admit)."""
+        backend = self.pick(memory_limit, cpu_limit)
+        return await backend.executor.admit(memory_limit, cpu_limit, priority)
+
+    def backend_for(self, reservation: Optional[Reservation]) -> Optional[DockerBackend]:
+        """Returns the endpoint a reservation from admit() was made on."""
+        if reservation is None:
+            return None
+        for backend in self.backends:
+            if backend.scheduler is reservation.scheduler:
+                return backend
+        return None
+
+    async def run(
+        self,
+        code: str,
+        timeout: int,
+        memory_limit: str,
+        cpu_limit: float,
+        execution_id: str,
+        prefix: str = "code_exec",
+        priority: int = 0,
+        cacheable: bool = False,
+    ) -> SandboxResult:
+        """Executes code on the least-loaded endpoint (see SandboxExecutor.run)."""
+        backend = self.pick(memory_limit, cpu_limit)
+        self._record_execution(backend)
+        try:
+            result = await backend.executor.run(
+                code,
+                timeout=timeout,
+                memory_limit=memory_limit,
+                cpu_limit=cpu_limit,
+                execution_id=execution_id,
+                prefix=prefix,
+                priority=priority,
+                cacheable=cacheable,
+            )
+        except _CONNECTION_ERRORS as e:
+            self._record_failure(backend, e)
+            raise
+        if not result.cached:
+            self._record_usage(backend, result.resources)
+        return result
+
+    async def stream(
+        self,
+        code: str,
+        timeout: int,
+        memory_limit: str,
+        cpu_limit: float,
+        execution_id: str,
+        prefix: str = "code_exec",
+        reservation: Optional[Reservation] = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streams execution events (see SandboxExecutor.stream).
+
+        A ``reservation`` from admit() pins the execution to the endpoint it
+        was reserved on.
+        """
+        backend = self.backend_for(reservation) or self.pick(memory_limit, cpu_limit)
+        self._record_execution(backend)
+        async for event in backend.executor.stream(
+            code,
+            timeout=timeout,
+            memory_limit=memory_limit,
+            cpu_limit=cpu_limit,
+            execution_id=execution_id,
+            prefix=prefix,
+            reservation=reservation,
+        ):
+            if event[0] == "exit":
+                self._record_usage(backend, event[1].get("resources"))
+            yield event
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": sum(1 for backend in self.backends if backend.healthy),
+            "total": len(self.backends),
+            "endpoints": [backend.stats() for backend in self.backends],
+        }
+
+    async def check_health(self) -> None:
+        """Pings every endpoint once and updates the rotation."""
+        await asyncio.gather(*(self._check(backend) for backend in self.backends))
+
+    async def _check(self, backend: DockerBackend) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            if backend.client is None:
+                await asyncio.wait_for(
+                    loop.run_in_executor(self._health_executor, backend.connect), self.health_timeout
+                )
+            await asyncio.wait_for(loop.run_in_executor(self._health_executor, backend.ping), self.health_timeout)
+        except Exception as e:
+            self._record_failure(backend, e if str(e) else type(e).__name__)
+            return
+
+        backend.failures = 0
+        if not backend.healthy:
+            backend.healthy = True
+            metrics.BACKEND_HEALTH_CHANGES.inc(backend=backend.name, healthy="true")
+            logger.info(f"Docker endpoint {backend.name} is healthy")
+        if backend.name not in self._started:
+            self._started.add(backend.name)
+            await backend.start()
+
+    def _record_failure(self, backend: DockerBackend, error) -> None:
+        backend.failures += 1
+        backend.last_error = str(error)
+        if backend.healthy and backend.failures >= self.failure_threshold:
+            backend.healthy = False
+            metrics.BACKEND_HEALTH_CHANGES.inc(backend=backend.name, healthy="false")
+            logger.error(f"Docker endpoint {backend.name} removed from rotation: {backend.last_error}")
+        elif backend.failures == 1:
+            logger.warning(f"Docker endpoint {backend.name} check failed: {backend.last_error}")
+
+    def _record_execution(self, backend: DockerBackend) -> None:
+        backend.executions += 1
+        metrics.BACKEND_EXECUTIONS.inc(backend=backend.name)
+
+    def _record_usage(self, backend: DockerBackend, resources: Optional[Dict[str, Any]]) -> None:
+        if not resources:
+            return
+        usage = backend.usage
+        if resources["peak_memory_bytes"] is not None and resources["memory_limit_bytes"]:
+            metrics.EXECUTION_MEMORY_RATIO.observe(
+                resources["peak_memory_bytes"] / resources["memory_limit_bytes"], backend=backend.name
+            )
+        for mode in ("user", "system"):
+            seconds = resources[f"cpu_{mode}_seconds"]
+            if seconds:
+                usage["cpu_seconds"] += seconds
+                metrics.EXECUTION_CPU_SECONDS.inc(seconds, backend=backend.name, mode=mode)
+        if resources["throttled_periods"]:
+            usage["throttled_periods"] += resources["throttled_periods"]
+            metrics.EXECUTION_THROTTLED_PERIODS.inc(resources["throttled_periods"], backend=backend.name)
+        if resources["oom_killed"]:
+            usage["oom_kills"] += 1
+            metrics.EXECUTION_OOM_KILLS.inc(backend=backend.name)
+        for stream in ("stdout", "stderr"):
+            usage["output_bytes"] += resources[f"{stream}_bytes"]
+            metrics.EXECUTION_OUTPUT_BYTES.inc(resources[f"{stream}_bytes"], backend=backend.name, stream=stream)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Docker health check failed: {str(e)}")
@@ -0,0 +1,175 @@
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*parts: Any) -> str:
+    """Builds a content-addressed cache key from the given parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def normalize_code(code: str) -> str:
+    """
+    Normalizes code so that formatting-only differences share a cache entry.
+
+    Line endings are unified and blank lines before the first and after the
+    last line of code are dropped. Everything else, including whitespace
+    inside lines, is kept, since it may be part of a string literal.
+    """
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return "\n".join(lines)
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry expiry.
+
+    Entries are evicted least-recently-used once ``max_size`` is exceeded and
+    expire ``ttl`` seconds after being stored. When ``path`` is given, entries
+    are also written through to a local SQLite file so they survive restarts;
+    values must therefore be JSON serializable.
+    """
+
+    def __init__(self, max_size: int, ttl: float, path: Optional[str] = None, name: str = "cache"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path or None
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if self.path:
+            self._open_db()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Looks up a cached value.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None if missing or expired
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._db_get(key)
+                if entry is not None:
+                    self._entries[key] = entry
+            if entry is not None and entry[0] <= now:
+                self._entries.pop(key, None)
+                self._db_delete(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        """Stores a value, evicting the least recently used entries if needed."""
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._db_delete(evicted)
+            self._db_put(key, expires_at, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and current size."""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "persistent": self._db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _open_db(self) -> None:
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, expires_at REAL, value TEXT)"
+            )
+            self._db.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open {self.name} store at {self.path}: {str(e)}")
+            self._db = None
+
+    def _db_get(self, key: str) -> Optional[Tuple[float, Any]]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT expires_at, value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read {self.name} store: {str(e)}")
+            return None
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _db_put(self, key: str, expires_at: float, value: Any) -> None:
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, json.dumps(value)),
+            )
+            self._db.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.error(f"Failed to write {self.name} store: {str(e)}")
+
+    def _db_delete(self, key: str) -> None:
+        if self._db is None:
+            return
+        try:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to delete from {self.name} store: {str(e)}")
@@ -1,166 +1,473 @@
 import os
 import json
-from typing import Dict, Any, Tuple, Optional
-import httpx
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, Any, Awaitable, Callable, List, Tuple, Optional
 import logging
 import re
 
+from services import llm_client, metrics, static_analysis
+from services.cache import TTLCache, make_key, normalize_code
+from services.json_stream import JSONFieldParser
+from services.resilience import ResilientCaller
+
 logger = logging.getLogger(__name__)
 
 # Get API key from environment variable
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
 API_TIMEOUT = int(os.getenv("API_TIMEOUT", "30"))
 
-async def generate_and_validate_code(query: str) -> Tuple[str, bool, str]:
+TOGETHER_API_URL = os.getenv("TOGETHER_API_URL", "https://api.together.xyz/v1/chat/completions")
+TOGETHER_MODEL = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
+# Model that generates (and self-validates) code for queries
+GENERATION_MODEL = os.getenv("GENERATION_MODEL", TOGETHER_MODEL)
+
+GENERATION_TEMPERATURE = 0.3
+VALIDATION_TEMPERATURE = 0.2
+
+# Bump whenever a prompt changes so cached results are invalidated
+GENERATION_PROMPT_VERSION = "1"
+VALIDATION_PROMPT_VERSION = "3"
+
+# Stream completions so rejections can stop generation early
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() in ("1", "true", "yes")
+# Per-call budgets: completion tokens and total seconds
+GENERATION_MAX_TOKENS = int(os.getenv("GENERATION_MAX_TOKENS", "2048"))
+VALIDATION_MAX_TOKENS = int(os.getenv("VALIDATION_MAX_TOKENS", "2048"))
+LLM_TIME_BUDGET = float(os.getenv("LLM_TIME_BUDGET", str(API_TIMEOUT)))
+
+# Validator cascade as a JSON list of tiers, cheapest first, e.g.
+# [{"name": "fast", "model": "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo", "prompt": "verdict",
+#   "max_tokens": 128, "timeout": 5, "min_confidence": 0.85}, {"name": "large"}]
+# (unset: a single tier using TOGETHER_MODEL)
+VALIDATION_TIERS = os.getenv("VALIDATION_TIERS", "")
+VALIDATION_PROMPTS = ("review", "verdict")
+
+# How validation decides when Together AI gives no verdict (error, open circuit, unusable reply):
+# "static" trusts the local static analysis and rejects code it cannot clear,
+# "reject" rejects the code, "allow" runs the original code unvalidated
+VALIDATION_FALLBACK_POLICY = os.getenv("VALIDATION_FALLBACK_POLICY", "static").lower()
+VALIDATION_FALLBACK_POLICIES = ("static", "reject", "allow")
+if VALIDATION_FALLBACK_POLICY not in VALIDATION_FALLBACK_POLICIES:
+    raise ValueError(f"VALIDATION_FALLBACK_POLICY must be one of {', '.join(VALIDATION_FALLBACK_POLICIES)}")
+
+# Decide clearly safe/unsafe code locally before asking the LLM
+STATIC_PRESCREEN_ENABLED = os.getenv("STATIC_PRESCREEN_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Cache of validation verdicts keyed by normalized code, validator cascade and prompt version
+validation_cache = TTLCache(
+    max_size=int(os.getenv("VALIDATION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("VALIDATION_CACHE_TTL", "3600")),
+    path=os.getenv("VALIDATION_CACHE_PATH"),
+    name="validation cache",
+)
+
+# Cache of generated code keyed by normalized query, model and temperature
+generation_cache = TTLCache(
+    max_size=int(os.getenv("GENERATION_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("GENERATION_CACHE_TTL", "3600")),
+    name="generation cache",
+)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight request.
+    
+    The first caller starts the work as a task; callers arriving while it is
+    still running await the same task and share its result. The task is
+    shielded, so a cancelled caller does not cancel the work for the others.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0
+        self.coalesced = 0
+        self._calls: Dict[str, asyncio.Task] = {}
+    
+    async def do(self, key: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.executed += 1
+        else:
+            logger.info(f"Coalescing {self.name} call with in-flight request")
+            self.coalesced += 1
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+        }
+
+# Concurrent identical LLM calls share one Together AI request
+generation_flights = SingleFlight("generation")
+validation_flights = SingleFlight("validation")
+
+# Hedging, retries and per-model circuit breakers for every Together AI call
+llm_calls = ResilientCaller("Together AI")
+
+@dataclass
+class ValidatorTier:
+    """One step of the validation cascade and its counters."""
+    name: str
+    model: str = TOGETHER_MODEL
+    prompt: str = "review"  # "review" (verdict and improved code) or "verdict" (verdict only)
+    max_tokens: int = VALIDATION_MAX_TOKENS
+    timeout: float = LLM_TIME_BUDGET
+    # Safe verdicts below this confidence are escalated (ignored on the last tier)
+    min_confidence: float = 0.8
+    calls: int = field(default=0, compare=False)
+    decided: int = field(default=0, compare=False)
+    escalated: Dict[str, int] = field(default_factory=dict, compare=False)
+    seconds: float = field(default=0.0, compare=False)
+    tokens: int = field(default=0, compare=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "prompt": self.prompt,
+            "calls": self.calls,
+            "decided": self.decided,
+            "hit_rate": self.decided / self.calls if self.calls else 0.0,
+            "escalated": dict(self.escalated),
+            "latency_avg": self.seconds / self.calls if self.calls else 0.0,
+            "completion_tokens": self.tokens,
+        }
+
+def parse_validation_tiers(spec: str) -> List[ValidatorTier]:
+    """
+    Parses the VALIDATION_TIERS JSON list.
+    
+    Args:
+        spec: JSON list of objects with optional ``name``, ``model``,
+            ``prompt``, ``max_tokens``, ``timeout`` and ``min_confidence``
+    
+    Returns:
+        Tiers in escalation order; a single TOGETHER_MODEL tier if ``spec`` is empty
+    
+    Raises:
+        ValueError: If the spec is not a list of tier objects
+    """
+    if not spec.strip():
+        return [ValidatorTier(name="default")]
+    items = json.loads(spec)
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise ValueError("VALIDATION_TIERS must be a non-empty JSON list of objects")
+    tiers = []
+    for index, item in enumerate(items):
+        tier = ValidatorTier(name=str(item.get("name") or f"tier-{index}"))
+        tier.model = item.get("model", tier.model)
+        tier.prompt = item.get("prompt", tier.prompt)
+        tier.max_tokens = int(item.get("max_tokens", tier.max_tokens))
+        tier.timeout = float(item.get("timeout", tier.timeout))
+        tier.min_confidence = float(item.get("min_confidence", tier.min_confidence))
+        if tier.prompt not in VALIDATION_PROMPTS:
+            raise ValueError(f"Unknown validation prompt '{tier.prompt}' for tier {tier.name}")
+        tiers.append(tier)
+    return tiers
+
+# Validators tried in order until one is confident; the last one always decides
+validation_tiers = parse_validation_tiers(VALIDATION_TIERS)
+
+def _cascade_signature() -> str:
+    """Identifies the cascade in validation cache keys, so changing tiers invalidates verdicts."""
+    return ";".join(f"{t.model}:{t.prompt}:{t.min_confidence}" for t in validation_tiers)
+
+def validation_tier_stats() -> List[Dict[str, Any]]:
+    """Returns per-tier call counts, hit rates, escalations, latency and token spend."""
+    return [tier.stats() for tier in validation_tiers]
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query so trivial variants share a generation cache entry.
+    
+    Case and runs of whitespace are ignored, as is trailing punctuation.
+    """
+    return " ".join(query.casefold().split()).rstrip(".!?;: ")
+
+async def generate_and_validate_code(query: str, bypass_cache: bool = False) -> Tuple[str, bool, str, bool]:
     """
     Generates and validates Python code from a user query.
     
     This uses a unified approach to generate and validate in a single API call.
+    Results are cached by normalized query, model and temperature, so repeated
+    queries skip the Together AI call.
     
     Args:
         query: The user query describing what the code should do
+        bypass_cache: Always call the model (the fresh result is still cached)
         
     Returns:
         Tuple containing:
         - generated_code: The generated Python code
         - is_safe: Boolean indicating if the code is safe to execute
         - explanation: Explanation of what the code does and any potential issues
+        - cached: Whether the result was served from the generation cache
     """
     if not TOGETHER_API_KEY:
         logger.warning("TOGETHER_API_KEY not set, skipping code generation")
-        return None, False, "API key not configured"
+        return None, False, "API key not configured", False
+    
+    cache_key = make_key(
+        normalize_query(query), GENERATION_MODEL, GENERATION_TEMPERATURE, GENERATION_PROMPT_VERSION
+    )
+    if not bypass_cache:
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Generation cache hit")
+            generated_code, is_safe, explanation = cached
+            return generated_code, is_safe, explanation, True
+    
+    with metrics.stage("llm_generation"):
+        generated_code, is_safe, explanation, cacheable = await generation_flights.do(
+            cache_key, _request_generation, query
+        )
+    if generated_code and is_safe and STATIC_PRESCREEN_ENABLED:
+        # The model's verdict never overrides a local rejection
+        with metrics.stage("static_analysis"):
+            verdict, reason = static_analysis.analyze_code(generated_code)
+        if verdict == static_analysis.UNSAFE:
+            is_safe, explanation = False, reason
+    if cacheable and generated_code:
+        generation_cache.set(cache_key, [generated_code, is_safe, explanation])
+    return generated_code, is_safe, explanation, False
+
+class LLMBudgetExceeded(Exception):
+    """Raised when a Together AI call exceeds its token or time budget."""
+
+def _headers() -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {TOGETHER_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+async def _complete_json(
+    call: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    should_stop: Callable[[Dict[str, Any], str], Optional[str]],
+    model: str = TOGETHER_MODEL,
+    time_budget: float = LLM_TIME_BUDGET,
+    usage: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, JSONFieldParser, Optional[str]]:
+    """
+    Streams a Together AI completion through an incremental JSON parser.
+    
+    ``should_stop`` is called with the parsed fields each time a top-level
+    field closes; returning a reason aborts the stream, which stops
+    generation upstream. The call is bounded by ``max_tokens`` (also sent to
+    the API) and ``time_budget`` seconds, which covers retries and hedged
+    duplicates (see ResilientCaller). Token usage reported by the API is
+    copied into ``usage``; for a stream that ends without it, the chunk
+    count stands in for ``completion_tokens``.
+    
+    Returns:
+        Tuple of (content received so far, parser, stop reason or None)
+    
+    Raises:
+        LLMBudgetExceeded: If the token or time budget runs out first
+        CircuitOpenError: If the model's circuit breaker is open
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": LLM_STREAMING,
+        "timeout": API_TIMEOUT
+    }
+    
+    async def attempt() -> Tuple[str, JSONFieldParser, Optional[str], Dict[str, Any]]:
+        # Each attempt (retry or hedge) parses its own response
+        parser = JSONFieldParser()
+        content: List[str] = []
+        attempt_usage: Dict[str, Any] = {}
+        chunks = llm_client.stream_chat(
+            TOGETHER_API_URL, _headers(), payload, llm_client.request_timeout(API_TIMEOUT), usage=attempt_usage
+        )
+        stop_reason = None
+        try:
+            async for chunk in chunks:
+                content.append(chunk)
+                for name in parser.feed(chunk):
+                    stop_reason = should_stop(parser.fields, name)
+                    if stop_reason:
+                        break
+                if stop_reason:
+                    break
+                # Streamed chunks are roughly one token each
+                if LLM_STREAMING and len(content) > max_tokens:
+                    metrics.LLM_BUDGET_EXCEEDED.inc(call=call, budget="tokens")
+                    raise LLMBudgetExceeded(f"Token budget of {max_tokens} exceeded")
+        finally:
+            await chunks.aclose()
+            # A stream abandoned early never gets the server's usage figures
+            if LLM_STREAMING and "completion_tokens" not in attempt_usage:
+                attempt_usage["completion_tokens"] = len(content)
+        return "".join(content), parser, stop_reason, attempt_usage
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.together.xyz/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {TOGETHER_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": (
-                                "You are an expert Python programmer that generates secure, "
-                                "well-commented Python code based on user queries. "
-                                "Generate working Python code that satisfies the user's request, "
-                                "but first analyze it for security and efficiency. "
-                                "VERY IMPORTANT: YOUR RESPONSE MUST BE VALID JSON in this format:\n"
-                                "{\n"
-                                "  \"generated_code\": \"FULL_PYTHON_CODE_HERE\",\n"
-                                "  \"is_safe\": true_or_false,\n"
-                                "  \"explanation\": \"brief explanation of the code and any security considerations\"\n"
-                                "}\n\n"
-                                "Do not include any explanatory text, headers, or markdown formatting outside of the JSON object."
-                            )
-                        },
-                        {
-                            "role": "user",
-                            "content": (
-                                f"Write Python code to: {query}\n\n"
-                                "Keep in mind that this code will run in a restricted Docker environment with:\n"
-                                "- No network access\n"
-                                "- No file system access beyond current directory\n"
-                                "- Limited CPU and memory\n"
-                                "- Execution timeout\n"
-                                "- No sudo/admin privileges\n"
-                                "- No access to system resources"
-                            )
-                        }
-                    ],
-                    "temperature": 0.3,
-                    "timeout": API_TIMEOUT
-                },
-                timeout=API_TIMEOUT
+        content, parser, stop_reason, attempt_usage = await llm_calls.call(call, model, attempt, time_budget)
+    except asyncio.TimeoutError:
+        metrics.LLM_BUDGET_EXCEEDED.inc(call=call, budget="time")
+        raise LLMBudgetExceeded(f"Time budget of {time_budget:g}s exceeded")
+    if usage is not None:
+        usage.update(attempt_usage)
+    if stop_reason:
+        metrics.LLM_EARLY_ABORTS.inc(call=call, reason=stop_reason)
+        logger.info(f"Stopped {call} stream early: {stop_reason}")
+    return content, parser, stop_reason
+
+def _extract_json(content: str, parser: JSONFieldParser) -> Optional[Dict[str, Any]]:
+    """Returns the response object, or None if the content is not JSON."""
+    if parser.complete:
+        return parser.fields
+    # Find JSON in the content if it's wrapped in text
+    json_start = content.find('{')
+    json_end = content.rfind('}') + 1
+    if json_start >= 0 and json_end > 0:
+        try:
+            return json.loads(content[json_start:json_end])
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse JSON from Together AI response: {content}")
+    else:
+        logger.warning("Could not find JSON in Together AI response")
+    return None
+
+def _extract_code_block(content: str) -> Optional[str]:
+    """Extracts code from a markdown ```python block, if there is one."""
+    if "```python" in content:
+        start = content.find("```python") + len("```python")
+        end = content.rfind("```")
+        if start > 0 and end > start:
+            return content[start:end].strip()
+    return None
+
+def _generation_messages(query: str) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are an expert Python programmer that generates secure, "
+                "well-commented Python code based on user queries. "
+                "Generate working Python code that satisfies the user's request, "
+                "but first analyze it for security and efficiency. "
+                "VERY IMPORTANT: YOUR RESPONSE MUST BE VALID JSON in this format:\n"
+                "{\n"
+                "  \"generated_code\": \"FULL_PYTHON_CODE_HERE\",\n"
+                "  \"is_safe\": true_or_false,\n"
+                "  \"explanation\": \"brief explanation of the code and any security considerations\"\n"
+                "}\n\n"
+                "Do not include any explanatory text, headers, or markdown formatting outside of the JSON object."
             )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            # Extract the content from the response
-            content = result["choices"][0]["message"]["content"]
-            
-            # Parse the JSON from the content
-            try:
-                # Find JSON in the content if it's wrapped in text
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start >= 0 and json_end > 0:
-                    json_str = content[json_start:json_end]
-                    generation_result = json.loads(json_str)
-                else:
-                    # Fallback if no JSON found
-                    logger.warning("Could not find JSON in Together AI response")
-                    
-                    # Extract code from any markdown code blocks if available
-                    if "```python" in content:
-                        start = content.find("```python") + len("```python")
-                        end = content.rfind("```")
-                        if start > 0 and end > start:
-                            extracted_code = content[start:end].strip()
-                            # Simple heuristic: if the code looks safe (no imports of concerning modules)
-                            is_safe = all(unsafe_import not in extracted_code.lower() 
-                                         for unsafe_import in ["import os", "import subprocess", "import socket"])
-                            return extracted_code, is_safe, "Response was not properly formatted as JSON, but code was extracted"
-                    
-                    # If we couldn't extract code from a code block, try to find imports and def statements
-                    import_pattern = r"import [a-zA-Z0-9_]+"
-                    def_pattern = r"def [a-zA-Z0-9_]+\("
-                    
-                    if re.search(import_pattern, content) and re.search(def_pattern, content):
-                        # Treat the entire content as code - risky but better than nothing
-                        logger.warning("Treating entire response as code")
-                        is_safe = all(unsafe_import not in content.lower() 
-                                     for unsafe_import in ["import os", "import subprocess", "import socket"])
-                        return content, is_safe, "Treating entire response as code (no JSON structure found)"
-                    
-                    logger.error("Could not extract code from response")
-                    return None, False, "Failed to generate code: Could not parse response"
-                
-                return (
-                    generation_result.get("generated_code", None),
-                    generation_result.get("is_safe", False),
-                    generation_result.get("explanation", "No explanation provided")
-                )
-            except json.JSONDecodeError:
-                logger.error(f"Failed to parse JSON from Together AI response: {content}")
-                
-                # Extract code from any markdown code blocks if available
-                if "```python" in content:
-                    start = content.find("```python") + len("```python")
-                    end = content.rfind("```")
-                    if start > 0 and end > start:
-                        extracted_code = content[start:end].strip()
-                        # Simple heuristic: if the code looks safe (no imports of concerning modules)
-                        is_safe = all(unsafe_import not in extracted_code.lower() 
-                                     for unsafe_import in ["import os", "import subprocess", "import socket"])
-                        return extracted_code, is_safe, "Response was not properly formatted as JSON, but code was extracted"
-                
-                # If we couldn't extract code from a code block, try to find imports and def statements
-                import_pattern = r"import [a-zA-Z0-9_]+"
-                def_pattern = r"def [a-zA-Z0-9_]+\("
-                
-                if re.search(import_pattern, content) and re.search(def_pattern, content):
-                    # Treat the entire content as code - risky but better than nothing
-                    logger.warning("Treating entire response as code")
-                    is_safe = all(unsafe_import not in content.lower() 
-                                 for unsafe_import in ["import os", "import subprocess", "import socket"])
-                    return content, is_safe, "Treating entire response as code (no JSON structure found)"
-                
-                logger.error("Could not extract code from response")
-                return None, False, "Failed to generate code: Could not parse response"
-                
+        },
+        {
+            "role": "user",
+            "content": (
+                f"Write Python code to: {query}\n\n"
+                "Keep in mind that this code will run in a restricted Docker environment with:\n"
+                "- No network access\n"
+                "- No file system access beyond current directory\n"
+                "- Limited CPU and memory\n"
+                "- Execution timeout\n"
+                "- No sudo/admin privileges\n"
+                "- No access to system resources"
+            )
+        }
+    ]
+
+async def _request_generation(query: str) -> Tuple[str, bool, str, bool]:
+    """
+    Asks Together AI to generate and validate code for a query.
+    
+    The response is streamed: local static analysis runs as soon as the
+    ``generated_code`` field closes, and the stream is abandoned once either
+    the local check or the model's ``is_safe`` rejects the code.
+    
+    Returns the same values as generate_and_validate_code, with the last
+    element indicating whether the result came from a structured response and
+    may be cached.
+    """
+    local = {}
+    
+    def should_stop(fields: Dict[str, Any], name: str) -> Optional[str]:
+        if name == "is_safe" and fields["is_safe"] is False:
+            return "model_unsafe"
+        if name == "generated_code" and STATIC_PRESCREEN_ENABLED and isinstance(fields[name], str):
+            with metrics.stage("static_analysis"):
+                local["verdict"], local["reason"] = static_analysis.analyze_code(fields[name])
+            if local["verdict"] == static_analysis.UNSAFE:
+                return "static_unsafe"
+        return None
+    
+    try:
+        content, parser, stop_reason = await _complete_json(
+            "generation", _generation_messages(query), GENERATION_TEMPERATURE, GENERATION_MAX_TOKENS, should_stop,
+            model=GENERATION_MODEL,
+        )
     except Exception as e:
         logger.error(f"Error generating code with Together AI: {str(e)}")
-        return None, False, f"Generation error: {str(e)}"
+        return None, False, f"Generation error: {str(e)}", False
+    
+    fields = parser.fields
+    if stop_reason == "static_unsafe":
+        return fields["generated_code"], False, local["reason"], True
+    if stop_reason == "model_unsafe":
+        explanation = fields.get("explanation", "Model marked the generated code unsafe")
+        return fields.get("generated_code"), False, explanation, True
+    
+    generation_result = _extract_json(content, parser)
+    if generation_result is not None:
+        return (
+            generation_result.get("generated_code", None),
+            generation_result.get("is_safe", False),
+            generation_result.get("explanation", "No explanation provided"),
+            True
+        )
+    
+    metrics.LLM_PARSE_FALLBACKS.inc(call="generation")
+    
+    # Extract code from any markdown code blocks if available
+    extracted_code = _extract_code_block(content)
+    if extracted_code:
+        # No model verdict available: only code the local analysis clears is safe, and it is not cached
+        is_safe = static_analysis.analyze_code(extracted_code)[0] == static_analysis.SAFE
+        return extracted_code, is_safe, "Response was not properly formatted as JSON, but code was extracted", False
+    
+    # If we couldn't extract code from a code block, try to find imports and def statements
+    import_pattern = r"import [a-zA-Z0-9_]+"
+    def_pattern = r"def [a-zA-Z0-9_]+\("
+    
+    if re.search(import_pattern, content) and re.search(def_pattern, content):
+        # Treat the entire content as code - risky but better than nothing
+        logger.warning("Treating entire response as code")
+        is_safe = static_analysis.analyze_code(content)[0] == static_analysis.SAFE
+        return content, is_safe, "Treating entire response as code (no JSON structure found)", False
+    
+    logger.error("Could not extract code from response")
+    return None, False, "Failed to generate code: Could not parse response", False
 
-async def validate_existing_code(code: str) -> Tuple[str, bool, str]:
+async def validate_existing_code(code: str) -> Tuple[str, bool, str, bool]:
     """
     Validates and potentially improves existing Python code.
     
+    Code is first classified by a local AST pre-screen; clearly safe or
+    clearly unsafe code is decided without any network call. The rest goes
+    through the validator cascade (see VALIDATION_TIERS). Verdicts are cached
+    by a hash of the normalized code, the cascade and the prompt version, so
+    resubmitting the same snippet skips the Together AI calls.
+    
     Args:
         code: The Python code to validate
         
@@ -169,101 +476,213 @@ async def validate_existing_code(code: str) -> Tuple[str, bool, str]:
         - validated_code: The validated and potentially improved code
         - is_safe: Boolean indicating if the code is safe to execute
         - explanation: Explanation of issues found or improvements made
+        - cached: Whether the verdict was served from the validation cache
     """
+    if STATIC_PRESCREEN_ENABLED:
+        with metrics.stage("static_analysis"):
+            verdict, reason = static_analysis.analyze_code(code)
+        if verdict == static_analysis.SAFE:
+            return code, True, reason, False
+        if verdict == static_analysis.UNSAFE:
+            return code, False, reason, False
+    
     if not TOGETHER_API_KEY:
         logger.warning("TOGETHER_API_KEY not set, skipping code validation")
-        return code, True, "Validation skipped: API key not configured"
+        return code, True, "Validation skipped: API key not configured", False
+    
+    cache_key = make_key(normalize_code(code), _cascade_signature(), VALIDATION_PROMPT_VERSION)
+    cached = validation_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Validation cache hit")
+        validated_code, is_safe, explanation = cached
+        return _own_code(code, validated_code), is_safe, explanation, True
+    
+    with metrics.stage("llm_validation"):
+        validated_code, is_safe, explanation, cacheable = await validation_flights.do(
+            cache_key, _validate_cascade, code
+        )
+    if cacheable:
+        validation_cache.set(cache_key, [validated_code, is_safe, explanation])
+    return _own_code(code, validated_code), is_safe, explanation, False
+
+def _own_code(code: str, validated_code: str) -> str:
+    """
+    Returns the caller's code when the verdict left it unchanged.
+    
+    Cached and coalesced verdicts carry the text of whichever submission
+    produced them, which may differ from this one in line endings or
+    surrounding blank lines.
+    """
+    if validated_code is not None and normalize_code(validated_code) == normalize_code(code):
+        return code
+    return validated_code
+
+class _Escalate(Exception):
+    """Raised by a validator tier that cannot decide on its own."""
+    
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+async def _validate_cascade(code: str) -> Tuple[str, bool, str, bool]:
+    """
+    Asks the validator tiers in order until one reaches a verdict.
     
+    A tier other than the last decides only when it finds the code safe with
+    at least its ``min_confidence``. Unsafe verdicts, low confidence, errors
+    and unparseable responses go to the next tier, so a cheap tier can only
+    settle the common, clearly safe case and the last tier decides the rest.
+    
+    Returns the same values as _request_validation.
+    """
+    for index, tier in enumerate(validation_tiers):
+        final = index == len(validation_tiers) - 1
+        try:
+            result = await _request_validation(code, tier, final)
+        except _Escalate as e:
+            tier.escalated[e.reason] = tier.escalated.get(e.reason, 0) + 1
+            metrics.VALIDATION_TIER_OUTCOMES.inc(tier=tier.name, outcome=e.reason)
+            logger.info(f"Validation tier {tier.name} escalated: {e.reason}")
+            continue
+        tier.decided += 1
+        metrics.VALIDATION_TIER_OUTCOMES.inc(tier=tier.name, outcome="decided")
+        return result
+    # Unreachable: the last tier never escalates
+    raise RuntimeError("Validation cascade ended without a verdict")
+
+def _confidence(result: Dict[str, Any]) -> float:
+    """Returns the model's confidence in [0, 1]; missing or invalid counts as 0."""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.together.xyz/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {TOGETHER_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": (
-                                "You are an expert Python security analyst. "
-                                "Analyze the given Python code for security issues, and either validate it or improve it. "
-                                "VERY IMPORTANT: YOUR RESPONSE MUST BE VALID JSON in this format:\n"
-                                "{\n"
-                                "  \"validated_code\": \"FULL_PYTHON_CODE_HERE\",\n"
-                                "  \"is_safe\": true_or_false,\n"
-                                "  \"explanation\": \"brief explanation of issues/improvements\"\n"
-                                "}\n\n"
-                                "Do not include any explanatory text, headers, or markdown formatting outside of the JSON object."
-                            )
-                        },
-                        {
-                            "role": "user",
-                            "content": f"Review this Python code:\n```python\n{code}\n```"
-                        }
-                    ],
-                    "temperature": 0.2,
-                    "timeout": API_TIMEOUT
-                },
-                timeout=API_TIMEOUT
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            # Extract the content from the response
-            content = result["choices"][0]["message"]["content"]
-            
-            # Parse the JSON from the content
-            try:
-                # Find JSON in the content if it's wrapped in text
-                json_start = content.find('{')
-                json_end = content.rfind('}') + 1
-                if json_start >= 0 and json_end > 0:
-                    json_str = content[json_start:json_end]
-                    validation_result = json.loads(json_str)
-                else:
-                    # Fallback if no JSON found
-                    logger.warning("Could not find JSON in Together AI response")
-                    
-                    # Extract validated code from any markdown code blocks if available
-                    if "```python" in content:
-                        start = content.find("```python") + len("```python")
-                        end = content.rfind("```")
-                        if start > 0 and end > start:
-                            extracted_code = content[start:end].strip()
-                            # Simple heuristic: if the code looks safe (no imports of concerning modules)
-                            is_safe = all(unsafe_import not in extracted_code.lower() 
-                                         for unsafe_import in ["import os", "import subprocess", "import socket"])
-                            return extracted_code, is_safe, "Validation response was not properly formatted as JSON, but code was extracted"
-                    
-                    # If we get here, we couldn't extract code properly
-                    return code, True, "Validation response parsing failed, using original code"
-                
-                return (
-                    validation_result.get("validated_code", code),
-                    validation_result.get("is_safe", False),
-                    validation_result.get("explanation", "No explanation provided")
-                )
-            except json.JSONDecodeError:
-                logger.error(f"Failed to parse JSON from Together AI response: {content}")
-                
-                # Extract validated code from any markdown code blocks if available
-                if "```python" in content:
-                    start = content.find("```python") + len("```python")
-                    end = content.rfind("```")
-                    if start > 0 and end > start:
-                        extracted_code = content[start:end].strip()
-                        # Simple heuristic: if the code looks safe (no imports of concerning modules)
-                        is_safe = all(unsafe_import not in extracted_code.lower() 
-                                     for unsafe_import in ["import os", "import subprocess", "import socket"])
-                        return extracted_code, is_safe, "Validation response was not properly formatted as JSON, but code was extracted"
-                
-                # If we couldn't extract code, use the original but warn
-                return code, True, "Using original code: JSON parsing failed"
-                
+        return min(max(float(result.get("confidence")), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+_REVIEW_SYSTEM_PROMPT = (
+    "You are an expert Python security analyst. "
+    "Analyze the given Python code for security issues, and either validate it or improve it. "
+    "VERY IMPORTANT: YOUR RESPONSE MUST BE VALID JSON in this format:\n"
+    "{\n"
+    "  \"explanation\": \"brief explanation of issues/improvements\",\n"
+    "  \"is_safe\": true_or_false,\n"
+    "  \"confidence\": number_from_0_to_1,\n"
+    "  \"validated_code\": \"FULL_PYTHON_CODE_HERE\"\n"
+    "}\n\n"
+    "Do not include any explanatory text, headers, or markdown formatting outside of the JSON object."
+)
+
+_VERDICT_SYSTEM_PROMPT = (
+    "You are an expert Python security analyst. "
+    "Decide whether the given Python code is safe to run in a sandbox with no network access, "
+    "a read-only filesystem and limited CPU and memory. Do not rewrite the code. "
+    "VERY IMPORTANT: YOUR RESPONSE MUST BE VALID JSON in this format:\n"
+    "{\n"
+    "  \"is_safe\": true_or_false,\n"
+    "  \"confidence\": number_from_0_to_1,\n"
+    "  \"explanation\": \"one sentence\"\n"
+    "}\n\n"
+    "Do not include any explanatory text, headers, or markdown formatting outside of the JSON object."
+)
+
+def _validation_messages(code: str, prompt: str = "review") -> List[Dict[str, str]]:
+    # The verdict comes before the code so a rejection can end the stream early
+    return [
+        {
+            "role": "system",
+            "content": _VERDICT_SYSTEM_PROMPT if prompt == "verdict" else _REVIEW_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Review this Python code:\n```python\n{code}\n```"
+        }
+    ]
+
+async def _request_validation(code: str, tier: ValidatorTier, final: bool = True) -> Tuple[str, bool, str, bool]:
+    """
+    Sends code to one validator tier.
+    
+    The response is streamed and abandoned as soon as ``is_safe`` is false,
+    so rejected code does not cost a full rewritten copy in tokens.
+    
+    Returns the same values as validate_existing_code, with the last element
+    indicating whether the verdict came from a usable model response and may
+    be cached. Verdicts that did not come from the model are never cached.
+    
+    Raises:
+        _Escalate: If ``final`` is false and the tier is not confident the code is safe
+    """
+    def should_stop(fields: Dict[str, Any], name: str) -> Optional[str]:
+        if name == "is_safe" and fields["is_safe"] is False:
+            return "model_unsafe"
+        return None
+    
+    tier.calls += 1
+    usage: Dict[str, Any] = {}
+    started = time.perf_counter()
+    try:
+        content, parser, stop_reason = await _complete_json(
+            "validation", _validation_messages(code, tier.prompt), VALIDATION_TEMPERATURE, tier.max_tokens,
+            should_stop, model=tier.model, time_budget=tier.timeout, usage=usage,
+        )
     except Exception as e:
-        logger.error(f"Error validating code with Together AI: {str(e)}")
-        return code, True, f"Validation error: {str(e)} - using original code" 
\ No newline at end of file
+        logger.error(f"Error validating code with Together AI ({tier.name}): {str(e)}")
+        if not final:
+            raise _Escalate("error")
+        return _fallback_verdict(code, f"Validation error: {str(e)}")
+    finally:
+        elapsed = time.perf_counter() - started
+        tier.seconds += elapsed
+        tier.tokens += int(usage.get("completion_tokens") or 0)
+        metrics.VALIDATION_TIER_SECONDS.observe(elapsed, tier=tier.name)
+        metrics.VALIDATION_TIER_TOKENS.inc(int(usage.get("completion_tokens") or 0), tier=tier.name)
+    
+    if stop_reason == "model_unsafe":
+        if not final:
+            raise _Escalate("flagged")
+        return code, False, parser.fields.get("explanation", "Model marked the code unsafe"), True
+    
+    validation_result = _extract_json(content, parser)
+    if validation_result is not None:
+        is_safe = validation_result.get("is_safe", False)
+        if not final:
+            if is_safe is not True:
+                raise _Escalate("flagged")
+            if _confidence(validation_result) < tier.min_confidence:
+                raise _Escalate("low_confidence")
+        return (
+            validation_result.get("validated_code", code),
+            is_safe,
+            validation_result.get("explanation", "No explanation provided"),
+            True
+        )
+    
+    metrics.LLM_PARSE_FALLBACKS.inc(call="validation")
+    if not final:
+        raise _Escalate("unparsed")
+    
+    # Extract validated code from any markdown code blocks if available
+    extracted_code = _extract_code_block(content)
+    if extracted_code:
+        # No model verdict available
+        return _fallback_verdict(
+            extracted_code, "Validation response was not properly formatted as JSON, but code was extracted"
+        )
+    
+    return _fallback_verdict(code, "Validation response parsing failed")
+
+def _fallback_verdict(code: str, reason: str) -> Tuple[str, bool, str, bool]:
+    """
+    Decides without a model verdict, following VALIDATION_FALLBACK_POLICY.
+    
+    Fallback verdicts are never cached, so the code is validated again once
+    Together AI answers.
+    """
+    metrics.VALIDATION_FALLBACKS.inc(policy=VALIDATION_FALLBACK_POLICY)
+    if VALIDATION_FALLBACK_POLICY == "allow":
+        return code, True, f"{reason} - using original code", False
+    if VALIDATION_FALLBACK_POLICY == "static":
+        verdict, detail = static_analysis.analyze_code(code)
+        if verdict == static_analysis.SAFE:
+            return code, True, f"{reason} - {detail}", False
+        if verdict == static_analysis.UNSAFE:
+            return code, False, f"{reason} - {detail}", False
+    return code, False, f"{reason} - code rejected until it can be validated", False
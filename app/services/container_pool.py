@@ -0,0 +1,261 @@
+import os
+import time
+import asyncio
+import tempfile
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from services.sandbox import (
+    CODE_DELIVERY,
+    container_options,
+    remove_container,
+    remove_temp_dir,
+    track_resource,
+)
+
+logger = logging.getLogger(__name__)
+
+# Number of idle containers kept per bucket (0 disables the pool)
+POOL_SIZE = int(os.getenv("CONTAINER_POOL_SIZE", "4"))
+# Comma separated "memory_limit:cpu_limit" pairs to keep warm
+POOL_BUCKETS = os.getenv("CONTAINER_POOL_BUCKETS", "100m:0.5")
+# Idle containers older than this (seconds) are recycled
+POOL_MAX_IDLE_AGE = float(os.getenv("CONTAINER_POOL_MAX_IDLE_AGE", "300"))
+
+Bucket = Tuple[str, float]
+
+
+def bucket_key(memory_limit: str, cpu_limit: float) -> Bucket:
+    """Normalizes resource limits into a pool bucket key."""
+    return (str(memory_limit).strip().lower(), float(cpu_limit))
+
+
+def parse_buckets(spec: str) -> List[Bucket]:
+    """
+    Parses a bucket specification such as ``"100m:0.5,200m:1"``.
+
+    Args:
+        spec: Comma separated ``memory_limit:cpu_limit`` pairs
+
+    Returns:
+        List of normalized bucket keys
+    """
+    buckets = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        memory_limit, _, cpu_limit = item.partition(":")
+        buckets.append(bucket_key(memory_limit, cpu_limit or "0.5"))
+    return buckets
+
+
+@dataclass
+class PooledContainer:
+    """A created-but-not-started sandbox container and its code directory."""
+    container: Any
+    code_dir: Optional[str]  # None when code is delivered on stdin
+    bucket: Bucket
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class ContainerPool:
+    """
+    Keeps pre-created sandbox containers ready for execution.
+
+    Containers are created (not started) ready to receive code, either on
+    stdin or through an already bind-mounted code directory, so a request
+    only has to start the container and deliver its code. Each container is
+    used once; after a run it is destroyed and a replacement is created in
+    the background.
+    """
+
+    def __init__(
+        self,
+        docker_client,
+        size: int = POOL_SIZE,
+        buckets: Optional[List[Bucket]] = None,
+        max_idle_age: float = POOL_MAX_IDLE_AGE,
+    ):
+        self.docker_client = docker_client
+        self.size = size
+        self.buckets = buckets if buckets is not None else parse_buckets(POOL_BUCKETS)
+        self.max_idle_age = max_idle_age
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self._idle: Dict[Bucket, Deque[PooledContainer]] = {b: deque() for b in self.buckets}
+        self._pending: Dict[Bucket, int] = {b: 0 for b in self.buckets}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="container-pool")
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and bool(self.buckets)
+
+    async def start(self) -> None:
+        """Fills every bucket and starts the idle-age maintenance loop."""
+        if not self.enabled:
+            logger.info("Container pool disabled")
+            return
+        logger.info(f"Warming container pool: {self.size} per bucket {self.buckets}")
+        for bucket in self.buckets:
+            self._schedule_refill(bucket)
+        self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+
+    async def stop(self) -> None:
+        """Stops maintenance and destroys all idle containers."""
+        self._closed = True
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+        with self._lock:
+            leftovers = [item for queue in self._idle.values() for item in queue]
+            for queue in self._idle.values():
+                queue.clear()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self._destroy, item) for item in leftovers),
+            return_exceptions=True,
+        )
+        self._executor.shutdown(wait=False)
+
+    def acquire(self, memory_limit: str, cpu_limit: float) -> Optional[PooledContainer]:
+        """
+        Takes a warm container for the given limits.
+
+        Args:
+            memory_limit: Requested memory limit
+            cpu_limit: Requested CPU limit
+
+        Returns:
+            A PooledContainer, or None on a pool miss
+        """
+        bucket = bucket_key(memory_limit, cpu_limit)
+        item = None
+        stale = []
+        with self._lock:
+            queue = self._idle.get(bucket)
+            while queue:
+                candidate = queue.popleft()
+                if time.monotonic() - candidate.created_at > self.max_idle_age:
+                    stale.append(candidate)
+                    continue
+                item = candidate
+                break
+            if item is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for candidate in stale:
+            self.recycled += 1
+            self._submit(self._destroy, candidate)
+        if queue is not None:
+            self._schedule_refill(bucket)
+        return item
+
+    def release(self, item: PooledContainer) -> None:
+        """Destroys a used container in the background."""
+        self._submit(self._destroy, item)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns pool hit/miss counters and idle counts per bucket."""
+        with self._lock:
+            idle = {f"{m}:{c}": len(q) for (m, c), q in self._idle.items()}
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "max_idle_age": self.max_idle_age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "recycled": self.recycled,
+            "idle": idle,
+        }
+
+    def _submit(self, fn, *args) -> None:
+        try:
+            self._executor.submit(fn, *args)
+        except RuntimeError:
+            # Executor already shut down; run inline so nothing leaks
+            fn(*args)
+
+    def _schedule_refill(self, bucket: Bucket) -> None:
+        if self._closed:
+            return
+        with self._lock:
+            missing = self.size - len(self._idle[bucket]) - self._pending[bucket]
+            if missing <= 0:
+                return
+            self._pending[bucket] += missing
+        for _ in range(missing):
+            self._submit(self._create, bucket)
+
+    def _create(self, bucket: Bucket) -> None:
+        code_dir = None
+        try:
+            if CODE_DELIVERY != "stdin":
+                code_dir = tempfile.mkdtemp(prefix="pool_exec_")
+                track_resource(code_dir)
+            memory_limit, cpu_limit = bucket
+            container = self.docker_client.containers.create(
+                **container_options(code_dir, memory_limit, cpu_limit, role="pool")
+            )
+            track_resource(container.id)
+            item = PooledContainer(container=container, code_dir=code_dir, bucket=bucket)
+        except Exception as e:
+            logger.error(f"Failed to create pooled container for bucket {bucket}: {str(e)}")
+            if code_dir is not None:
+                remove_temp_dir(code_dir)
+            with self._lock:
+                self._pending[bucket] -= 1
+            return
+
+        with self._lock:
+            self._pending[bucket] -= 1
+            if not self._closed:
+                self._idle[bucket].append(item)
+                item = None
+        if item is not None:
+            self._destroy(item)
+
+    def _destroy(self, item: PooledContainer) -> None:
+        remove_container(item.container, "pooled container")
+        if item.code_dir is not None:
+            remove_temp_dir(item.code_dir)
+
+    def _sweep(self) -> None:
+        """Recycles containers that sat idle longer than max_idle_age."""
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for queue in self._idle.values():
+                fresh = deque(item for item in queue if now - item.created_at <= self.max_idle_age)
+                stale.extend(item for item in queue if now - item.created_at > self.max_idle_age)
+                queue.clear()
+                queue.extend(fresh)
+        for item in stale:
+            self.recycled += 1
+            self._destroy(item)
+        for bucket in self.buckets:
+            self._schedule_refill(bucket)
+
+    async def _maintenance_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = max(self.max_idle_age / 2, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(self._executor, self._sweep)
+            except Exception as e:
+                logger.error(f"Container pool maintenance failed: {str(e)}")
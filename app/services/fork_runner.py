@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from docker.utils import parse_bytes
+
+from services import metrics
+from services.sandbox import (
+    OUTPUT_MAX_BYTES,
+    SandboxResult,
+    container_options,
+    remove_container,
+    resource_usage,
+    track_resource,
+)
+
+logger = logging.getLogger(__name__)
+
+# Serve snippets from long-lived fork-server containers when one is idle
+FORK_RUNNER_ENABLED = os.getenv("FORK_RUNNER_ENABLED", "false").lower() in ("1", "true", "yes")
+# Number of fork-server containers (each runs one snippet at a time)
+FORK_RUNNER_CONTAINERS = int(os.getenv("FORK_RUNNER_CONTAINERS", "2"))
+# Limits of each fork-server container; requests asking for more use a regular container
+FORK_RUNNER_MEMORY_LIMIT = os.getenv("FORK_RUNNER_MEMORY_LIMIT", "512m")
+FORK_RUNNER_CPU_LIMIT = float(os.getenv("FORK_RUNNER_CPU_LIMIT", "1"))
+# Modules imported once by the fork server and inherited by every snippet
+FORK_RUNNER_PRELOAD = os.getenv(
+    "FORK_RUNNER_PRELOAD",
+    "math,cmath,json,re,collections,itertools,functools,datetime,decimal,fractions,"
+    "random,statistics,string,heapq,bisect,operator,textwrap,dataclasses,typing",
+)
+# Extra seconds to wait for a response beyond the snippet's own timeout
+FORK_RUNNER_GRACE = float(os.getenv("FORK_RUNNER_GRACE", "5"))
+
+_STDOUT, _STDERR = 1, 2
+
+
+class ForkServerError(Exception):
+    """Raised when a fork server stops responding or answers with an error."""
+
+
+def response_resources(response: Dict[str, Any], memory_limit: str) -> Dict[str, Any]:
+    """
+    Resource accounting for one snippet from a fork-server or session response.
+
+    The rusage comes from inside the sandbox. The container's cgroup is
+    shared between snippets, so there is no throttling or OOM figure for
+    one run.
+    """
+    rusage = response.get("rusage") or {}
+    stdout_bytes, stderr_bytes = response.get("output_bytes") or (0, 0)
+    return resource_usage(
+        memory_limit,
+        peak_memory=rusage.get("max_rss"),
+        cpu_user=rusage.get("user"),
+        cpu_system=rusage.get("system"),
+        stdout_bytes=stdout_bytes,
+        stderr_bytes=stderr_bytes,
+    )
+
+
+class ServerConnection:
+    """
+    A long-lived server container (fork server or session) and its attached
+    stdin/stdout stream, exchanging one JSON object per line.
+    """
+
+    def __init__(self, container, label: str = "Fork server", stderr_level: int = logging.INFO):
+        self.container = container
+        self.label = label
+        self.stderr_level = stderr_level
+        self._sock = None
+        self._buffer = b""
+
+    def connect(self) -> None:
+        attached = self.container.attach_socket(params={"stdin": 1, "stdout": 1, "stderr": 1, "stream": 1})
+        self._sock = getattr(attached, "_sock", attached)
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self._sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def _recv_exact(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ForkServerError(f"{self.label} closed the connection")
+            data += chunk
+        return data
+
+    def _read_frame(self):
+        # Docker multiplexes stdout/stderr as [stream, 0, 0, 0, size (4 bytes)] + payload
+        header = self._recv_exact(8)
+        stream, size = header[0], struct.unpack(">I", header[4:])[0]
+        return stream, self._recv_exact(size)
+
+    def receive(self, deadline: float, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """Reads one response line, forwarding a cancel request if ``cancel`` is set."""
+        cancel_sent = False
+        while b"\n" not in self._buffer:
+            if cancel is not None and cancel.is_set() and not cancel_sent:
+                self.send({"op": "cancel"})
+                cancel_sent = True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ForkServerError(f"{self.label} did not respond in time")
+            self._sock.settimeout(min(remaining, 0.25))
+            try:
+                stream, payload = self._read_frame()
+            except socket.timeout:
+                continue
+            finally:
+                self._sock.settimeout(None)
+            if stream == _STDERR:
+                logger.log(self.stderr_level, f"{self.label}: {payload.decode('utf-8', errors='replace').rstrip()}")
+            else:
+                self._buffer += payload
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        remove_container(self.container, f"{self.label.lower()} container")
+
+
+class ForkServerRunner:
+    """
+    Runs snippets in pre-started fork-server containers.
+
+    Each container runs ``dockerfile/fork_server.py``, which preloads common
+    modules and forks a fresh, rlimited child per snippet, so a trivial
+    snippet takes milliseconds instead of a container start. Snippets from
+    different requests share a container (but never a process), so this is
+    opt-in. When every fork server is busy, or a request asks for more than
+    a fork-server container has, the caller falls back to a regular
+    container.
+    """
+
+    def __init__(
+        self,
+        docker_client,
+        size: int = FORK_RUNNER_CONTAINERS,
+        memory_limit: str = FORK_RUNNER_MEMORY_LIMIT,
+        cpu_limit: float = FORK_RUNNER_CPU_LIMIT,
+        preload: str = FORK_RUNNER_PRELOAD,
+    ):
+        self.docker_client = docker_client
+        self.size = size
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.preload = preload
+        self.runs = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self._idle: "queue.Queue[ServerConnection]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="fork-runner")
+        self._closed = False
+
+    async def start(self) -> None:
+        logger.info(f"Starting {self.size} fork-server containers")
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self._spawn) for _ in range(self.size)),
+            return_exceptions=True,
+        )
+
+    async def stop(self) -> None:
+        self._closed = True
+        servers: List[ServerConnection] = []
+        while True:
+            try:
+                servers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self._executor, server.close) for server in servers),
+            return_exceptions=True,
+        )
+        self._executor.shutdown(wait=False)
+
+    def accepts(self, memory_limit: str, cpu_limit: float) -> bool:
+        """Whether a request fits within a fork-server container's limits."""
+        return (
+            parse_bytes(memory_limit) <= parse_bytes(self.memory_limit)
+            and float(cpu_limit) <= self.cpu_limit
+        )
+
+    def try_run(
+        self,
+        code: str,
+        timeout: int,
+        memory_limit: str,
+        cpu_limit: float,
+        execution_id: str,
+        cancel: Optional[threading.Event] = None,
+    ) -> Optional[SandboxResult]:
+        """
+        Runs code on an idle fork server.
+
+        Returns:
+            SandboxResult, or None if no fork server can take the request
+
+        Raises:
+            ForkServerError: If the fork server failed mid-request
+        """
+        if not self.accepts(memory_limit, cpu_limit):
+            return None
+        try:
+            server = self._idle.get_nowait()
+        except queue.Empty:
+            self.fallbacks += 1
+            return None
+
+        started = time.monotonic()
+        try:
+            server.send({
+                "code": code,
+                "timeout": timeout,
+                "memory": parse_bytes(memory_limit),
+                "max_output": OUTPUT_MAX_BYTES,
+            })
+            response = server.receive(started + timeout + FORK_RUNNER_GRACE, cancel)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Fork server failed for ID {execution_id}: {str(e)}")
+            self._replace(server)
+            raise ForkServerError(str(e))
+        self._idle.put(server)
+
+        if "error" in response:
+            raise ForkServerError(response["error"])
+        self.runs += 1
+        elapsed = time.monotonic() - started
+        metrics.observe_stage("fork_execution", elapsed)
+        if response.get("timed_out"):
+            metrics.EXECUTION_TIMEOUTS.inc()
+            logger.warning(f"Execution timed out for ID: {execution_id}")
+        return SandboxResult(
+            stdout=response["stdout"],
+            stderr=response["stderr"],
+            exit_code=response["exit_code"],
+            execution_time=elapsed,
+            pooled=True,
+            truncated=response.get("truncated", False),
+            timed_out=response.get("timed_out", False),
+            resources=response_resources(response, memory_limit),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "memory_limit": self.memory_limit,
+            "cpu_limit": self.cpu_limit,
+            "runs": self.runs,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+        }
+
+    def _spawn(self) -> None:
+        if self._closed:
+            return
+        options = container_options(None, self.memory_limit, self.cpu_limit, role="forkserver")
+        options.update(
+            command=["--forkserver"],
+            stdin_once=False,  # stdin stays open across snippets
+            environment={"RUNNER_PRELOAD": self.preload},
+        )
+        try:
+            container = self.docker_client.containers.create(**options)
+        except Exception as e:
+            logger.error(f"Failed to create fork-server container: {str(e)}")
+            return
+        track_resource(container.id)
+        server = ServerConnection(container)
+        try:
+            server.connect()
+            container.start()
+        except Exception as e:
+            logger.error(f"Failed to start fork-server container: {str(e)}")
+            server.close()
+            return
+        self._idle.put(server)
+
+    def _replace(self, server: ServerConnection) -> None:
+        def replace():
+            server.close()
+            self._spawn()
+        try:
+            self._executor.submit(replace)
+        except RuntimeError:
+            server.close()
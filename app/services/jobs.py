@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# "memory" (default) or "sqlite"
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.db")
+# Number of jobs executed concurrently by the worker pool
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# Maximum queued jobs before submissions are rejected
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "1000"))
+# Seconds a finished job (and its result) is kept
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobError(Exception):
+    """Raised by a job handler to fail a job with an HTTP-style status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+
+
+class JobStore(ABC):
+    """Storage backend for job records."""
+
+    @abstractmethod
+    def save(self, job: Job) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def unfinished(self) -> List[Job]:
+        """Returns the jobs that are still queued or running."""
+
+    @abstractmethod
+    def delete_expired(self, now: float) -> int:
+        ...
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        ...
+
+
+class MemoryJobStore(JobStore):
+    """Keeps jobs in process memory; results are lost on restart."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            return [j for j in self._jobs.values() if j.status not in FINISHED_STATES]
+
+    def delete_expired(self, now: float) -> int:
+        with self._lock:
+            expired = [j.id for j in self._jobs.values() if j.expires_at is not None and j.expires_at <= now]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+
+class SQLiteJobStore(JobStore):
+    """Keeps jobs in a local SQLite file so results survive restarts."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs "
+            "(id TEXT PRIMARY KEY, status TEXT, expires_at REAL, data TEXT)"
+        )
+        self._db.commit()
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, expires_at, data) VALUES (?, ?, ?, ?)",
+                (job.id, job.status, job.expires_at, json.dumps(asdict(job))),
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        return [Job(**json.loads(row[0])) for row in rows]
+
+    def delete_expired(self, now: float) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+def create_store(kind: str = JOB_STORE, path: str = JOB_STORE_PATH) -> JobStore:
+    """Builds the configured job store."""
+    if kind == "sqlite":
+        return SQLiteJobStore(path)
+    if kind != "memory":
+        logger.warning(f"Unknown JOB_STORE '{kind}', using memory")
+    return MemoryJobStore()
+
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a pool of asyncio workers.
+
+    Each job kind maps to a handler coroutine that takes the job payload and
+    returns a JSON-serializable result, raising JobError to fail the job.
+    Finished jobs are kept for ``result_ttl`` seconds.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Handler],
+        workers: int = JOB_WORKERS,
+        queue_size: int = JOB_QUEUE_SIZE,
+        result_ttl: float = JOB_RESULT_TTL,
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._running: Dict[str, asyncio.Task] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self) -> None:
+        # Jobs left queued or running by a previous process will never be
+        # picked up again, so fail them instead of leaving them pending forever
+        for job in self.store.unfinished():
+            logger.warning(f"Failing {job.kind} job {job.id} left {job.status} by a previous run")
+            self._finish(job, FAILED, error="Interrupted by a service restart", status_code=503)
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._cleanup_loop()))
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in list(self._running.values()) + self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> Job:
+        """
+        Queues a job.
+
+        Raises:
+            ValueError: If no handler is registered for ``kind``
+            QueueFullError: If the queue is at capacity
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(id=str(uuid.uuid4()), kind=kind, payload=payload)
+        try:
+            self._queue.put_nowait(job.id)
+        except asyncio.QueueFull:
+            raise QueueFullError("Job queue is full")
+        self.store.save(job)
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancels a queued or running job.
+
+        Returns:
+            The updated job, or None if it does not exist
+        """
+        job = self.store.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            # The worker records the cancellation when the task unwinds
+            task.cancel()
+        else:
+            self._finish(job, CANCELLED, error="Cancelled before start")
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "running": len(self._running),
+            "jobs": self.store.counts(),
+        }
+
+    def _finish(self, job: Job, status: str, result=None, error=None, status_code=None) -> None:
+        job.status = status
+        job.result = result
+        job.error = error
+        job.status_code = status_code
+        job.finished_at = time.time()
+        job.expires_at = job.finished_at + self.result_ttl
+        self.store.save(job)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.store.get(job_id)
+            if job is None or job.status != QUEUED:
+                continue
+            job.status = RUNNING
+            job.started_at = time.time()
+            self.store.save(job)
+
+            task = asyncio.create_task(self.handlers[job.kind](job.payload))
+            self._running[job.id] = task
+            try:
+                result = await task
+                self._finish(job, SUCCEEDED, result=result, status_code=200)
+            except JobError as e:
+                self._finish(job, FAILED, error=e.detail, status_code=e.status_code)
+            except asyncio.CancelledError:
+                if self._stopping or not task.cancelled():
+                    # The worker itself is shutting down
+                    task.cancel()
+                    self._finish(job, FAILED, error="Interrupted by a service shutdown", status_code=503)
+                    raise
+                self._finish(job, CANCELLED, error="Cancelled while running")
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {str(e)}")
+                self._finish(job, FAILED, error=str(e), status_code=500)
+            finally:
+                self._running.pop(job.id, None)
+
+    async def _cleanup_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(min(self.result_ttl / 2, 60), 1))
+            removed = self.store.delete_expired(time.time())
+            if removed:
+                logger.info(f"Removed {removed} expired jobs")
@@ -0,0 +1,148 @@
+import json
+from typing import Any, Dict, List, Optional
+
+_WHITESPACE = " \t\r\n"
+
+
+class JSONFieldParser:
+    """
+    Incrementally parses the top-level fields of a JSON object fed in chunks.
+
+    Text before the opening brace (prose, a markdown fence) is skipped. Each
+    top-level value is decoded as soon as it closes, so callers can act on a
+    field before the rest of the object has arrived::
+
+        parser = JSONFieldParser()
+        for chunk in chunks:
+            for name in parser.feed(chunk):
+                handle(name, parser.fields[name])
+
+    ``error`` is set if the object turns out not to be valid JSON, after
+    which further input is ignored.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+        self.error: Optional[str] = None
+        self._state = "seek"
+        self._buffer: List[str] = []
+        self._key: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def done(self) -> bool:
+        return self.complete or self.error is not None
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Consumes a chunk of text.
+
+        Returns:
+            Names of the fields whose values completed within this chunk
+        """
+        completed: List[str] = []
+        for char in text:
+            if self.done:
+                break
+            self._step(char, completed)
+        return completed
+
+    def _step(self, char: str, completed: List[str]) -> None:
+        state = self._state
+        if state == "seek":
+            if char == "{":
+                self._state = "before_key"
+        elif state == "before_key":
+            if char == '"':
+                self._buffer = []
+                self._state = "key"
+            elif char == "}" and not self.fields:
+                self.complete = True
+            elif char not in _WHITESPACE:
+                self._fail(f"expected a key, got {char!r}")
+        elif state == "key":
+            if self._escaped:
+                self._escaped = False
+                self._buffer.append(char)
+            elif char == "\\":
+                self._escaped = True
+                self._buffer.append(char)
+            elif char == '"':
+                self._key = self._decode('"' + "".join(self._buffer) + '"')
+                self._state = "colon"
+            else:
+                self._buffer.append(char)
+        elif state == "colon":
+            if char == ":":
+                self._state = "value_start"
+            elif char not in _WHITESPACE:
+                self._fail(f"expected ':', got {char!r}")
+        elif state == "value_start":
+            if char in _WHITESPACE:
+                return
+            self._buffer = [char]
+            self._depth = 1 if char in "{[" else 0
+            self._in_string = char == '"'
+            self._state = "value"
+        elif state == "value":
+            self._step_value(char, completed)
+        elif state == "after_value":
+            if char == ",":
+                self._state = "before_key"
+            elif char == "}":
+                self.complete = True
+            elif char not in _WHITESPACE:
+                self._fail(f"expected ',' or '}}', got {char!r}")
+
+    def _step_value(self, char: str, completed: List[str]) -> None:
+        if self._in_string:
+            self._buffer.append(char)
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    self._finish_value(completed)
+            return
+
+        if char == '"':
+            self._in_string = True
+            self._buffer.append(char)
+        elif char in "{[":
+            self._depth += 1
+            self._buffer.append(char)
+        elif char in "}]" and self._depth > 0:
+            self._depth -= 1
+            self._buffer.append(char)
+            if self._depth == 0:
+                self._finish_value(completed)
+        elif self._depth == 0 and (char in ",}" or char in _WHITESPACE):
+            # End of a number or literal
+            self._finish_value(completed)
+            if not self.done:
+                self._step(char, completed)
+        else:
+            self._buffer.append(char)
+
+    def _finish_value(self, completed: List[str]) -> None:
+        value = self._decode("".join(self._buffer))
+        if self.error is not None:
+            return
+        self.fields[self._key] = value
+        completed.append(self._key)
+        self._state = "after_value"
+
+    def _decode(self, text: str) -> Any:
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            self._fail(str(e))
+            return None
+
+    def _fail(self, reason: str) -> None:
+        self.error = reason
@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings for the shared Together AI client
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() in ("1", "true", "yes")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "5"))
+
+_client: Optional[httpx.AsyncClient] = None
+_http2_enabled = False
+_requests = 0
+_in_flight = 0
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _create_client() -> httpx.AsyncClient:
+    global _http2_enabled
+    _http2_enabled = LLM_HTTP2 and _http2_available()
+    if LLM_HTTP2 and not _http2_enabled:
+        logger.warning("LLM_HTTP2 enabled but the 'h2' package is not installed, using HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=_http2_enabled,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=request_timeout(float(os.getenv("API_TIMEOUT", "30"))),
+    )
+
+
+async def startup() -> None:
+    """Creates the shared client. Called from the FastAPI lifespan."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+
+
+async def shutdown() -> None:
+    """Closes the shared client and its pooled connections."""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared client, creating it on first use.
+
+    The client is normally created by the app lifespan; lazy creation keeps
+    the code manager usable from scripts outside the API process.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+@asynccontextmanager
+async def session() -> AsyncIterator[httpx.AsyncClient]:
+    """
+    Yields the shared client for one LLM call without closing it afterwards.
+
+    Drop-in replacement for ``async with httpx.AsyncClient() as client``.
+    """
+    global _requests, _in_flight
+    _requests += 1
+    _in_flight += 1
+    try:
+        yield get_client()
+    finally:
+        _in_flight -= 1
+
+
+async def stream_chat(
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    timeout: httpx.Timeout,
+    usage: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """
+    Posts a chat completion request and yields the content as it arrives.
+
+    With ``"stream": True`` in the payload the server-sent events are parsed
+    and each content delta is yielded. A server that answers with a regular
+    JSON completion instead yields its whole content once. Closing the
+    iterator early closes the connection, which stops generation upstream.
+
+    Args:
+        url: Chat completions endpoint
+        headers: Request headers, including authorization
+        payload: Request body
+        timeout: Per-read timeout for the request
+        usage: Optional dict updated with the token counts the server reports
+            (prompt_tokens, completion_tokens), if it reports any
+
+    Yields:
+        Chunks of the assistant message content
+    """
+    async with session() as client:
+        async with client.stream("POST", url, headers=headers, json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            if "text/event-stream" not in response.headers.get("content-type", ""):
+                body = json.loads(await response.aread())
+                if usage is not None:
+                    usage.update(body.get("usage") or {})
+                yield body["choices"][0]["message"]["content"]
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                event = json.loads(data)
+                if usage is not None and event.get("usage"):
+                    usage.update(event["usage"])
+                choices = event.get("choices") or []
+                if not choices:
+                    continue
+                text = (choices[0].get("delta") or {}).get("content") or choices[0].get("text")
+                if text:
+                    yield text
+
+
+def request_timeout(total: float) -> httpx.Timeout:
+    """
+    Builds the timeout for one LLM call.
+
+    Args:
+        total: Read/write timeout in seconds for the call
+
+    Returns:
+        httpx.Timeout with the configured connect and pool timeouts
+    """
+    return httpx.Timeout(total, connect=LLM_CONNECT_TIMEOUT, pool=LLM_POOL_TIMEOUT)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Returns request counters and connection pool occupancy."""
+    stats: Dict[str, Any] = {
+        "http2": _http2_enabled,
+        "max_connections": LLM_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_MAX_KEEPALIVE_CONNECTIONS,
+        "keepalive_expiry": LLM_KEEPALIVE_EXPIRY,
+        "requests": _requests,
+        "in_flight": _in_flight,
+        "connections": 0,
+        "idle_connections": 0,
+    }
+    # httpx does not expose pool state publicly; read it from httpcore if present
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is not None:
+        stats["connections"] = len(connections)
+        stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+    return stats
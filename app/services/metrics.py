@@ -0,0 +1,296 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Histogram bucket upper bounds in seconds
+METRICS_BUCKETS = [
+    float(b) for b in os.getenv(
+        "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+    ).split(",")
+]
+
+LabelValues = Tuple[str, ...]
+
+# Per-request stage timings, set by start_breakdown()
+_breakdown: ContextVar[Optional[Dict[str, float]]] = ContextVar("timing_breakdown", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # An unlabelled counter is reported as 0 before its first increment
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, optionally split by labels."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = METRICS_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = sorted(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), total[0]) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "codeexec_stage_duration_seconds",
+    "Time spent in each stage of handling a request.",
+    ["stage"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "codeexec_http_request_duration_seconds",
+    "Time to send the complete response, by route and status code.",
+    ["method", "route", "status"],
+)
+EXECUTION_TIMEOUTS = Counter(
+    "codeexec_execution_timeouts_total",
+    "Sandbox executions killed after exceeding their timeout.",
+)
+VALIDATION_REJECTIONS = Counter(
+    "codeexec_validation_rejections_total",
+    "Code rejected as unsafe before execution.",
+    ["source"],
+)
+LLM_PARSE_FALLBACKS = Counter(
+    "codeexec_llm_parse_fallbacks_total",
+    "Together AI responses that were not valid JSON and needed a fallback parser.",
+    ["call"],
+)
+LLM_EARLY_ABORTS = Counter(
+    "codeexec_llm_early_aborts_total",
+    "Together AI streams stopped once the code was known to be rejected.",
+    ["call", "reason"],
+)
+LLM_BUDGET_EXCEEDED = Counter(
+    "codeexec_llm_budget_exceeded_total",
+    "Together AI calls stopped for exceeding their token or time budget.",
+    ["call", "budget"],
+)
+LLM_RETRIES = Counter(
+    "codeexec_llm_retries_total",
+    "Together AI calls retried after a transient failure.",
+    ["call"],
+)
+LLM_HEDGES = Counter(
+    "codeexec_llm_hedges_total",
+    "Duplicate Together AI requests sent for slow calls, and how many answered first.",
+    ["call", "outcome"],
+)
+LLM_RETRY_BUDGET_EXHAUSTED = Counter(
+    "codeexec_llm_retry_budget_exhausted_total",
+    "Retries and hedges skipped because the retry budget was spent.",
+    ["kind"],
+)
+LLM_CIRCUIT_TRANSITIONS = Counter(
+    "codeexec_llm_circuit_transitions_total",
+    "Together AI circuit breaker state changes, by model.",
+    ["model", "state"],
+)
+VALIDATION_FALLBACKS = Counter(
+    "codeexec_validation_fallbacks_total",
+    "Validations decided by the local fallback policy because Together AI gave no verdict.",
+    ["policy"],
+)
+VALIDATION_TIER_SECONDS = Histogram(
+    "codeexec_validation_tier_duration_seconds",
+    "Time spent in each tier of the validation cascade.",
+    ["tier"],
+)
+VALIDATION_TIER_OUTCOMES = Counter(
+    "codeexec_validation_tier_outcomes_total",
+    "Validation cascade calls, by tier and whether the tier decided or why it escalated.",
+    ["tier", "outcome"],
+)
+VALIDATION_TIER_TOKENS = Counter(
+    "codeexec_validation_tier_completion_tokens_total",
+    "Completion tokens spent by each tier of the validation cascade.",
+    ["tier"],
+)
+SPECULATIVE_EXECUTIONS = Counter(
+    "codeexec_speculative_executions_total",
+    "Executions started before validation finished, by outcome.",
+    ["outcome"],
+)
+BACKEND_EXECUTIONS = Counter(
+    "codeexec_backend_executions_total",
+    "Executions routed to each docker endpoint.",
+    ["backend"],
+)
+BACKEND_HEALTH_CHANGES = Counter(
+    "codeexec_backend_health_changes_total",
+    "Docker endpoints taken out of or returned to rotation.",
+    ["backend", "healthy"],
+)
+EXECUTION_MEMORY_RATIO = Histogram(
+    "codeexec_execution_peak_memory_ratio",
+    "Peak memory of each execution as a fraction of its memory limit.",
+    ["backend"],
+    buckets=[0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1],
+)
+EXECUTION_CPU_SECONDS = Counter(
+    "codeexec_execution_cpu_seconds_total",
+    "CPU time used by executions, by user or system mode.",
+    ["backend", "mode"],
+)
+EXECUTION_THROTTLED_PERIODS = Counter(
+    "codeexec_execution_throttled_periods_total",
+    "CPU scheduling periods in which executions exhausted their CPU quota.",
+    ["backend"],
+)
+EXECUTION_OOM_KILLS = Counter(
+    "codeexec_execution_oom_kills_total",
+    "Executions killed for exceeding their memory limit.",
+    ["backend"],
+)
+EXECUTION_OUTPUT_BYTES = Counter(
+    "codeexec_execution_output_bytes_total",
+    "Bytes written by executions, including truncated output.",
+    ["backend", "stream"],
+)
+SESSIONS_CLOSED = Counter(
+    "codeexec_sessions_closed_total",
+    "Interactive sessions closed, by reason.",
+    ["reason"],
+)
+REAPED_RESOURCES = Counter(
+    "codeexec_reaped_resources_total",
+    "Orphaned sandbox containers and temp dirs reclaimed by the reaper.",
+    ["kind"],
+)
+
+_registry = [
+    STAGE_SECONDS,
+    HTTP_REQUEST_SECONDS,
+    EXECUTION_TIMEOUTS,
+    VALIDATION_REJECTIONS,
+    LLM_PARSE_FALLBACKS,
+    LLM_EARLY_ABORTS,
+    LLM_BUDGET_EXCEEDED,
+    LLM_RETRIES,
+    LLM_HEDGES,
+    LLM_RETRY_BUDGET_EXHAUSTED,
+    LLM_CIRCUIT_TRANSITIONS,
+    VALIDATION_FALLBACKS,
+    VALIDATION_TIER_SECONDS,
+    VALIDATION_TIER_OUTCOMES,
+    VALIDATION_TIER_TOKENS,
+    SPECULATIVE_EXECUTIONS,
+    BACKEND_EXECUTIONS,
+    BACKEND_HEALTH_CHANGES,
+    EXECUTION_MEMORY_RATIO,
+    EXECUTION_CPU_SECONDS,
+    EXECUTION_THROTTLED_PERIODS,
+    EXECUTION_OOM_KILLS,
+    EXECUTION_OUTPUT_BYTES,
+    SESSIONS_CLOSED,
+    REAPED_RESOURCES,
+]
+
+
+def start_breakdown() -> Dict[str, float]:
+    """
+    Starts collecting stage timings for the current request.
+
+    Stages recorded later in the same task (and in sandbox threads started
+    from it) are added to the returned dict, in seconds.
+    """
+    breakdown: Dict[str, float] = {}
+    _breakdown.set(breakdown)
+    return breakdown
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Records a stage duration in the histogram and the request breakdown."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown[stage] = breakdown.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times the enclosed block as one stage, including when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def render() -> str:
+    """Returns every metric in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
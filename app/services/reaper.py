@@ -0,0 +1,195 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+from typing import Any, Callable, Dict, List, Optional
+
+from services import metrics
+from services.sandbox import (
+    CREATED_LABEL,
+    INSTANCE_ID,
+    INSTANCE_LABEL,
+    ROLE_LABEL,
+    SANDBOX_LABEL,
+    is_tracked,
+    remove_container,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps (0 disables the reaper)
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "60"))
+# Untracked sandboxes and temp dirs older than this are reclaimed, whoever created them;
+# keep it above the longest execution timeout plus CONTAINER_POOL_MAX_IDLE_AGE
+REAPER_MAX_AGE = float(os.getenv("REAPER_MAX_AGE", "900"))
+# This process's own sandboxes (and exited ones from anywhere) are reclaimed sooner
+REAPER_GRACE = float(os.getenv("REAPER_GRACE", "60"))
+
+# Temp dir prefixes used for mount delivery
+TEMP_DIR_PREFIXES = ("code_exec_", "query_exec_", "pool_exec_")
+
+_FINISHED_STATES = ("exited", "dead")
+
+
+class Reaper:
+    """
+    Periodically reclaims sandbox containers and temp dirs nobody owns.
+
+    Every sandbox container carries labels with its role, the instance that
+    created it and its creation time, and every live container and temp dir
+    is tracked by the process that owns it. A sweep removes what is not
+    tracked:
+
+    - containers of this instance older than ``grace`` (their removal failed)
+    - exited containers of other instances older than ``grace`` (for
+      example after a crash)
+    - any other container older than ``max_age``; running fork servers and
+      sessions of other instances are left alone, since they exit when their
+      owner does
+    - ``code_exec_*``, ``query_exec_*`` and ``pool_exec_*`` temp dirs not
+      modified for ``max_age``
+    """
+
+    def __init__(
+        self,
+        clients: Callable[[], List[Any]],
+        interval: float = REAPER_INTERVAL,
+        max_age: float = REAPER_MAX_AGE,
+        grace: float = REAPER_GRACE,
+        temp_root: Optional[str] = None,
+    ):
+        self.clients = clients
+        self.interval = interval
+        self.max_age = max_age
+        self.grace = grace
+        self.temp_root = temp_root or tempfile.gettempdir()
+        self.sweeps = 0
+        self.containers_reaped = 0
+        self.temp_dirs_reaped = 0
+        self.errors = 0
+        self.last_sweep: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    async def start(self) -> None:
+        if not self.enabled:
+            logger.info("Sandbox reaper disabled")
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        Reclaims orphaned sandbox containers and temp dirs once (blocking).
+
+        Returns:
+            Counts of containers and temp dirs reclaimed by this sweep
+        """
+        containers = 0
+        for client in self.clients():
+            try:
+                containers += self._sweep_containers(client)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Failed to sweep sandbox containers: {str(e)}")
+        temp_dirs = self._sweep_temp_dirs()
+        self.sweeps += 1
+        self.last_sweep = time.time()
+        if containers or temp_dirs:
+            logger.warning(f"Reaper reclaimed {containers} containers and {temp_dirs} temp dirs")
+        return {"containers": containers, "temp_dirs": temp_dirs}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "max_age": self.max_age,
+            "grace": self.grace,
+            "instance": INSTANCE_ID,
+            "sweeps": self.sweeps,
+            "containers_reaped": self.containers_reaped,
+            "temp_dirs_reaped": self.temp_dirs_reaped,
+            "errors": self.errors,
+            "last_sweep": self.last_sweep,
+        }
+
+    def _is_orphan(self, container) -> bool:
+        if is_tracked(container.id):
+            return False
+        labels = container.labels
+        try:
+            age = time.time() - float(labels.get(CREATED_LABEL, 0))
+        except ValueError:
+            age = float("inf")
+        if labels.get(INSTANCE_LABEL) == INSTANCE_ID:
+            return age > self.grace
+        if container.status in _FINISHED_STATES:
+            return age > self.grace
+        if labels.get(ROLE_LABEL) in ("forkserver", "session") and container.status == "running":
+            return False
+        # Possibly another instance's warm or running sandbox
+        return age > self.max_age
+
+    def _sweep_containers(self, client) -> int:
+        reaped = 0
+        containers = client.containers.list(all=True, filters={"label": SANDBOX_LABEL}, ignore_removed=True)
+        for container in containers:
+            if not self._is_orphan(container):
+                continue
+            logger.info(
+                f"Reaping {container.status} sandbox {container.id[:12]} "
+                f"({container.labels.get(ROLE_LABEL, 'unknown')}, instance {container.labels.get(INSTANCE_LABEL)})"
+            )
+            remove_container(container, f"orphaned container {container.id[:12]}")
+            reaped += 1
+        self.containers_reaped += reaped
+        metrics.REAPED_RESOURCES.inc(reaped, kind="container")
+        return reaped
+
+    def _sweep_temp_dirs(self) -> int:
+        reaped = 0
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.temp_root))
+        except OSError as e:
+            self.errors += 1
+            logger.error(f"Failed to scan {self.temp_root}: {str(e)}")
+            return 0
+        for entry in entries:
+            if not entry.name.startswith(TEMP_DIR_PREFIXES) or is_tracked(entry.path):
+                continue
+            try:
+                if not entry.is_dir(follow_symlinks=False) or now - entry.stat().st_mtime <= self.max_age:
+                    continue
+                shutil.rmtree(entry.path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                self.errors += 1
+                logger.error(f"Failed to remove orphaned temp dir {entry.path}: {str(e)}")
+                continue
+            reaped += 1
+        self.temp_dirs_reaped += reaped
+        metrics.REAPED_RESOURCES.inc(reaped, kind="temp_dir")
+        return reaped
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Sandbox reaper sweep failed: {str(e)}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,330 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+import httpx
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Send a duplicate request when a call runs past the recent latency quantile
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Latency quantile that triggers the hedge, and the floor on the hedge delay in seconds
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.25"))
+# Recent successful calls kept per call type and model; no hedging below LLM_HEDGE_MIN_SAMPLES
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Retries per call after a connection error, timeout, 429 or 5xx
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Exponential backoff with full jitter: a random delay up to base * 2^retry, capped
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.25"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "2"))
+# Retries and hedges together may add at most this fraction of extra calls, with bursts up to LLM_RETRY_BUDGET_MAX
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.1"))
+LLM_RETRY_BUDGET_MAX = float(os.getenv("LLM_RETRY_BUDGET_MAX", "10"))
+# Consecutive failures that open a model's circuit, and seconds before a probe call is let through
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the model while its circuit breaker is open."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is a transient backend failure worth retrying."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status in (408, 429) or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+class LatencyTracker:
+    """Latencies of recent successful calls, for picking the hedge delay."""
+
+    def __init__(self, window: int = LLM_HEDGE_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class RetryBudget:
+    """
+    Token bucket shared by retries and hedges.
+
+    Every call deposits ``ratio`` tokens and every retry or hedge withdraws
+    one, so during an outage the extra load is capped at ``ratio`` of the
+    call rate instead of multiplying it.
+    """
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET_RATIO, max_tokens: float = LLM_RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self, kind: str) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            metrics.LLM_RETRY_BUDGET_EXHAUSTED.inc(kind=kind)
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one model.
+
+    After ``failure_threshold`` failures in a row the circuit opens and
+    calls fail at once. After ``cooldown`` seconds one probe call is let
+    through (half-open); its success closes the circuit, its failure opens
+    it for another cooldown.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self, name: str, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; in half-open state one call at a time is let through."""
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._transition(self.HALF_OPEN)
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def retry_in(self) -> float:
+        return max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+
+    def record(self, success: bool) -> None:
+        self._probing = False
+        if success:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self._opened_at = time.monotonic()
+            self.trips += 1
+            self._transition(self.OPEN)
+
+    def release(self) -> None:
+        """Lets another probe through if this call ended without a verdict on the backend."""
+        self._probing = False
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"Circuit for {self.name} is now {state}")
+        self.state = state
+        metrics.LLM_CIRCUIT_TRANSITIONS.inc(model=self.name, state=state)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_in": self.retry_in() if self.state == self.OPEN else 0.0,
+        }
+
+
+class ResilientCaller:
+    """
+    Hedging, retries and circuit breaking around calls to one LLM provider.
+
+    A call that runs past the recent ``hedge_quantile`` latency of its call
+    type and model gets a duplicate request, and the first answer wins.
+    Connection errors, timeouts, 429s and 5xx responses are retried with
+    jittered exponential backoff. Hedges and retries draw on one shared
+    RetryBudget. Each model has a CircuitBreaker; while it is open, calls
+    raise CircuitOpenError at once instead of queueing behind an outage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        hedge_enabled: bool = LLM_HEDGE_ENABLED,
+        hedge_quantile: float = LLM_HEDGE_QUANTILE,
+        max_retries: int = LLM_MAX_RETRIES,
+    ):
+        self.name = name
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.max_retries = max_retries
+        self.budget = RetryBudget()
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(model)
+        return self._breakers[model]
+
+    def hedge_delay(self, call: str, model: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None until enough calls have been seen."""
+        tracker = self._latency.get(f"{call}:{model}")
+        if not self.hedge_enabled or tracker is None or len(tracker) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(tracker.quantile(self.hedge_quantile), LLM_HEDGE_MIN_DELAY)
+
+    async def call(self, call: str, model: str, attempt: Callable[[], Awaitable[T]], time_budget: float) -> T:
+        """
+        Runs ``attempt`` with hedging and retries within ``time_budget`` seconds.
+
+        ``attempt`` must be safe to run more than once, including twice at
+        the same time.
+
+        Args:
+            call: Call type, used for latency tracking and metrics
+            model: Model name; each model has its own circuit breaker
+            attempt: Makes one request and returns its result
+            time_budget: Seconds allowed for all attempts together
+
+        Returns:
+            The result of the first successful attempt
+
+        Raises:
+            CircuitOpenError: If the model's circuit is open
+            asyncio.TimeoutError: If the time budget runs out
+            Exception: The last attempt's error, if every attempt failed
+        """
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            raise CircuitOpenError(
+                f"{self.name} circuit for {model} is open after repeated failures; "
+                f"retrying in {breaker.retry_in():.0f}s"
+            )
+        self.calls += 1
+        self.budget.deposit()
+        try:
+            return await asyncio.wait_for(self._with_retries(call, model, attempt, breaker), time_budget)
+        except asyncio.TimeoutError:
+            breaker.record(False)
+            raise
+        finally:
+            breaker.release()
+
+    async def _with_retries(
+        self, call: str, model: str, attempt: Callable[[], Awaitable[T]], breaker: CircuitBreaker
+    ) -> T:
+        retries = 0
+        while True:
+            try:
+                return await self._hedged(call, model, attempt, breaker)
+            except Exception as e:
+                if not is_retryable(e) or retries >= self.max_retries or breaker.state != CircuitBreaker.CLOSED:
+                    raise
+                if not self.budget.withdraw("retry"):
+                    raise
+                retries += 1
+                self.retries += 1
+                metrics.LLM_RETRIES.inc(call=call)
+                delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** retries))
+                reason = str(e) or type(e).__name__
+                logger.warning(f"{self.name} {call} call failed ({reason}), retry {retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _hedged(
+        self, call: str, model: str, attempt: Callable[[], Awaitable[T]], breaker: CircuitBreaker
+    ) -> T:
+        tracker = self._latency.setdefault(f"{call}:{model}", LatencyTracker())
+        delay = self.hedge_delay(call, model)
+
+        async def timed() -> T:
+            started = time.perf_counter()
+            try:
+                result = await attempt()
+            except Exception as e:
+                if is_retryable(e):
+                    breaker.record(False)
+                raise
+            breaker.record(True)
+            tracker.observe(time.perf_counter() - started)
+            return result
+
+        tasks: List[asyncio.Future] = [asyncio.ensure_future(timed())]
+        hedge = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and breaker.state == CircuitBreaker.CLOSED and self.budget.withdraw("hedge"):
+                    self.hedges += 1
+                    metrics.LLM_HEDGES.inc(call=call, outcome="sent")
+                    logger.info(f"Hedging {call} call to {model} after {delay:.2f}s")
+                    hedge = asyncio.ensure_future(timed())
+                    tasks.append(hedge)
+            error: Optional[BaseException] = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedges_won += 1
+                            metrics.LLM_HEDGES.inc(call=call, outcome="won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing request is abandoned, which closes its stream
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "retry_budget": {
+                "tokens": round(self.budget.tokens, 2),
+                "max_tokens": self.budget.max_tokens,
+                "ratio": self.budget.ratio,
+                "exhausted": self.budget.exhausted,
+            },
+            "hedge_delays": {
+                key: self.hedge_delay(*key.split(":", 1)) for key in self._latency
+            },
+            "breakers": {model: breaker.stats() for model, breaker in self._breakers.items()},
+        }
@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import asdict
+from typing import Any, Dict, Optional, Tuple
+
+from services.cache import TTLCache, make_key
+from services.sandbox import SANDBOX_IMAGE, SandboxResult
+
+logger = logging.getLogger(__name__)
+
+# Entry count, lifetime and optional SQLite file of the execution result cache
+EXECUTION_CACHE_SIZE = int(os.getenv("EXECUTION_CACHE_SIZE", "1024"))
+EXECUTION_CACHE_TTL = float(os.getenv("EXECUTION_CACHE_TTL", "3600"))
+EXECUTION_CACHE_PATH = os.getenv("EXECUTION_CACHE_PATH")
+# Results larger than this (stdout plus stderr, in bytes) are not cached
+EXECUTION_CACHE_MAX_ENTRY_BYTES = int(os.getenv("EXECUTION_CACHE_MAX_ENTRY_BYTES", str(64 * 1024)))
+# How often each daemon's sandbox image digest is looked up again, so a rebuilt image misses the cache
+IMAGE_DIGEST_REFRESH = float(os.getenv("IMAGE_DIGEST_REFRESH", "60"))
+
+
+class ExecutionResultCache:
+    """
+    Cache of sandbox results for requests that opt in with ``cacheable``.
+
+    Entries are keyed by the executed code, the digest of the sandbox image
+    on the daemon that runs it and the resource limits, so a rebuilt image,
+    a daemon with a different build or different limits never reuse a
+    result. Only clean results are stored: timed-out runs, runs killed by a
+    signal (OOM), truncated output and oversized output always go to a
+    container.
+    """
+
+    def __init__(self, cache: Optional[TTLCache] = None, image: str = SANDBOX_IMAGE):
+        self.cache = cache or TTLCache(
+            max_size=EXECUTION_CACHE_SIZE,
+            ttl=EXECUTION_CACHE_TTL,
+            path=EXECUTION_CACHE_PATH,
+            name="execution cache",
+        )
+        self.image = image
+        self.skipped = 0
+        # id(docker client) -> (image ID, time it was looked up)
+        self._digests: Dict[int, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.enabled
+
+    def image_digest(self, docker_client) -> Optional[str]:
+        """
+        Returns the sandbox image ID on the daemon behind ``docker_client`` (blocking).
+
+        Daemons may hold different builds of the same tag, so the ID is
+        looked up on the daemon that runs the snippet, and refreshed every
+        IMAGE_DIGEST_REFRESH seconds. Returns None if it cannot be resolved.
+        """
+        with self._lock:
+            entry = self._digests.get(id(docker_client))
+        if entry is not None and time.monotonic() - entry[1] <= IMAGE_DIGEST_REFRESH:
+            return entry[0]
+        try:
+            digest = docker_client.images.get(self.image).id
+        except Exception as e:
+            logger.warning(f"Could not resolve digest of {self.image}: {str(e)}")
+            return None
+        with self._lock:
+            self._digests[id(docker_client)] = (digest, time.monotonic())
+        return digest
+
+    def key(self, docker_client, code: str, timeout: int, memory_limit: str, cpu_limit: float) -> Optional[str]:
+        """Returns the cache key for a run on ``docker_client``'s daemon, or None if its image is unknown."""
+        digest = self.image_digest(docker_client)
+        if digest is None:
+            return None
+        return make_key("execution", digest, code, timeout, memory_limit, float(cpu_limit))
+
+    def get(self, key: str) -> Optional[SandboxResult]:
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        # execution_time stays that of the run that produced the result
+        return SandboxResult(**{**value, "cached": True})
+
+    def set(self, key: str, result: SandboxResult) -> None:
+        size = len(result.stdout.encode("utf-8")) + len(result.stderr.encode("utf-8"))
+        if result.timed_out or not 0 <= result.exit_code < 128 or result.truncated or size > EXECUTION_CACHE_MAX_ENTRY_BYTES:
+            self.skipped += 1
+            return
+        self.cache.set(key, asdict(result))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            digests = sorted({digest for digest, _ in self._digests.values()})
+        return {**self.cache.stats(), "skipped": self.skipped, "image_digests": digests}
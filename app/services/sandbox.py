@@ -0,0 +1,909 @@
+import os
+import time
+import uuid
+import codecs
+import shutil
+import asyncio
+import tempfile
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+import docker
+from docker.utils import parse_bytes
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Image used for every sandboxed execution
+SANDBOX_IMAGE = os.getenv("SANDBOX_IMAGE", "python-code-execution:latest")
+# Maximum number of sandbox executions in flight per worker process
+EXECUTION_CONCURRENCY = int(os.getenv("EXECUTION_CONCURRENCY", "32"))
+# Output chunks buffered per streaming execution before the container is throttled
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+# Maximum bytes kept per output stream (stdout and stderr each)
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", str(1024 * 1024)))
+# How code reaches the sandbox: "stdin" (in memory) or "mount" (temp dir bind mount)
+CODE_DELIVERY = os.getenv("CODE_DELIVERY", "stdin")
+# Seconds a killed container may keep running before it is force-removed
+SANDBOX_KILL_GRACE = float(os.getenv("SANDBOX_KILL_GRACE", "3"))
+# Seconds between container stats samples while a sandbox runs (0 disables sampling)
+RESOURCE_SAMPLE_INTERVAL = float(os.getenv("RESOURCE_SAMPLE_INTERVAL", "0.25"))
+
+# Labels on every sandbox container, so leaked ones can be found and reclaimed
+SANDBOX_LABEL = "codeexec.sandbox"
+ROLE_LABEL = "codeexec.role"
+INSTANCE_LABEL = "codeexec.instance"
+CREATED_LABEL = "codeexec.created"
+# Identifies the containers created by this process
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+# Container IDs and temp dirs this process still owns (the reaper skips them)
+_owned_lock = threading.Lock()
+_owned = set()
+
+
+def track_resource(resource: str) -> None:
+    """Marks a container ID or temp dir as in use by this process."""
+    with _owned_lock:
+        _owned.add(resource)
+
+
+def untrack_resource(resource: str) -> None:
+    with _owned_lock:
+        _owned.discard(resource)
+
+
+def is_tracked(resource: str) -> bool:
+    with _owned_lock:
+        return resource in _owned
+
+
+@dataclass
+class SandboxResult:
+    """Outcome of a single sandboxed execution."""
+    stdout: str
+    stderr: str
+    exit_code: int
+    execution_time: float
+    pooled: bool = False
+    truncated: bool = False
+    cached: bool = False  # Served from the execution result cache
+    timed_out: bool = False  # Killed after exceeding its timeout; output is partial
+    resources: Optional[Dict[str, Any]] = None  # See resource_usage()
+
+
+def resource_usage(
+    memory_limit: str,
+    peak_memory: Optional[int] = None,
+    cpu_user: Optional[float] = None,
+    cpu_system: Optional[float] = None,
+    throttled_periods: Optional[int] = None,
+    oom_killed: bool = False,
+    stdout_bytes: int = 0,
+    stderr_bytes: int = 0,
+    samples: int = 0,
+) -> Dict[str, Any]:
+    """
+    Builds the resource accounting reported for one execution.
+
+    Measurements that were not taken (for example because the run finished
+    before the first stats sample) are None.
+
+    Args:
+        memory_limit: Docker memory limit of the execution (e.g. "100m")
+        peak_memory: Highest memory use seen, in bytes, excluding page cache
+        cpu_user: CPU seconds spent in user mode
+        cpu_system: CPU seconds spent in kernel mode
+        throttled_periods: CFS periods in which the CPU quota was exhausted
+        oom_killed: Whether the kernel OOM killer ended the run
+        stdout_bytes: Bytes written to stdout, including any truncated
+        stderr_bytes: Bytes written to stderr, including any truncated
+        samples: Number of stats samples the figures are based on
+
+    Returns:
+        Dict with the measurements and the memory limit in bytes
+    """
+    return {
+        "peak_memory_bytes": peak_memory,
+        "memory_limit_bytes": parse_bytes(memory_limit),
+        "cpu_user_seconds": cpu_user,
+        "cpu_system_seconds": cpu_system,
+        "throttled_periods": throttled_periods,
+        "oom_killed": oom_killed,
+        "stdout_bytes": stdout_bytes,
+        "stderr_bytes": stderr_bytes,
+        "samples": samples,
+    }
+
+
+def container_options(
+    code_dir: Optional[str], memory_limit: str, cpu_limit: float, unbuffered: bool = False, role: str = "exec"
+) -> Dict[str, Any]:
+    """
+    Builds the docker keyword arguments shared by every sandbox container.
+
+    Args:
+        code_dir: Host directory mounted read-only at /code, or None to
+            receive the code on stdin instead
+        memory_limit: Docker memory limit (e.g. "100m")
+        cpu_limit: Fraction of a CPU core the container may use
+        unbuffered: Disable Python output buffering (for streaming)
+        role: Kind of sandbox ("exec", "pool", "forkserver" or "session"), stored as a label
+
+    Returns:
+        Keyword arguments for ``containers.create`` / ``containers.run``
+    """
+    if code_dir is None:
+        delivery = {
+            "command": ["--stdin"],  # run_code.sh runs the program read from stdin
+            "stdin_open": True,
+            "stdin_once": True,  # stdin closes once the code has been sent
+        }
+    else:
+        delivery = {
+            "command": ["python", "/code/code.py"],
+            "volumes": {code_dir: {"bind": "/code", "mode": "ro"}},
+        }
+    return {
+        "environment": {"PYTHONUNBUFFERED": "1"} if unbuffered else None,
+        "image": SANDBOX_IMAGE,
+        "mem_limit": memory_limit,
+        "cpu_quota": int(100000 * cpu_limit),  # Docker CPU quota in microseconds
+        "network_mode": "none",  # Disable networking
+        "read_only": True,  # Read-only filesystem
+        "cap_drop": ["ALL"],  # Drop all capabilities
+        "security_opt": ["no-new-privileges:true"],  # Prevent privilege escalation
+        "labels": {
+            SANDBOX_LABEL: "true",
+            ROLE_LABEL: role,
+            INSTANCE_LABEL: INSTANCE_ID,
+            CREATED_LABEL: str(int(time.time())),
+        },
+        **delivery,
+    }
+
+
+def remove_container(container, description: str = "container") -> None:
+    """Force-removes a sandbox container; one already gone counts as removed."""
+    try:
+        container.remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    except Exception as e:
+        # Left for the reaper
+        logger.error(f"Failed to remove {description}: {str(e)}")
+    finally:
+        untrack_resource(container.id)
+
+
+def remove_temp_dir(path: str) -> None:
+    """Removes a sandbox code directory; failures are left for the reaper."""
+    try:
+        shutil.rmtree(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Failed to remove temporary directory: {str(e)}")
+    finally:
+        untrack_resource(path)
+
+
+def _write_code(code_dir: str, code: str) -> None:
+    code_file_path = os.path.join(code_dir, "code.py")
+    with open(code_file_path, "w") as f:
+        f.write(code)
+
+
+def _send_stdin(container, code: str) -> None:
+    """Pipes code into a started container's stdin and closes it."""
+    sock = container.attach_socket(params={"stdin": 1, "stream": 1})
+    raw = getattr(sock, "_sock", sock)
+    try:
+        raw.sendall(code.encode("utf-8"))
+    except OSError as e:
+        # The container exited before reading everything; its output says why
+        logger.warning(f"Failed to send code to container stdin: {str(e)}")
+    finally:
+        raw.close()
+
+
+class _Sandbox:
+    """A created sandbox container and how its code gets delivered."""
+
+    def __init__(self, container, lease=None, temp_dir: Optional[str] = None, stdin_code: Optional[str] = None):
+        self.container = container
+        self.lease = lease
+        self.temp_dir = temp_dir
+        self.stdin_code = stdin_code
+
+    def start(self) -> None:
+        self.container.start()
+        if self.stdin_code is not None:
+            _send_stdin(self.container, self.stdin_code)
+
+
+def _prepare_container(docker_client, pool, code, memory_limit, cpu_limit, execution_id, prefix, unbuffered=False) -> _Sandbox:
+    """
+    Leases a warm container or creates a cold one, ready to receive the code.
+
+    With stdin delivery nothing touches the host filesystem: the code is
+    piped in when the sandbox starts. With mount delivery the code is
+    written to a temp dir bind-mounted at /code. Pooled containers use
+    buffered output, so unbuffered (streaming) runs always start cold.
+
+    Returns:
+        A _Sandbox whose container has not been started yet
+    """
+    lease = None
+    if pool is not None and not unbuffered:
+        lease = pool.acquire(memory_limit, cpu_limit)
+    if lease is not None:
+        if lease.code_dir is None:
+            return _Sandbox(lease.container, lease=lease, stdin_code=code)
+        try:
+            _write_code(lease.code_dir, code)
+        except Exception:
+            pool.release(lease)
+            raise
+        return _Sandbox(lease.container, lease=lease)
+
+    if CODE_DELIVERY == "stdin":
+        container = docker_client.containers.create(
+            **container_options(None, memory_limit, cpu_limit, unbuffered=unbuffered)
+        )
+        track_resource(container.id)
+        return _Sandbox(container, stdin_code=code)
+
+    temp_dir = tempfile.mkdtemp(prefix=f"{prefix}_{execution_id}_")
+    track_resource(temp_dir)
+    try:
+        _write_code(temp_dir, code)
+        container = docker_client.containers.create(
+            **container_options(temp_dir, memory_limit, cpu_limit, unbuffered=unbuffered)
+        )
+    except Exception:
+        remove_temp_dir(temp_dir)
+        raise
+    track_resource(container.id)
+    return _Sandbox(container, temp_dir=temp_dir)
+
+
+def _dispose_container(pool, sandbox: _Sandbox, execution_id) -> None:
+    """Removes a used container and its code directory, if any."""
+    if sandbox.lease is not None:
+        # Destroyed and replaced in the background
+        pool.release(sandbox.lease)
+        return
+    remove_container(sandbox.container, f"container for ID {execution_id}")
+    if sandbox.temp_dir is not None:
+        remove_temp_dir(sandbox.temp_dir)
+
+
+class _OutputCollector:
+    """
+    Decodes one output stream incrementally, keeping at most ``max_bytes``.
+
+    Bytes past the cap are counted but dropped, and a truncation marker is
+    emitted when the stream ends.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.kept = 0
+        self.omitted = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    @property
+    def truncated(self) -> bool:
+        return self.omitted > 0
+
+    @property
+    def total(self) -> int:
+        """Bytes received, including those dropped past the cap."""
+        return self.kept + self.omitted
+
+    def feed(self, chunk: bytes) -> str:
+        room = self.max_bytes - self.kept
+        if room <= 0:
+            self.omitted += len(chunk)
+            return ""
+        if len(chunk) > room:
+            self.omitted += len(chunk) - room
+            chunk = chunk[:room]
+        self.kept += len(chunk)
+        return self._decoder.decode(chunk)
+
+    def flush(self) -> str:
+        text = self._decoder.decode(b"", final=True)
+        if self.omitted:
+            text += f"\n[output truncated: {self.omitted} bytes omitted]\n"
+        return text
+
+
+class _ResourceSampler:
+    """
+    Polls a running container's stats to track its peak memory and CPU time.
+
+    Docker only reports point-in-time figures, so memory peaks between
+    samples are missed and a run shorter than the interval may have no
+    sample at all. CPU and throttling counters are cumulative, so the last
+    sample is kept.
+    """
+
+    # Cleared when the daemon does not support single-shot stats (API < 1.41)
+    one_shot_supported = True
+
+    def __init__(self, container, execution_id: str, interval: float = RESOURCE_SAMPLE_INTERVAL):
+        self.container = container
+        self.execution_id = execution_id
+        self.interval = interval
+        self.samples = 0
+        self.peak_memory: Optional[int] = None
+        self.cpu_user: Optional[float] = None
+        self.cpu_system: Optional[float] = None
+        self.throttled_periods: Optional[int] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or not _ResourceSampler.one_shot_supported:
+            return
+        self._thread = threading.Thread(target=self._loop, name=f"stats-{self.execution_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def record(self, stats: Dict[str, Any]) -> None:
+        """Folds one docker stats snapshot into the running figures."""
+        memory = stats.get("memory_stats") or {}
+        if not memory.get("usage"):
+            # The container is not running (yet or anymore)
+            return
+        details = memory.get("stats") or {}
+        # Same working-set figure as `docker stats`: usage minus inactive page cache
+        cache = details.get("inactive_file", details.get("total_inactive_file", 0))
+        working_set = max(memory["usage"] - cache, 0)
+        self.peak_memory = max(self.peak_memory or 0, working_set)
+
+        cpu = stats.get("cpu_stats") or {}
+        usage = cpu.get("cpu_usage") or {}
+        if "usage_in_usermode" in usage:
+            self.cpu_user = usage["usage_in_usermode"] / 1e9
+            self.cpu_system = usage.get("usage_in_kernelmode", 0) / 1e9
+        throttling = cpu.get("throttling_data") or {}
+        if "throttled_periods" in throttling:
+            self.throttled_periods = throttling["throttled_periods"]
+        self.samples += 1
+
+    def _loop(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.record(self.container.stats(stream=False, one_shot=True))
+            except docker.errors.InvalidVersion:
+                _ResourceSampler.one_shot_supported = False
+                logger.warning("Docker API does not support one-shot stats, resource sampling disabled")
+                return
+            except Exception as e:
+                # Usually the container exiting between samples
+                logger.debug(f"Stats sample failed for ID {self.execution_id}: {str(e)}")
+            if self._stopped.wait(self.interval):
+                return
+
+
+def was_oom_killed(container) -> bool:
+    """Whether the kernel OOM killer stopped a finished container."""
+    try:
+        container.reload()
+        return bool(container.attrs["State"].get("OOMKilled"))
+    except Exception:
+        return False
+
+
+def _exit_code(container, execution_id: str) -> int:
+    """Returns the exit code of a container whose output has closed, or -1 if unknown."""
+    try:
+        return container.wait(timeout=5).get("StatusCode")
+    except Exception as e:
+        logger.warning(f"Could not wait for container for ID {execution_id}: {str(e)}")
+    try:
+        container.reload()
+        state = container.attrs["State"]
+        if not state.get("Running"):
+            return state["ExitCode"]
+    except Exception:
+        pass
+    return -1
+
+
+def _iter_sandbox(
+    docker_client,
+    pool,
+    code: str,
+    timeout: int,
+    memory_limit: str,
+    cpu_limit: float,
+    execution_id: str,
+    prefix: str,
+    unbuffered: bool,
+    cancel: Optional[threading.Event] = None,
+    max_output_bytes: int = OUTPUT_MAX_BYTES,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Runs code in a sandbox and yields its output in a single pass.
+
+    The container's output is attached before it starts and demultiplexed
+    into stdout and stderr, each decoded incrementally and capped at
+    ``max_output_bytes``. A watchdog kills the container when the timeout
+    expires or ``cancel`` is set, and force-removes it if it is still
+    producing output SANDBOX_KILL_GRACE seconds later. Output received
+    before the kill is kept. While the container runs, its stats are sampled
+    every RESOURCE_SAMPLE_INTERVAL seconds for the resource accounting.
+
+    Yields:
+        ("stdout", text) and ("stderr", text) chunks, then a final
+        ("exit", {"exit_code", "execution_time", "timed_out", "truncated",
+        "pooled", "resources"}) event
+    """
+    cancel = cancel or threading.Event()
+    finished = threading.Event()
+    output_closed = threading.Event()
+    timed_out = threading.Event()
+    start_time = time.monotonic()
+    with metrics.stage("container_prepare"):
+        sandbox = _prepare_container(
+            docker_client, pool, code, memory_limit, cpu_limit, execution_id, prefix, unbuffered=unbuffered
+        )
+    container = sandbox.container
+    sampler = _ResourceSampler(container, execution_id)
+
+    def watchdog():
+        deadline = time.monotonic() + timeout
+        while not finished.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out.set()
+                break
+            if cancel.wait(min(remaining, 0.25)):
+                break
+        if finished.is_set():
+            return
+        try:
+            container.kill()
+        except Exception as e:
+            logger.warning(f"Failed to kill container for ID {execution_id}: {str(e)}")
+        # Removing the container closes its output stream even if the kill did not take
+        if not output_closed.wait(SANDBOX_KILL_GRACE) and not finished.is_set():
+            logger.error(f"Container for ID {execution_id} survived kill, force-removing it")
+            remove_container(container, f"container for ID {execution_id}")
+
+    try:
+        with metrics.stage("container_start"):
+            chunks = container.attach(stdout=True, stderr=True, stream=True, logs=True, demux=True)
+            sandbox.start()
+        running_since = time.perf_counter()
+        threading.Thread(target=watchdog, name=f"watchdog-{execution_id}", daemon=True).start()
+        sampler.start()
+
+        collectors = {
+            "stdout": _OutputCollector(max_output_bytes),
+            "stderr": _OutputCollector(max_output_bytes),
+        }
+        for stdout_chunk, stderr_chunk in chunks:
+            for name, chunk in (("stdout", stdout_chunk), ("stderr", stderr_chunk)):
+                if chunk:
+                    text = collectors[name].feed(chunk)
+                    if text:
+                        yield name, text
+        output_closed.set()
+        sampler.stop()
+        for name, collector in collectors.items():
+            text = collector.flush()
+            if text:
+                yield name, text
+
+        exit_code = _exit_code(container, execution_id)
+        # OOM kills end in SIGKILL; don't inspect containers that exited normally
+        oom_killed = exit_code in (137, -1) and was_oom_killed(container)
+        metrics.observe_stage("execution", time.perf_counter() - running_since)
+        if oom_killed:
+            logger.warning(f"Execution ran out of memory for ID: {execution_id}")
+        if timed_out.is_set():
+            metrics.EXECUTION_TIMEOUTS.inc()
+            logger.warning(f"Execution timed out for ID: {execution_id}")
+
+        yield "exit", {
+            "exit_code": exit_code,
+            "execution_time": time.monotonic() - start_time,
+            "timed_out": timed_out.is_set(),
+            "truncated": any(c.truncated for c in collectors.values()),
+            "pooled": sandbox.lease is not None,
+            "resources": resource_usage(
+                memory_limit,
+                peak_memory=sampler.peak_memory,
+                cpu_user=sampler.cpu_user,
+                cpu_system=sampler.cpu_system,
+                throttled_periods=sampler.throttled_periods,
+                oom_killed=oom_killed,
+                stdout_bytes=collectors["stdout"].total,
+                stderr_bytes=collectors["stderr"].total,
+                samples=sampler.samples,
+            ),
+        }
+    finally:
+        finished.set()
+        sampler.stop()
+        with metrics.stage("cleanup"):
+            _dispose_container(pool, sandbox, execution_id)
+
+
+def run_in_sandbox(
+    docker_client,
+    pool,
+    code: str,
+    timeout: int,
+    memory_limit: str,
+    cpu_limit: float,
+    execution_id: str,
+    prefix: str = "code_exec",
+    cancel: Optional[threading.Event] = None,
+) -> SandboxResult:
+    """
+    Runs Python code in an isolated container and collects its output.
+
+    A pre-warmed container is taken from ``pool`` when one matches the
+    requested limits; otherwise a container is created from scratch. The
+    code is delivered according to CODE_DELIVERY. Output is read once,
+    demultiplexed, and capped at OUTPUT_MAX_BYTES per stream.
+
+    Args:
+        docker_client: Docker client used for cold starts
+        pool: ContainerPool to lease warm containers from (may be None)
+        code: The Python code to execute
+        timeout: Execution timeout in seconds
+        memory_limit: Docker memory limit (e.g. "100m")
+        cpu_limit: Fraction of a CPU core the container may use
+        execution_id: Identifier used in logs and temp dir names
+        prefix: Temp dir prefix for mount delivery
+        cancel: Setting this event kills the container early
+
+    Returns:
+        SandboxResult with the captured output and exit code
+    """
+    output = {"stdout": [], "stderr": []}
+    summary = {}
+    for event, payload in _iter_sandbox(
+        docker_client, pool, code, timeout, memory_limit, cpu_limit, execution_id, prefix,
+        unbuffered=False, cancel=cancel,
+    ):
+        if event == "exit":
+            summary = payload
+        else:
+            output[event].append(payload)
+
+    return SandboxResult(
+        stdout="".join(output["stdout"]),
+        stderr="".join(output["stderr"]),
+        exit_code=summary["exit_code"],
+        execution_time=summary["execution_time"],
+        pooled=summary["pooled"],
+        truncated=summary["truncated"],
+        timed_out=summary["timed_out"],
+        resources=summary["resources"],
+    )
+
+
+def stream_in_sandbox(
+    docker_client,
+    pool,
+    code: str,
+    timeout: int,
+    memory_limit: str,
+    cpu_limit: float,
+    execution_id: str,
+    prefix: str = "code_exec",
+    cancel: Optional[threading.Event] = None,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Runs Python code in an isolated container, yielding output as it arrives.
+
+    Uses a cold container with unbuffered Python output so chunks are
+    forwarded as soon as they are written. Setting ``cancel`` kills the
+    container.
+
+    Yields:
+        ("stdout", text) and ("stderr", text) chunks, then a final
+        ("exit", {...}) event
+    """
+    return _iter_sandbox(
+        docker_client, pool, code, timeout, memory_limit, cpu_limit, execution_id, prefix,
+        unbuffered=True, cancel=cancel,
+    )
+
+
+class SandboxExecutor:
+    """
+    Runs sandbox executions without blocking the event loop.
+
+    The docker SDK is synchronous, so every execution is offloaded to a
+    dedicated thread pool. An asyncio semaphore caps how many executions are
+    in flight; callers beyond the ceiling wait without holding a thread.
+    When a ResourceScheduler is given, each execution first reserves its
+    memory and CPU limits against host capacity. When a ForkServerRunner is
+    given, blocking runs try an idle fork server before a container. When an
+    ExecutionResultCache is given, cacheable runs are looked up there first.
+    """
+
+    def __init__(
+        self,
+        docker_client,
+        pool=None,
+        concurrency: int = EXECUTION_CONCURRENCY,
+        scheduler=None,
+        runner=None,
+        result_cache=None,
+    ):
+        self.docker_client = docker_client
+        self.pool = pool
+        self.scheduler = scheduler
+        self.runner = runner
+        self.result_cache = result_cache
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="sandbox")
+
+    async def call(self, fn: Callable, *args, **kwargs):
+        """Runs a blocking docker call on the sandbox thread pool."""
+        loop = asyncio.get_running_loop()
+        # Carry the caller's context so stage timings reach its breakdown
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, lambda: context.run(fn, *args, **kwargs))
+
+    async def admit(self, memory_limit: str, cpu_limit: float, priority: int = 0):
+        """
+        Reserves host capacity for one execution.
+
+        Returns:
+            A Reservation, or None when no scheduler is configured
+
+        Raises:
+            AdmissionRejected: If the execution cannot be admitted
+        """
+        if self.scheduler is None:
+            return None
+        with metrics.stage("admission"):
+            return await self.scheduler.acquire(memory_limit, cpu_limit, priority)
+
+    async def run(
+        self,
+        code: str,
+        timeout: int,
+        memory_limit: str,
+        cpu_limit: float,
+        execution_id: str,
+        prefix: str = "code_exec",
+        priority: int = 0,
+        cacheable: bool = False,
+    ) -> SandboxResult:
+        """
+        Executes code in the sandbox once capacity and a concurrency slot are free.
+
+        Cancelling the call kills the container; its concurrency slot and
+        reservation are held until the container is gone.
+
+        Args:
+            code: The Python code to execute
+            timeout: Execution timeout in seconds
+            memory_limit: Docker memory limit (e.g. "100m")
+            cpu_limit: Fraction of a CPU core the container may use
+            execution_id: Identifier used in logs and temp dir names
+            prefix: Temp dir prefix for cold starts
+            priority: Admission priority when waiting for capacity
+            cacheable: Serve the result from, and store it in, the result cache
+
+        Returns:
+            SandboxResult with the captured output and exit code
+
+        Raises:
+            AdmissionRejected: If the scheduler rejects the execution
+        """
+        cache_key = None
+        if cacheable and self.result_cache is not None and self.result_cache.enabled:
+            with metrics.stage("result_cache"):
+                cache_key = await asyncio.to_thread(
+                    self.result_cache.key, self.docker_client, code, timeout, memory_limit, cpu_limit
+                )
+                cached = None if cache_key is None else await asyncio.to_thread(self.result_cache.get, cache_key)
+            if cached is not None:
+                logger.info(f"Serving cached result for ID: {execution_id}")
+                return cached
+
+        result = await self._run(code, timeout, memory_limit, cpu_limit, execution_id, prefix, priority)
+        if cache_key is not None:
+            await asyncio.to_thread(self.result_cache.set, cache_key, result)
+        return result
+
+    async def _run(
+        self,
+        code: str,
+        timeout: int,
+        memory_limit: str,
+        cpu_limit: float,
+        execution_id: str,
+        prefix: str,
+        priority: int,
+    ) -> SandboxResult:
+        reservation = await self.admit(memory_limit, cpu_limit, priority)
+        await self._acquire_slot(reservation)
+
+        cancel = threading.Event()
+        future = asyncio.ensure_future(self.call(
+            self._run_blocking,
+            code,
+            timeout=timeout,
+            memory_limit=memory_limit,
+            cpu_limit=cpu_limit,
+            execution_id=execution_id,
+            prefix=prefix,
+            cancel=cancel,
+        ))
+        future.add_done_callback(lambda done: self._release_slot(reservation, done))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Kill the container; the slot and reservation are freed once it is gone
+            cancel.set()
+            raise
+
+    def _run_blocking(
+        self,
+        code: str,
+        timeout: int,
+        memory_limit: str,
+        cpu_limit: float,
+        execution_id: str,
+        prefix: str,
+        cancel: threading.Event,
+    ) -> Optional[SandboxResult]:
+        """Runs code on an idle fork server if there is one, otherwise in a container."""
+        if self.runner is not None:
+            try:
+                result = self.runner.try_run(code, timeout, memory_limit, cpu_limit, execution_id, cancel)
+            except Exception as e:
+                logger.warning(f"Fork server failed for ID {execution_id}, using a container: {str(e)}")
+                result = None
+            if result is not None:
+                return result
+            if cancel.is_set():
+                # The caller is gone; don't start a container nobody waits for
+                return None
+        return run_in_sandbox(
+            self.docker_client,
+            self.pool,
+            code,
+            timeout=timeout,
+            memory_limit=memory_limit,
+            cpu_limit=cpu_limit,
+            execution_id=execution_id,
+            prefix=prefix,
+            cancel=cancel,
+        )
+
+    async def _acquire_slot(self, reservation) -> None:
+        """Waits for a concurrency slot, releasing ``reservation`` if the wait fails."""
+        try:
+            self.waiting += 1
+            try:
+                with metrics.stage("concurrency_wait"):
+                    await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        except BaseException:
+            if reservation is not None:
+                reservation.release()
+            raise
+        self.in_flight += 1
+
+    def _release_slot(self, reservation, future=None) -> None:
+        self.in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+        if reservation is not None:
+            reservation.release()
+        if future is not None and not future.cancelled():
+            # Mark the outcome as retrieved when the caller was cancelled
+            future.exception()
+
+    async def stream(
+        self,
+        code: str,
+        timeout: int,
+        memory_limit: str,
+        cpu_limit: float,
+        execution_id: str,
+        prefix: str = "code_exec",
+        reservation=None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streams execution events once a concurrency slot is free.
+
+        Events from stream_in_sandbox are handed over through a bounded queue,
+        so a slow consumer applies backpressure to the container instead of
+        output piling up in memory. Closing the iterator early (for example
+        when the client disconnects) kills the container.
+
+        Pass a ``reservation`` obtained from admit() beforehand so admission
+        can be rejected before a streaming response has started; it is
+        released when the execution finishes.
+        """
+        await self._acquire_slot(reservation)
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        cancel = threading.Event()
+
+        def put(event) -> bool:
+            future = asyncio.run_coroutine_threadsafe(queue.put(event), loop)
+            while not cancel.is_set():
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except FutureTimeoutError:
+                    # Not the builtin TimeoutError before Python 3.11
+                    continue
+            future.cancel()
+            return False
+
+        def produce():
+            try:
+                for event in stream_in_sandbox(
+                    self.docker_client,
+                    self.pool,
+                    code,
+                    timeout=timeout,
+                    memory_limit=memory_limit,
+                    cpu_limit=cpu_limit,
+                    execution_id=execution_id,
+                    prefix=prefix,
+                    cancel=cancel,
+                ):
+                    if not put(event):
+                        return
+            except Exception as e:
+                logger.error(f"Container execution error: {str(e)}")
+                put(("error", {"detail": f"Execution error: {str(e)}"}))
+            finally:
+                put(None)
+
+        future = loop.run_in_executor(self._executor, produce)
+        future.add_done_callback(lambda done: self._release_slot(reservation, done))
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            cancel.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns concurrency counters for the executor."""
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,226 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from docker.utils import parse_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def _host_memory() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+# Host capacity reserved by in-flight executions ("0" disables the limit)
+SCHEDULER_MEMORY_CAPACITY = os.getenv("SCHEDULER_MEMORY_CAPACITY") or str(int(_host_memory() * 0.8))
+SCHEDULER_CPU_CAPACITY = float(os.getenv("SCHEDULER_CPU_CAPACITY", str(os.cpu_count() or 1)))
+# Executions allowed to wait for capacity before new ones get 429
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "100"))
+# Seconds an execution may wait for capacity before it is rejected
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "30"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when an execution cannot be admitted; maps to HTTP 429."""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _Waiter:
+    sort_key: Tuple[int, int]
+    memory: int = field(compare=False)
+    cpus: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class Reservation:
+    """Memory/CPU budget held by one execution until released."""
+
+    def __init__(self, scheduler: "ResourceScheduler", memory: int, cpus: float):
+        self.scheduler = scheduler
+        self.memory = memory
+        self.cpus = cpus
+        self.granted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.scheduler._release(self)
+
+    async def __aenter__(self) -> "Reservation":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class ResourceScheduler:
+    """
+    Admission control for sandbox executions.
+
+    Each execution reserves its memory and CPU limits against the configured
+    host capacity. Executions that do not fit wait in a bounded priority
+    queue (higher priority first, FIFO within a priority) and are admitted as
+    reservations are released. When the queue is full, or an execution waits
+    longer than ``max_wait``, AdmissionRejected is raised.
+    """
+
+    def __init__(
+        self,
+        memory_capacity: int = parse_bytes(SCHEDULER_MEMORY_CAPACITY),
+        cpu_capacity: float = SCHEDULER_CPU_CAPACITY,
+        max_queue: int = SCHEDULER_MAX_QUEUE,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+    ):
+        self.memory_capacity = memory_capacity
+        self.cpu_capacity = cpu_capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.reserved_memory = 0
+        self.reserved_cpus = 0.0
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.queued_total = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._hold_time_avg = 1.0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory_capacity > 0 or self.cpu_capacity > 0
+
+    def _fits(self, memory: int, cpus: float) -> bool:
+        if self.memory_capacity > 0 and self.reserved_memory + memory > self.memory_capacity:
+            return False
+        if self.cpu_capacity > 0 and self.reserved_cpus + cpus > self.cpu_capacity + 1e-9:
+            return False
+        return True
+
+    def queue_depth(self) -> int:
+        return sum(1 for w in self._waiters if not w.future.done())
+
+    def queued_demand(self) -> Tuple[int, float]:
+        """Returns the memory and CPUs requested by executions still waiting."""
+        waiting = [w for w in self._waiters if not w.future.done()]
+        return sum(w.memory for w in waiting), sum(w.cpus for w in waiting)
+
+    def retry_after(self) -> int:
+        """Estimates how many seconds a rejected client should wait."""
+        return max(1, math.ceil(self._hold_time_avg))
+
+    async def acquire(self, memory_limit: str, cpu_limit: float, priority: int = 0) -> Reservation:
+        """
+        Reserves capacity for one execution, waiting if necessary.
+
+        Args:
+            memory_limit: Docker memory limit of the execution (e.g. "100m")
+            cpu_limit: CPU limit of the execution in cores
+            priority: Higher values are admitted first when queued
+
+        Returns:
+            A Reservation to release once the container is gone
+
+        Raises:
+            ValueError: If the request can never fit on this host
+            AdmissionRejected: If the queue is full or the wait times out
+        """
+        memory = parse_bytes(memory_limit)
+        cpus = float(cpu_limit)
+        if (0 < self.memory_capacity < memory) or (0 < self.cpu_capacity < cpus):
+            raise ValueError(
+                f"Requested resources ({memory_limit}, {cpu_limit} CPU) exceed host capacity"
+            )
+
+        if self.queue_depth() == 0 and self._fits(memory, cpus):
+            return self._grant(memory, cpus)
+
+        if self.queue_depth() >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("Execution queue is full", self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter((-priority, next(self._seq)), memory, cpus, loop.create_future())
+        heapq.heappush(self._waiters, waiter)
+        self.queued_total += 1
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter.future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._wake()
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"Timed out after {self.max_wait:.0f}s waiting for execution capacity",
+                self.retry_after(),
+            )
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result().release()
+            self._wake()
+            raise
+        finally:
+            waited = time.monotonic() - queued_at
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+        return waiter.future.result()
+
+    def _grant(self, memory: int, cpus: float) -> Reservation:
+        self.reserved_memory += memory
+        self.reserved_cpus += cpus
+        self.active += 1
+        self.admitted += 1
+        return Reservation(self, memory, cpus)
+
+    def _release(self, reservation: Reservation) -> None:
+        self.reserved_memory -= reservation.memory
+        self.reserved_cpus -= reservation.cpus
+        self.active -= 1
+        held = time.monotonic() - reservation.granted_at
+        self._hold_time_avg = 0.9 * self._hold_time_avg + 0.1 * held
+        self._wake()
+
+    def _wake(self) -> None:
+        # Head-of-line admission keeps large requests from starving
+        while self._waiters:
+            head = self._waiters[0]
+            if head.future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._fits(head.memory, head.cpus):
+                break
+            heapq.heappop(self._waiters)
+            head.future.set_result(self._grant(head.memory, head.cpus))
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns reserved capacity, queue depth and wait times."""
+        return {
+            "enabled": self.enabled,
+            "memory_capacity": self.memory_capacity,
+            "cpu_capacity": self.cpu_capacity,
+            "reserved_memory": self.reserved_memory,
+            "reserved_cpus": round(self.reserved_cpus, 3),
+            "active": self.active,
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "queued_total": self.queued_total,
+            "wait_time_avg": self.wait_time_total / self.queued_total if self.queued_total else 0.0,
+            "wait_time_max": self.wait_time_max,
+        }
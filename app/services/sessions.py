@@ -0,0 +1,349 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from docker.utils import parse_bytes
+
+from services import metrics
+from services.fork_runner import ForkServerError, ServerConnection, response_resources
+from services.sandbox import (
+    OUTPUT_MAX_BYTES,
+    SandboxResult,
+    container_options,
+    track_resource,
+    was_oom_killed,
+)
+
+logger = logging.getLogger(__name__)
+
+# Maximum open sessions per worker process (0 disables sessions)
+SESSION_MAX = int(os.getenv("SESSION_MAX", "20"))
+# Seconds a session may sit idle before it is closed
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "600"))
+# Memory limit of a session sandbox when the client does not ask for one
+SESSION_MEMORY_LIMIT = os.getenv("SESSION_MEMORY_LIMIT", "256m")
+# Largest memory limit a client may ask for
+SESSION_MAX_MEMORY_LIMIT = os.getenv("SESSION_MAX_MEMORY_LIMIT", "1g")
+# Extra seconds a snippet has to stop after its timeout before the session is closed
+SESSION_INTERRUPT_GRACE = float(os.getenv("SESSION_INTERRUPT_GRACE", "5"))
+
+
+class SessionNotFound(Exception):
+    """Raised for an unknown, expired or closed session; maps to HTTP 404."""
+
+
+class SessionLimitReached(Exception):
+    """Raised when no more sessions may be opened; maps to HTTP 429."""
+
+
+class SessionFailed(Exception):
+    """Raised when a session's sandbox died mid-request; maps to HTTP 410."""
+
+
+class Session:
+    """One interactive session: a long-lived sandbox and its interpreter namespace."""
+
+    def __init__(self, server: ServerConnection, reservation, backend: str, memory_limit: str, cpu_limit: float):
+        self.id = uuid.uuid4().hex
+        self.server = server
+        self.reservation = reservation
+        self.backend = backend
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.executions = 0
+        self.closed = False
+        # One snippet at a time; responses are read in order
+        self.lock = asyncio.Lock()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "backend": self.backend,
+            "memory_limit": self.memory_limit,
+            "cpu_limit": self.cpu_limit,
+            "created_at": self.created_at,
+            "idle_seconds": time.monotonic() - self.last_used,
+            "executions": self.executions,
+            "busy": self.lock.locked(),
+        }
+
+
+class SessionManager:
+    """
+    Interactive sessions, each backed by one long-lived sandbox.
+
+    A session's container runs ``dockerfile/session_server.py`` with the same
+    isolation flags as every other sandbox and its own memory and CPU limits,
+    which stay reserved with the endpoint's admission scheduler until the
+    session closes. Snippets run one at a time against a persistent
+    namespace, so later snippets reuse the data and imports of earlier ones.
+    A snippet that runs past its timeout is interrupted and the namespace is
+    kept; if it does not stop within ``SESSION_INTERRUPT_GRACE`` seconds, or
+    the sandbox dies (for example when it runs out of memory), the session is
+    closed. Sessions idle for ``idle_ttl`` seconds are closed in the
+    background. Sessions live in this process only.
+    """
+
+    def __init__(
+        self,
+        router,
+        max_sessions: int = SESSION_MAX,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        memory_limit: str = SESSION_MEMORY_LIMIT,
+        max_memory_limit: str = SESSION_MAX_MEMORY_LIMIT,
+    ):
+        self.router = router
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.memory_limit = memory_limit
+        self.max_memory_limit = max_memory_limit
+        self.created = 0
+        self.executions = 0
+        self.closed: Dict[str, int] = {}
+        self._sessions: Dict[str, Session] = {}
+        self._opening = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(2, max_sessions), thread_name_prefix="session")
+        self._evict_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_sessions > 0
+
+    async def start(self) -> None:
+        if self.enabled:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def stop(self) -> None:
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            try:
+                await self._evict_task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.gather(
+            *(self._close(session, "shutdown") for session in list(self._sessions.values())),
+            return_exceptions=True,
+        )
+        self._executor.shutdown(wait=False)
+
+    async def create(self, memory_limit: Optional[str] = None, cpu_limit: float = 0.5) -> Session:
+        """
+        Opens a session on the least-loaded docker endpoint.
+
+        Args:
+            memory_limit: Docker memory limit of the session sandbox
+                (defaults to SESSION_MEMORY_LIMIT)
+            cpu_limit: Fraction of a CPU core the session may use
+
+        Returns:
+            The new Session
+
+        Raises:
+            SessionLimitReached: If sessions are disabled or at the cap
+            ValueError: If the memory limit is above SESSION_MAX_MEMORY_LIMIT
+            AdmissionRejected: If no endpoint has capacity for the session
+        """
+        if not self.enabled:
+            raise SessionLimitReached("Sessions are disabled")
+        if len(self._sessions) + self._opening >= self.max_sessions:
+            raise SessionLimitReached(f"Session limit of {self.max_sessions} reached")
+        memory_limit = memory_limit or self.memory_limit
+        if parse_bytes(memory_limit) > parse_bytes(self.max_memory_limit):
+            raise ValueError(f"Session memory limit may not exceed {self.max_memory_limit}")
+
+        self._opening += 1
+        try:
+            reservation = await self.router.admit(memory_limit, cpu_limit)
+            backend = self.router.backend_for(reservation)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, self._spawn, backend.client, memory_limit, cpu_limit)
+            try:
+                server = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The caller is gone; close the sandbox once it is up
+                future.add_done_callback(
+                    lambda done: done.exception() is None and self._executor.submit(done.result().close)
+                )
+                reservation.release()
+                raise
+            except BaseException:
+                reservation.release()
+                raise
+        finally:
+            self._opening -= 1
+
+        session = Session(server, reservation, backend.name, memory_limit, float(cpu_limit))
+        self._sessions[session.id] = session
+        self.created += 1
+        logger.info(f"Opened session {session.id} on {backend.name} ({memory_limit}, {cpu_limit} CPU)")
+        return session
+
+    def get(self, session_id: str) -> Session:
+        """
+        Returns the open session with this id.
+
+        Raises:
+            SessionNotFound: If there is no open session with this id
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound("Session not found")
+        return session
+
+    async def execute(self, session_id: str, code: str, timeout: int, execution_id: str) -> SandboxResult:
+        """
+        Runs a snippet in a session, after any snippet already running there.
+
+        Cancelling the call interrupts the snippet; the session stays open.
+
+        Args:
+            session_id: Id returned by create()
+            code: The Python code to execute
+            timeout: Execution timeout in seconds
+            execution_id: Identifier used in logs
+
+        Returns:
+            SandboxResult with the captured output and exit code
+
+        Raises:
+            SessionNotFound: If the session does not exist or closes while waiting
+            SessionFailed: If the sandbox died; the session is closed
+        """
+        session = self.get(session_id)
+        await session.lock.acquire()
+        if session.closed:
+            session.lock.release()
+            raise SessionNotFound("Session not found")
+        session.last_used = time.monotonic()
+
+        cancel = threading.Event()
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._executor, lambda: context.run(self._run_blocking, session, code, timeout, execution_id, cancel)
+        )
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Interrupt the snippet; the next one may start once its response is read
+            cancel.set()
+            future.add_done_callback(lambda done: self._finish(session, done))
+            raise
+        except (ForkServerError, OSError) as e:
+            self._finish(session)
+            detail = str(e)
+            if await loop.run_in_executor(self._executor, was_oom_killed, session.server.container):
+                detail = "ran out of memory"
+            logger.error(f"Session {session.id} failed: {detail}")
+            await self._close(session, "failed")
+            raise SessionFailed(f"Session sandbox stopped ({detail}); the session is closed")
+        self._finish(session)
+        session.executions += 1
+        self.executions += 1
+        return result
+
+    async def close(self, session_id: str) -> Session:
+        """
+        Closes a session and removes its sandbox, killing any running snippet.
+
+        Raises:
+            SessionNotFound: If there is no open session with this id
+        """
+        session = self.get(session_id)
+        await self._close(session, "closed")
+        return session
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "active": len(self._sessions),
+            "busy": sum(1 for session in self._sessions.values() if session.lock.locked()),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "memory_limit": self.memory_limit,
+            "max_memory_limit": self.max_memory_limit,
+            "created": self.created,
+            "executions": self.executions,
+            "closed": dict(self.closed),
+        }
+
+    def _spawn(self, docker_client, memory_limit: str, cpu_limit: float) -> ServerConnection:
+        options = container_options(None, memory_limit, cpu_limit, role="session")
+        options.update(
+            command=["--session"],
+            stdin_once=False,  # stdin stays open across snippets
+        )
+        container = docker_client.containers.create(**options)
+        track_resource(container.id)
+        # Snippet output written straight to file descriptors is only worth a debug line
+        server = ServerConnection(container, label="Session", stderr_level=logging.DEBUG)
+        try:
+            server.connect()
+            container.start()
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _run_blocking(
+        self, session: Session, code: str, timeout: int, execution_id: str, cancel: threading.Event
+    ) -> SandboxResult:
+        started = time.monotonic()
+        session.server.send({"code": code, "timeout": timeout, "max_output": OUTPUT_MAX_BYTES})
+        response = session.server.receive(started + timeout + SESSION_INTERRUPT_GRACE, cancel)
+        if "error" in response:
+            raise ForkServerError(response["error"])
+        elapsed = time.monotonic() - started
+        metrics.observe_stage("session_execution", elapsed)
+        if response.get("timed_out"):
+            metrics.EXECUTION_TIMEOUTS.inc()
+            logger.warning(f"Execution timed out for ID: {execution_id} (session {session.id})")
+        return SandboxResult(
+            stdout=response["stdout"],
+            stderr=response["stderr"],
+            exit_code=response["exit_code"],
+            execution_time=elapsed,
+            pooled=True,
+            truncated=response.get("truncated", False),
+            timed_out=response.get("timed_out", False),
+            resources=response_resources(response, session.memory_limit),
+        )
+
+    def _finish(self, session: Session, future=None) -> None:
+        session.last_used = time.monotonic()
+        session.lock.release()
+        if future is not None and not future.cancelled() and future.exception() is not None:
+            # The interrupted snippet never answered; the sandbox is unusable
+            asyncio.ensure_future(self._close(session, "failed"))
+
+    async def _close(self, session: Session, reason: str) -> None:
+        if session.closed:
+            return
+        session.closed = True
+        self._sessions.pop(session.id, None)
+        self.closed[reason] = self.closed.get(reason, 0) + 1
+        metrics.SESSIONS_CLOSED.inc(reason=reason)
+        logger.info(f"Closing session {session.id} ({reason})")
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, session.server.close)
+        finally:
+            session.reservation.release()
+
+    async def _evict_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(1.0, min(self.idle_ttl / 4, 30)))
+            now = time.monotonic()
+            for session in list(self._sessions.values()):
+                if not session.lock.locked() and now - session.last_used > self.idle_ttl:
+                    try:
+                        await self._close(session, "idle")
+                    except Exception as e:
+                        logger.error(f"Failed to close idle session {session.id}: {str(e)}")
@@ -0,0 +1,269 @@
+import ast
+import string
+import logging
+import importlib
+from types import ModuleType
+from collections import Counter
+from typing import Any, Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Verdicts returned by analyze_code
+SAFE = "safe"
+UNSAFE = "unsafe"
+NEEDS_REVIEW = "needs_review"
+
+# Pure-compute standard library modules that are safe inside the sandbox
+SAFE_MODULES = {
+    "abc", "array", "bisect", "calendar", "cmath", "collections", "copy",
+    "dataclasses", "datetime", "decimal", "enum", "fractions", "functools",
+    "hashlib", "heapq", "itertools", "json", "math", "numbers", "operator",
+    "pprint", "random", "re", "statistics", "string", "textwrap", "time",
+    "typing", "unicodedata", "uuid", "zlib", "base64", "binascii", "struct",
+    "contextlib", "difflib", "graphlib", "secrets", "colorsys",
+}
+
+# Modules that give access to processes, the filesystem, the network or the
+# interpreter internals
+UNSAFE_MODULES = {
+    "os", "posix", "nt", "subprocess", "_posixsubprocess", "pty", "socket",
+    "socketserver", "ssl", "select", "selectors", "shutil", "ctypes", "cffi",
+    "multiprocessing", "signal", "resource", "importlib", "imp", "pickle",
+    "marshal", "shelve", "builtins", "code", "codeop", "runpy", "gc",
+    "http", "urllib", "urllib3", "requests", "httpx", "aiohttp", "ftplib",
+    "smtplib", "poplib", "imaplib", "telnetlib", "xmlrpc", "webbrowser",
+}
+
+# Builtins that execute or import arbitrary code
+UNSAFE_BUILTINS = {"eval", "exec", "compile", "__import__", "breakpoint"}
+
+# Builtins that are not dangerous on their own but deserve a closer look
+REVIEW_BUILTINS = {"open", "getattr", "setattr", "delattr", "globals", "locals", "vars", "input", "memoryview"}
+
+# Attributes used to escape restricted namespaces
+UNSAFE_ATTRIBUTES = {
+    "__subclasses__", "__globals__", "__builtins__", "__code__", "__bases__",
+    "__base__", "__mro__", "__class__", "__dict__", "__getattribute__",
+    "__import__", "__loader__", "__spec__", "__closure__", "__func__",
+    "__self__", "__reduce__", "__reduce_ex__", "f_globals", "f_locals",
+    "f_back", "f_builtins", "gi_frame", "cr_frame", "tb_frame",
+}
+
+# Attribute names that reach a dangerous module or builtin through another
+# module's namespace, such as ``typing.sys`` or ``dataclasses.builtins``
+REEXPORTED_NAMES = UNSAFE_MODULES | UNSAFE_BUILTINS | {"sys"}
+
+# Qualified names that match REEXPORTED_NAMES but are harmless
+SAFE_QUALIFIED_NAMES = {"re.compile"}
+
+# Helpers that turn a string into attribute lookups or evaluate it as code,
+# such as ``operator.attrgetter("__class__.__base__")`` or ``typing.get_type_hints``
+STRING_LOOKUP_NAMES = {
+    "attrgetter", "methodcaller", "get_type_hints", "get_annotations",
+    "ForwardRef", "Formatter", "get_field", "getmembers", "getmembers_static",
+    "getattr_static",
+}
+
+# String methods whose replacement fields can read attributes and items
+FORMAT_METHODS = {"format", "format_map"}
+
+_verdicts: Counter = Counter()
+
+
+class _Analyzer(ast.NodeVisitor):
+    def __init__(self, defined_names: Set[str], module_aliases: Dict[str, str]):
+        self.defined_names = defined_names
+        self.module_aliases = module_aliases
+        self.unsafe: List[str] = []
+        self.review: List[str] = []
+
+    def _check_module(self, name: str, lineno: int) -> None:
+        root = name.split(".")[0]
+        if root in UNSAFE_MODULES:
+            self.unsafe.append(f"imports '{name}' (line {lineno})")
+        elif root not in SAFE_MODULES:
+            self.review.append(f"imports '{name}' (line {lineno})")
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            self._check_module(alias.name, node.lineno)
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        if node.level:
+            self.review.append(f"relative import (line {node.lineno})")
+        else:
+            self._check_module(node.module or "", node.lineno)
+        for alias in node.names:
+            # The same re-exports as attribute access, e.g. from random import _os
+            if alias.name == "*":
+                self.review.append(f"imports * from '{node.module}' (line {node.lineno})")
+            elif (alias.name.startswith("_") or alias.name in REEXPORTED_NAMES
+                    or alias.name in STRING_LOOKUP_NAMES
+                    or _reexported_module(node.module or "", alias.name)):
+                self.review.append(f"imports '{alias.name}' from '{node.module}' (line {node.lineno})")
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name) -> None:
+        if node.id not in self.defined_names:
+            if node.id in UNSAFE_BUILTINS or node.id == "__builtins__":
+                self.unsafe.append(f"uses '{node.id}' (line {node.lineno})")
+            elif node.id in REVIEW_BUILTINS or node.id in STRING_LOOKUP_NAMES:
+                self.review.append(f"uses '{node.id}' (line {node.lineno})")
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        if node.attr in UNSAFE_ATTRIBUTES:
+            self.unsafe.append(f"accesses '{node.attr}' (line {node.lineno})")
+        elif node.attr.startswith("_"):
+            # Private names of allowed modules can be other modules (random._os)
+            self.review.append(f"accesses '{node.attr}' (line {node.lineno})")
+        elif node.attr in REEXPORTED_NAMES and _qualified_name(node) not in SAFE_QUALIFIED_NAMES:
+            self.review.append(f"accesses '{node.attr}' (line {node.lineno})")
+        elif node.attr in STRING_LOOKUP_NAMES:
+            self.review.append(f"accesses '{node.attr}' (line {node.lineno})")
+        elif (isinstance(node.value, ast.Name) and node.value.id in self.module_aliases
+                and _reexported_module(self.module_aliases[node.value.id], node.attr)):
+            # Another module imported by an allowed one, e.g. dataclasses.inspect
+            self.review.append(f"accesses '{node.attr}' (line {node.lineno})")
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        if node.returns is not None:
+            self._check_annotation(node.returns)
+        self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_arg(self, node: ast.arg) -> None:
+        if node.annotation is not None:
+            self._check_annotation(node.annotation)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node: ast.AnnAssign) -> None:
+        self._check_annotation(node.annotation)
+        self.generic_visit(node)
+
+    def _check_annotation(self, annotation: ast.AST) -> None:
+        # String annotations are evaluated by get_type_hints, which
+        # functools.singledispatch calls, so check them as code
+        for node in ast.walk(annotation):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                try:
+                    expression = ast.parse(node.value.strip(), mode="eval")
+                except (SyntaxError, ValueError):
+                    # Evaluating it would only raise
+                    continue
+                for child in ast.walk(expression):
+                    if hasattr(child, "lineno"):
+                        child.lineno = node.lineno
+                self.visit(expression)
+
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr in FORMAT_METHODS:
+            template = func.value
+            if isinstance(template, ast.Name) and template.id == "str" and node.args:
+                # str.format(template, ...)
+                template = node.args[0]
+            if not (isinstance(template, ast.Constant) and isinstance(template.value, str)):
+                self.review.append(f"formats a string that is not a literal (line {node.lineno})")
+            elif _has_lookup_fields(template.value):
+                self.review.append(f"formats attribute or item lookups (line {node.lineno})")
+        self.generic_visit(node)
+
+
+def _qualified_name(node: ast.Attribute) -> str:
+    """Returns ``name.attr`` for an attribute of a plain name, or just the attribute."""
+    if isinstance(node.value, ast.Name):
+        return f"{node.value.id}.{node.attr}"
+    return node.attr
+
+
+def _reexported_module(module: str, name: str) -> bool:
+    """Whether ``module.name`` is another module that is not allow-listed, e.g. ``dataclasses.inspect``."""
+    if module.split(".")[0] not in SAFE_MODULES:
+        return False
+    try:
+        value = getattr(importlib.import_module(module), name, None)
+    except ImportError:
+        return False
+    return isinstance(value, ModuleType) and value.__name__.split(".")[0] not in SAFE_MODULES
+
+
+def _has_lookup_fields(template: str) -> bool:
+    """Whether a format string has fields like ``{0.attr}`` or ``{0[key]}``, including nested ones."""
+    try:
+        fields = list(string.Formatter().parse(template))
+    except ValueError:
+        # Malformed templates fail at run time anyway; let a reviewer decide
+        return True
+    for _, field_name, format_spec, _ in fields:
+        if field_name and ("." in field_name or "[" in field_name):
+            return True
+        if format_spec and _has_lookup_fields(format_spec):
+            return True
+    return False
+
+
+def _defined_names(tree: ast.AST) -> Set[str]:
+    """Collects names the snippet defines itself, which shadow builtins."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+    return names
+
+
+def _module_aliases(tree: ast.AST) -> Dict[str, str]:
+    """Maps the names bound by ``import`` statements to the modules they refer to."""
+    aliases = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    aliases[alias.asname] = alias.name
+                else:
+                    root = alias.name.split(".")[0]
+                    aliases[root] = root
+    return aliases
+
+
+def analyze_code(code: str) -> Tuple[str, str]:
+    """
+    Classifies code without any network call.
+
+    Args:
+        code: The Python code to analyze
+
+    Returns:
+        Tuple containing:
+        - verdict: SAFE, UNSAFE or NEEDS_REVIEW
+        - reason: Human readable summary of the findings
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) as e:
+        _verdicts[NEEDS_REVIEW] += 1
+        return NEEDS_REVIEW, f"Static analysis could not parse the code: {str(e)}"
+
+    analyzer = _Analyzer(_defined_names(tree), _module_aliases(tree))
+    analyzer.visit(tree)
+
+    if analyzer.unsafe:
+        verdict, reason = UNSAFE, "Static analysis rejected the code: " + "; ".join(analyzer.unsafe)
+    elif analyzer.review:
+        verdict, reason = NEEDS_REVIEW, "Static analysis requires review: " + "; ".join(analyzer.review)
+    else:
+        verdict, reason = SAFE, "Static analysis: pure computation using only allowed modules and builtins"
+    _verdicts[verdict] += 1
+    return verdict, reason
+
+
+def stats() -> Dict[str, Any]:
+    """Returns how many snippets received each verdict."""
+    return {verdict: _verdicts[verdict] for verdict in (SAFE, UNSAFE, NEEDS_REVIEW)}
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Fork server for the python-code-execution image.
+
+Pre-imports the modules listed in RUNNER_PRELOAD, then serves snippets
+read from stdin, one JSON object per line:
+
+    {"code": "...", "timeout": 10, "memory": 104857600, "max_output": 1048576}
+
+Each snippet runs in a freshly forked child with resource limits and an
+audit hook that blocks process creation, signals, sockets, native code and
+file writes. One JSON response per line is written to stdout:
+
+    {"stdout": "...", "stderr": "...", "exit_code": 0, "timed_out": false,
+     "truncated": false, "duration": 0.002, "output_bytes": [12, 0],
+     "rusage": {"max_rss": 9437184, "user": 0.001, "system": 0.0}}
+
+Sending {"op": "cancel"} while a snippet runs kills it.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import builtins
+import resource
+import importlib
+import traceback
+
+PRELOAD = [name.strip() for name in os.environ.get("RUNNER_PRELOAD", "").split(",") if name.strip()]
+
+# Audit events a snippet may never raise
+BLOCKED_EVENTS = {
+    "os.system", "os.exec", "os.posix_spawn", "os.spawn", "os.fork", "os.forkpty",
+    "os.kill", "os.killpg", "os.setuid", "os.setgid", "os.chmod", "os.chown",
+    "os.remove", "os.rename", "os.rmdir", "os.mkdir", "os.symlink", "os.link",
+    "os.truncate", "os.putenv", "os.unsetenv", "subprocess.Popen", "signal.pthread_kill",
+    "ctypes.dlopen", "ctypes.dlsym", "ctypes.call_function", "ctypes.cdata",
+    "ctypes.addressof", "ctypes.string_at", "ctypes.wstring_at", "mmap.__new__",
+}
+BLOCKED_PREFIXES = ("socket.", "shutil.", "ftplib.", "smtplib.", "http.client.", "urllib.")
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_TRUNC
+
+TRUNCATION_MARKER = "\n[output truncated: {} bytes omitted]\n"
+
+
+def _audit_hook(event, args):
+    if event in BLOCKED_EVENTS or event.startswith(BLOCKED_PREFIXES):
+        raise PermissionError(f"'{event}' is not allowed in the sandbox")
+    if event == "open":
+        path, mode, flags = args
+        if mode is not None:
+            writing = any(c in str(mode) for c in "wax+")
+        else:
+            writing = bool((flags or 0) & WRITE_FLAGS)
+        if writing:
+            raise PermissionError(f"Writing to '{path}' is not allowed in the sandbox")
+
+
+def _virtual_memory() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * resource.getpagesize()
+
+
+def _set_limits(memory: int, timeout: float) -> None:
+    if memory:
+        # Inherited mappings (preloaded modules) count towards the address space
+        limit = _virtual_memory() + memory
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    cpu = int(timeout) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (64, 64))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def _run_child(request, out_w: int, err_w: int) -> None:
+    """Runs one snippet in the forked child; never returns."""
+    exit_code = 1
+    try:
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        os.closerange(3, 256)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        _set_limits(int(request.get("memory") or 0), float(request.get("timeout") or 10))
+        sys.addaudithook(_audit_hook)
+
+        namespace = {"__name__": "__main__", "__builtins__": builtins}
+        try:
+            exec(compile(request["code"], "<code>", "exec"), namespace)
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+        except BaseException as e:
+            # Hide this frame so the traceback starts in the snippet
+            traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+            exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            pass
+        os._exit(exit_code & 0xFF)
+
+
+def _decode(data: bytes, omitted: int) -> str:
+    text = data.decode("utf-8", errors="replace")
+    if omitted:
+        text += TRUNCATION_MARKER.format(omitted)
+    return text
+
+
+class Server:
+    def __init__(self):
+        self._stdin_buffer = b""
+        self._eof = False
+
+    def read_line(self, timeout=None):
+        """Returns the next stdin line, None on timeout, or raises EOFError."""
+        while b"\n" not in self._stdin_buffer:
+            if self._eof:
+                raise EOFError
+            ready, _, _ = select.select([0], [], [], timeout)
+            if not ready:
+                return None
+            chunk = os.read(0, 65536)
+            if not chunk:
+                self._eof = True
+                raise EOFError
+            self._stdin_buffer += chunk
+        line, self._stdin_buffer = self._stdin_buffer.split(b"\n", 1)
+        return line
+
+    def respond(self, response) -> None:
+        data = (json.dumps(response) + "\n").encode("utf-8")
+        while data:
+            written = os.write(1, data)
+            data = data[written:]
+
+    def run(self, request):
+        started = time.monotonic()
+        timeout = float(request.get("timeout") or 10)
+        max_output = int(request.get("max_output") or 1024 * 1024)
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            os.close(out_r)
+            os.close(err_r)
+            _run_child(request, out_w, err_w)
+        os.close(out_w)
+        os.close(err_w)
+
+        output = {out_r: bytearray(), err_r: bytearray()}
+        omitted = {out_r: 0, err_r: 0}
+        open_fds = [out_r, err_r]
+        deadline = started + timeout
+        timed_out = cancelled = False
+
+        while open_fds:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select(open_fds + ([] if self._eof else [0]), [], [], remaining)
+            for fd in ready:
+                if fd == 0:
+                    try:
+                        line = self.read_line(0)
+                    except EOFError:
+                        # The host went away; nobody is waiting for this result
+                        cancelled = True
+                        continue
+                    if line is not None and json.loads(line).get("op") == "cancel":
+                        cancelled = True
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    open_fds.remove(fd)
+                    os.close(fd)
+                    continue
+                room = max_output - len(output[fd])
+                output[fd] += chunk[:room]
+                omitted[fd] += max(len(chunk) - room, 0)
+            if cancelled:
+                break
+
+        if open_fds:
+            os.kill(pid, signal.SIGKILL)
+            for fd in open_fds:
+                os.close(fd)
+        _, status, usage = os.wait4(pid, 0)
+        if os.WIFSIGNALED(status):
+            exit_code = 128 + os.WTERMSIG(status)
+        else:
+            exit_code = os.WEXITSTATUS(status)
+
+        return {
+            "stdout": _decode(bytes(output[out_r]), omitted[out_r]),
+            "stderr": _decode(bytes(output[err_r]), omitted[err_r]),
+            "exit_code": exit_code,
+            "timed_out": timed_out,
+            "cancelled": cancelled,
+            "truncated": bool(omitted[out_r] or omitted[err_r]),
+            "duration": time.monotonic() - started,
+            "output_bytes": [len(output[out_r]) + omitted[out_r], len(output[err_r]) + omitted[err_r]],
+            # ru_maxrss is in kilobytes on Linux
+            "rusage": {"max_rss": usage.ru_maxrss * 1024, "user": usage.ru_utime, "system": usage.ru_stime},
+        }
+
+    def serve(self) -> None:
+        while True:
+            try:
+                line = self.read_line()
+            except EOFError:
+                return
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self.respond({"error": f"Invalid request: {e}"})
+                continue
+            if request.get("op") == "cancel":
+                # Arrived after the snippet finished
+                continue
+            try:
+                self.respond(self.run(request))
+            except OSError as e:
+                if e.errno == errno.EPIPE:
+                    return
+                self.respond({"error": f"Runner error: {e}"})
+
+
+def main() -> None:
+    for name in PRELOAD:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"fork_server: could not preload {name}: {e}", file=sys.stderr)
+    print(f"fork_server: ready, preloaded {len(PRELOAD)} modules", file=sys.stderr, flush=True)
+    Server().serve()
+
+
+if __name__ == "__main__":
+    main()
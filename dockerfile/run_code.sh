@@ -1,6 +1,21 @@
 #!/bin/bash
 set -e
 
+# Long-lived fork server: snippets arrive as JSON lines on stdin
+if [ "$1" = "--forkserver" ]; then
+    exec python /usr/local/bin/fork_server.py
+fi
+
+# Interactive session: snippets share one interpreter namespace
+if [ "$1" = "--session" ]; then
+    exec python /usr/local/bin/session_server.py
+fi
+
+# Code piped through stdin (in-memory delivery, nothing mounted from the host)
+if [ "$1" = "--stdin" ]; then
+    exec python -
+fi
+
 # Check if we're given a Python file to run
 if [ -f "/code/code.py" ]; then
     # Execute the Python file
@@ -8,4 +23,4 @@ if [ -f "/code/code.py" ]; then
 else
     # If no Python file is provided, run the command as is
     python "$@"
-fi 
\ No newline at end of file
+fi
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Session server for the python-code-execution image.
+
+Keeps one interpreter namespace alive and runs snippets read from stdin
+against it, one JSON object per line:
+
+    {"code": "...", "timeout": 10, "max_output": 1048576}
+
+Variables, imports and functions defined by one snippet are visible to the
+next. One JSON response per line is written to stdout:
+
+    {"stdout": "...", "stderr": "...", "exit_code": 0, "timed_out": false,
+     "truncated": false, "duration": 0.002, "output_bytes": [12, 0],
+     "rusage": {"max_rss": 9437184, "user": 0.001, "system": 0.0}}
+
+Output written through sys.stdout and sys.stderr is captured. Output written
+straight to file descriptors (subprocesses, C extensions) goes to the
+container's stderr instead. A snippet that runs past its timeout, or gets
+{"op": "cancel"}, is interrupted and the namespace is kept.
+"""
+import io
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import builtins
+import resource
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+TRUNCATION_MARKER = "\n[output truncated: {} bytes omitted]\n"
+
+
+class CellTimeout(BaseException):
+    """Raised in the snippet when it runs past its timeout."""
+
+
+def _on_alarm(signum, frame):
+    raise CellTimeout()
+
+
+class CappedWriter(io.TextIOBase):
+    """Text stream that keeps at most ``max_bytes`` of UTF-8 output."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.kept = 0
+        self.omitted = 0
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        data = str(text).encode("utf-8", errors="replace")
+        room = max(self.max_bytes - self.kept, 0)
+        if len(data) > room:
+            self.omitted += len(data) - room
+            data = data[:room]
+        if data:
+            self._parts.append(data)
+            self.kept += len(data)
+        return len(text)
+
+    def getvalue(self) -> str:
+        text = b"".join(self._parts).decode("utf-8", errors="replace")
+        if self.omitted:
+            text += TRUNCATION_MARKER.format(self.omitted)
+        return text
+
+
+class Server:
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.namespace = {"__name__": "__main__", "__builtins__": builtins}
+        self.requests: "queue.Queue" = queue.Queue()
+        self._running = False
+        self._lock = threading.Lock()
+
+    def read_stdin(self) -> None:
+        """Queues snippets and interrupts the running one on cancel (reader thread)."""
+        for line in sys.stdin.buffer:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self.requests.put({"error": f"Invalid request: {e}"})
+                continue
+            if request.get("op") == "cancel":
+                with self._lock:
+                    if self._running:
+                        # A real signal also wakes the main thread from blocking calls
+                        os.kill(os.getpid(), signal.SIGINT)
+                continue
+            self.requests.put(request)
+        # The host went away
+        self.requests.put(None)
+
+    def respond(self, response) -> None:
+        self.protocol.write((json.dumps(response) + "\n").encode("utf-8"))
+        self.protocol.flush()
+
+    def run(self, request):
+        started = time.monotonic()
+        timeout = float(request.get("timeout") or 10)
+        max_output = int(request.get("max_output") or 1024 * 1024)
+        stdout, stderr = CappedWriter(max_output), CappedWriter(max_output)
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        exit_code = 0
+        timed_out = cancelled = False
+
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                code = compile(request["code"], "<cell>", "exec")
+                with self._lock:
+                    self._running = True
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+                try:
+                    exec(code, self.namespace)
+                finally:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                    with self._lock:
+                        self._running = False
+            except CellTimeout:
+                timed_out = True
+                exit_code = 1
+                print(f"Execution timed out after {timeout:g}s; session state is kept", file=sys.stderr)
+            except KeyboardInterrupt:
+                cancelled = True
+                exit_code = 1
+            except SystemExit as e:
+                if isinstance(e.code, int):
+                    exit_code = e.code
+                elif e.code is not None:
+                    print(e.code, file=sys.stderr)
+                    exit_code = 1
+            except BaseException as e:
+                # Hide this frame so the traceback starts in the snippet
+                traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+                exit_code = 1
+        # In case an interrupt landed in the cleanup above
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        with self._lock:
+            self._running = False
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+            "exit_code": exit_code & 0xFF,
+            "timed_out": timed_out,
+            "cancelled": cancelled,
+            "truncated": bool(stdout.omitted or stderr.omitted),
+            "duration": time.monotonic() - started,
+            "output_bytes": [stdout.kept + stdout.omitted, stderr.kept + stderr.omitted],
+            # Peak RSS of the whole session so far (ru_maxrss is in kilobytes on Linux)
+            "rusage": {
+                "max_rss": usage.ru_maxrss * 1024,
+                "user": usage.ru_utime - usage_before.ru_utime,
+                "system": usage.ru_stime - usage_before.ru_stime,
+            },
+        }
+
+    def serve(self) -> None:
+        threading.Thread(target=self.read_stdin, name="stdin", daemon=True).start()
+        while True:
+            try:
+                request = self.requests.get()
+            except KeyboardInterrupt:
+                # A cancel that arrived as the previous snippet finished
+                continue
+            if request is None:
+                return
+            if "error" in request:
+                self.respond(request)
+                continue
+            try:
+                response = self.run(request)
+            except KeyboardInterrupt:
+                continue
+            try:
+                self.respond(response)
+            except BrokenPipeError:
+                return
+
+
+def main() -> None:
+    # Keep the real stdout for responses; stray writes to fd 1 land on stderr
+    protocol = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    print("session_server: ready", file=sys.stderr, flush=True)
+    Server(protocol).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Load-test and benchmark harness for the code execution API.
+
+Drives the API at a fixed concurrency with a weighted mix of request
+scenarios and reports throughput and latency percentiles per scenario.
+
+Against a running server:
+
+    python scripts/benchmark.py --url http://localhost:8002 --concurrency 32 --duration 30
+
+Fully offline (starts the fake Together AI server and the API on a fake
+docker backend, then shuts both down):
+
+    python scripts/benchmark.py --offline --concurrency 32 --requests 2000
+
+Results can be saved and compared with a previous run to catch regressions:
+
+    python scripts/benchmark.py --offline --save baseline.json
+    python scripts/benchmark.py --offline --baseline baseline.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import itertools
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SCRIPTS_DIR, "..", "app")
+
+# Default request mix (relative weights)
+DEFAULT_MIX = "execute=4,execute_validated=2,generate=2,large_output=1,timeout=1"
+
+_counter = itertools.count()
+
+
+def _execute_payload() -> tuple:
+    n = 1000 + next(_counter) % 1000
+    code = f"total = sum(i * i for i in range({n}))\nprint(total)\n"
+    return "/execute", {"code": code, "timeout": 5, "validate_code": False}
+
+
+def _execute_validated_payload() -> tuple:
+    # getattr needs LLM review, and the varying constant defeats the validation cache
+    n = next(_counter)
+    code = f"import math\nvalue = getattr(math, 'sqrt')({n})\nprint(value)\n"
+    return "/execute", {"code": code, "timeout": 5, "validate_code": True}
+
+
+def _generate_payload() -> tuple:
+    n = next(_counter)
+    return "/generate-and-execute", {"query": f"Print the sum of squares of the first {n} integers", "timeout": 5}
+
+
+def _execute_cached_payload() -> tuple:
+    # A small set of repeated snippets, so most requests hit the result cache
+    n = 1000 + next(_counter) % 10
+    code = f"total = sum(i * i for i in range({n}))\nprint(total)\n"
+    return "/execute", {"code": code, "timeout": 5, "validate_code": False, "cacheable": True}
+
+
+def _large_output_payload() -> tuple:
+    code = "for i in range(200000):\n    print('line', i, 'x' * 40)\n"
+    return "/execute", {"code": code, "timeout": 10, "validate_code": False}
+
+
+def _timeout_payload() -> tuple:
+    return "/execute", {"code": "while True:\n    pass\n", "timeout": 1, "validate_code": False}
+
+
+SCENARIOS = {
+    "execute": _execute_payload,
+    "execute_validated": _execute_validated_payload,
+    "execute_cached": _execute_cached_payload,
+    "generate": _generate_payload,
+    "large_output": _large_output_payload,
+    "timeout": _timeout_payload,
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}'. Choose from: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+
+    def record(self, scenario: str, latency: float, status: str) -> None:
+        self.latencies.setdefault(scenario, []).append(latency)
+        by_status = self.statuses.setdefault(scenario, {})
+        by_status[status] = by_status.get(status, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for scenario, latencies in sorted(self.latencies.items()):
+            statuses = self.statuses[scenario]
+            summary[scenario] = {
+                "requests": len(latencies),
+                "errors": sum(count for status, count in statuses.items() if status != "200"),
+                "rps": len(latencies) / elapsed,
+                "mean": sum(latencies) / len(latencies),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies),
+                "statuses": statuses,
+            }
+        return summary
+
+
+async def run_load(url: str, mix: Dict[str, float], concurrency: int,
+                   duration: Optional[float], total_requests: Optional[int]) -> tuple:
+    results = Results()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    issued = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        async def worker():
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                if total_requests is not None and next(issued) >= total_requests:
+                    return
+                scenario = random.choices(names, weights)[0]
+                path, payload = SCENARIOS[scenario]()
+                started = time.perf_counter()
+                try:
+                    response = await client.post(path, json=payload)
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                results.record(scenario, time.perf_counter() - started, status)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def print_report(summary: Dict[str, Dict[str, float]], elapsed: float) -> None:
+    total = sum(s["requests"] for s in summary.values())
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)\n")
+    header = f"{'scenario':<18}{'reqs':>7}{'errors':>8}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for scenario, s in summary.items():
+        print(
+            f"{scenario:<18}{s['requests']:>7}{s['errors']:>8}{s['rps']:>8.1f}"
+            f"{s['p50'] * 1000:>10.1f}{s['p95'] * 1000:>10.1f}{s['p99'] * 1000:>10.1f}{s['max'] * 1000:>10.1f}"
+        )
+    for scenario, s in summary.items():
+        if s["errors"]:
+            print(f"  {scenario} statuses: {s['statuses']}")
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Returns a description of every metric that regressed beyond the tolerance."""
+    regressions = []
+    for scenario, current in summary.items():
+        previous = baseline.get(scenario)
+        if not previous:
+            continue
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{scenario}: rps {previous['rps']:.1f} -> {current['rps']:.1f}")
+        for key in ("p50", "p95", "p99"):
+            if current[key] > previous[key] * (1 + tolerance):
+                regressions.append(
+                    f"{scenario}: {key} {previous[key] * 1000:.1f}ms -> {current[key] * 1000:.1f}ms"
+                )
+    return regressions
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_healthy(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server at {url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server at {url} did not start within {timeout:.0f}s")
+
+
+def start_offline_stack(args) -> tuple:
+    """Starts the fake Together AI server and the API; returns (url, processes)."""
+    llm_port, api_port = _free_port(), _free_port()
+    processes = []
+    log = open(args.server_log, "ab") if args.server_log else subprocess.DEVNULL
+
+    llm = subprocess.Popen([
+        sys.executable, os.path.join(SCRIPTS_DIR, "fake_together.py"),
+        "--port", str(llm_port),
+        "--latency", str(args.llm_latency),
+        "--jitter", str(args.llm_jitter),
+        "--malformed-rate", str(args.llm_malformed_rate),
+    ], stdout=log, stderr=log)
+    processes.append(llm)
+    _wait_healthy(f"http://127.0.0.1:{llm_port}/stats", llm)
+
+    env = dict(os.environ)
+    env.update(
+        TOGETHER_API_URL=f"http://127.0.0.1:{llm_port}/v1/chat/completions",
+        TOGETHER_API_KEY=env.get("TOGETHER_API_KEY") or "fake",
+    )
+    if args.real_docker:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(api_port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, os.path.join(SCRIPTS_DIR, "fake_docker.py"), "--port", str(api_port)]
+    api = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log, stderr=log)
+    processes.append(api)
+    url = f"http://127.0.0.1:{api_port}"
+    _wait_healthy(f"{url}/health", api)
+    return url, processes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Secure Python Code Execution API")
+    parser.add_argument("--url", default="http://localhost:8002", help="Base URL of a running API")
+    parser.add_argument("--offline", action="store_true",
+                        help="Start a fake Together AI server and the API on a fake docker backend")
+    parser.add_argument("--real-docker", action="store_true",
+                        help="With --offline, run the API against the real docker daemon")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests (default 500)")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"Weighted scenarios, e.g. '{DEFAULT_MIX}'")
+    parser.add_argument("--warmup", type=int, default=0, help="Requests sent before measuring")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake Together AI mean delay (s)")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Fake Together AI delay jitter (s)")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0,
+                        help="Fraction of fake Together AI responses that are not JSON")
+    parser.add_argument("--server-log", help="With --offline, append server output to this file")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression against the baseline")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the request mix")
+    args = parser.parse_args()
+
+    if args.duration is None and args.requests is None:
+        args.requests = 500
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+
+    processes = []
+    url = args.url
+    try:
+        if args.offline:
+            url, processes = start_offline_stack(args)
+            print(f"Offline stack running at {url}")
+
+        if args.warmup:
+            asyncio.run(run_load(url, mix, args.concurrency, None, args.warmup))
+
+        print(f"Benchmarking {url}: concurrency {args.concurrency}, mix {mix}")
+        results, elapsed = asyncio.run(run_load(url, mix, args.concurrency, args.duration, args.requests))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    summary = results.summary(elapsed)
+    print_report(summary, elapsed)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"concurrency": args.concurrency, "mix": mix, "scenarios": summary}, f, indent=2)
+        print(f"\nResults saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+        regressions = compare(summary, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
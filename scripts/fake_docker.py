@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Runs the API against a fake docker backend for offline benchmarks.
+
+Sandbox "containers" are plain local Python subprocesses, so the service's
+scheduling, pooling, streaming and output handling can be measured without
+a docker daemon. There is NO isolation: only run trusted benchmark code.
+
+    python scripts/fake_docker.py --port 8002
+
+Container create/start overhead can be simulated with
+FAKE_DOCKER_CREATE_LATENCY and FAKE_DOCKER_START_LATENCY (seconds). Every
+DOCKER_ENDPOINTS entry gets its own fake daemon; list base URLs in
+FAKE_DOCKER_DOWN to simulate daemons that refuse connections.
+"""
+import os
+import sys
+import time
+import queue
+import hashlib
+import socket
+import struct
+import argparse
+import itertools
+import threading
+import subprocess
+
+import docker
+
+# Comma separated base URLs whose fake daemons refuse connections
+DOWN_ENDPOINTS = {url.strip() for url in os.getenv("FAKE_DOCKER_DOWN", "").split(",") if url.strip()}
+CREATE_LATENCY = float(os.getenv("FAKE_DOCKER_CREATE_LATENCY", "0"))
+START_LATENCY = float(os.getenv("FAKE_DOCKER_START_LATENCY", "0"))
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FORK_SERVER = os.path.join(SCRIPTS_DIR, "..", "dockerfile", "fork_server.py")
+SESSION_SERVER = os.path.join(SCRIPTS_DIR, "..", "dockerfile", "session_server.py")
+
+_ids = itertools.count()
+
+
+class _StdinSocket:
+    """Mimics the socket returned by ``attach_socket`` for stdin delivery."""
+
+    def __init__(self, proc: subprocess.Popen):
+        self.proc = proc
+
+    def sendall(self, data: bytes) -> None:
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close(self) -> None:
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+
+class _MultiplexedSocket:
+    """
+    Mimics a raw attach socket: stdin goes to the process, stdout/stderr
+    come back in docker's 8-byte-header multiplexed frames.
+    """
+
+    def __init__(self, container: "FakeContainer"):
+        self._sock, self._peer = socket.socketpair()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._pump, args=(container,), daemon=True).start()
+
+    def _pump(self, container: "FakeContainer") -> None:
+        container._started.wait()
+        proc = container._proc
+
+        def forward_stdin():
+            try:
+                for chunk in iter(lambda: self._peer.recv(65536), b""):
+                    proc.stdin.write(chunk)
+                    proc.stdin.flush()
+            except OSError:
+                pass
+            proc.stdin.close()
+
+        def forward_output(pipe, stream):
+            for chunk in iter(lambda: pipe.read1(65536), b""):
+                with self._lock:
+                    self._peer.sendall(struct.pack(">BxxxI", stream, len(chunk)) + chunk)
+
+        threading.Thread(target=forward_stdin, daemon=True).start()
+        threading.Thread(target=forward_output, args=(proc.stderr, 2), daemon=True).start()
+        forward_output(proc.stdout, 1)
+        self._peer.close()
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class FakeContainer:
+    """A created container backed by a local subprocess once started."""
+
+    def __init__(self, client: "FakeDockerClient", options: dict):
+        time.sleep(CREATE_LATENCY)
+        self.client = client
+        self.options = options
+        self.id = f"fake{next(_ids):08d}"
+        self.name = self.id
+        self.labels = options.get("labels") or {}
+        self.status = "created"
+        self.attrs = {"State": {"ExitCode": 0, "OOMKilled": False}, "Config": {"Labels": self.labels}}
+        self._proc = None
+        self._started = threading.Event()
+
+    def _argv(self):
+        command = self.options.get("command") or []
+        if command == ["--stdin"]:
+            return [sys.executable, "-"]
+        if command == ["--forkserver"]:
+            return [sys.executable, FORK_SERVER]
+        if command == ["--session"]:
+            return [sys.executable, SESSION_SERVER]
+        # Map the /code bind mount back to its host directory
+        for host_dir, bind in (self.options.get("volumes") or {}).items():
+            command = [arg.replace(bind["bind"], host_dir, 1) for arg in command]
+        return [sys.executable] + command[1:]
+
+    def start(self) -> None:
+        time.sleep(START_LATENCY)
+        env = dict(os.environ)
+        env.update(self.options.get("environment") or {})
+        self._proc = subprocess.Popen(
+            self._argv(),
+            stdin=subprocess.PIPE if self.options.get("stdin_open") else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+        )
+        self.status = "running"
+        self._started.set()
+
+    def attach_socket(self, params=None):
+        if self.options.get("command") in (["--forkserver"], ["--session"]):
+            # The runner attaches before starting, like the real API allows
+            return _MultiplexedSocket(self)
+        self._started.wait()
+        return _StdinSocket(self._proc)
+
+    def attach(self, stdout=True, stderr=True, stream=True, logs=True, demux=True):
+        def pump(pipe, index, events):
+            for chunk in iter(lambda: pipe.read1(65536), b""):
+                events.put((index, chunk))
+            events.put((index, None))
+
+        def frames():
+            self._started.wait()
+            events: queue.Queue = queue.Queue()
+            for index, pipe in enumerate((self._proc.stdout, self._proc.stderr)):
+                threading.Thread(target=pump, args=(pipe, index, events), daemon=True).start()
+            open_pipes = 2
+            while open_pipes:
+                index, chunk = events.get()
+                if chunk is None:
+                    open_pipes -= 1
+                elif index == 0:
+                    yield chunk, None
+                else:
+                    yield None, chunk
+
+        return frames()
+
+    def wait(self, timeout=None) -> dict:
+        self._started.wait()
+        code = self._proc.wait(timeout=timeout)
+        self.attrs["State"]["ExitCode"] = code
+        self.status = "exited"
+        return {"StatusCode": code}
+
+    def kill(self, signal=None) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+
+    def reload(self) -> None:
+        if self._proc is not None and self._proc.poll() is not None:
+            self.status = "exited"
+
+    def stats(self, stream=False, one_shot=None) -> dict:
+        # Docker-shaped figures for the backing process, read from /proc
+        if self._proc is None or self._proc.poll() is not None:
+            return {"memory_stats": {}, "cpu_stats": {}}
+        try:
+            with open(f"/proc/{self._proc.pid}/status") as f:
+                rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            with open(f"/proc/{self._proc.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, StopIteration):
+            return {"memory_stats": {}, "cpu_stats": {}}
+        ticks = os.sysconf("SC_CLK_TCK")
+        user, system = int(fields[11]) * 10**9 // ticks, int(fields[12]) * 10**9 // ticks
+        return {
+            "memory_stats": {"usage": rss_kb * 1024, "stats": {"inactive_file": 0}},
+            "cpu_stats": {
+                "cpu_usage": {"total_usage": user + system, "usage_in_usermode": user, "usage_in_kernelmode": system},
+                "throttling_data": {"periods": 0, "throttled_periods": 0, "throttled_time": 0},
+            },
+        }
+
+    def logs(self, stdout=True, stderr=True, **kwargs) -> bytes:
+        return b""
+
+    def remove(self, force=False) -> None:
+        self.kill()
+        self.client.containers._live.pop(self.id, None)
+
+
+class FakeContainers:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+        self._live = {}
+
+    def create(self, **options) -> FakeContainer:
+        container = FakeContainer(self.client, options)
+        self._live[container.id] = container
+        return container
+
+    def run(self, detach=True, remove=False, **options) -> FakeContainer:
+        container = self.create(**options)
+        container.start()
+        return container
+
+    def get(self, container_id: str) -> FakeContainer:
+        try:
+            return self._live[container_id]
+        except KeyError:
+            raise docker.errors.NotFound(f"No such container: {container_id}")
+
+    def list(self, all=False, filters=None, **kwargs) -> list:
+        containers = list(self._live.values())
+        label = (filters or {}).get("label")
+        if label:
+            key, _, value = label.partition("=")
+            containers = [c for c in containers if key in c.labels and (not value or c.labels[key] == value)]
+        return containers
+
+
+class FakeImage:
+    def __init__(self, name: str):
+        self.id = "sha256:" + hashlib.sha256(name.encode("utf-8")).hexdigest()
+        self.tags = [name]
+
+
+class FakeImages:
+    def get(self, name: str) -> FakeImage:
+        return FakeImage(name)
+
+
+class FakeDockerClient:
+    """Subset of ``docker.DockerClient`` used by the service."""
+
+    def __init__(self, base_url=None, **kwargs):
+        self.base_url = base_url
+        self._check_up()
+        self.containers = FakeContainers(self)
+        self.images = FakeImages()
+
+    def _check_up(self) -> None:
+        if self.base_url in DOWN_ENDPOINTS:
+            raise docker.errors.DockerException(f"Error while fetching server API version: {self.base_url} is down")
+
+    def ping(self) -> bool:
+        self._check_up()
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+def install() -> None:
+    """Makes ``docker.from_env`` return a FakeDockerClient."""
+    docker.from_env = FakeDockerClient
+    docker.DockerClient = FakeDockerClient
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the API with a fake docker backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    args = parser.parse_args()
+
+    install()
+    app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+    sys.path.insert(0, app_dir)
+    os.chdir(app_dir)
+
+    import uvicorn
+    import main
+
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
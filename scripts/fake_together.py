@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for the Together AI chat completions API.
+
+Answers generation and validation prompts with well-formed JSON after a
+configurable delay, so the API can be benchmarked without a real key or
+network access. Point the service at it with:
+
+    TOGETHER_API_URL=http://127.0.0.1:8010/v1/chat/completions TOGETHER_API_KEY=fake
+"""
+import re
+import json
+import random
+import asyncio
+import argparse
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake Together AI")
+
+# Overridden from the command line
+settings = {
+    "latency": 0.5,
+    "jitter": 0.1,
+    "malformed_rate": 0.0,
+    "unsafe_rate": 0.0,
+    "low_confidence_rate": 0.0,
+    "error_rate": 0.0,
+    "tail_rate": 0.0,
+    "tail_latency": 5.0,
+    "chunk_chars": 4,
+    "model_latency": {},
+}
+counters = {"generation": 0, "validation": 0, "malformed": 0, "errors": 0, "models": {}}
+
+
+def _generated_code(query: str) -> str:
+    # Any integer in the query sizes the workload, so varied queries do varied work
+    numbers = [int(n) for n in re.findall(r"\d+", query)] or [100]
+    n = min(numbers[0], 1_000_000)
+    return (
+        f"# {query}\n"
+        f"total = sum(i * i for i in range({n}))\n"
+        f"print(f'Sum of squares below {n}: {{total}}')\n"
+    )
+
+
+def _submitted_code(content: str) -> str:
+    match = re.search(r"```python\n(.*)\n```", content, re.S)
+    return match.group(1) if match else content
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    system = body["messages"][0]["content"]
+    user = body["messages"][-1]["content"]
+
+    model = body.get("model") or "unknown"
+    counters["models"][model] = counters["models"].get(model, 0) + 1
+    if random.random() < settings["error_rate"]:
+        # Exercise the service's retries and circuit breaker
+        counters["errors"] += 1
+        return JSONResponse({"error": {"message": "Fake overload"}}, status_code=503)
+    latency = settings["model_latency"].get(model, settings["latency"])
+    if random.random() < settings["tail_rate"]:
+        latency = settings["tail_latency"]
+    delay = latency + random.uniform(-settings["jitter"], settings["jitter"])
+    if not body.get("stream"):
+        await asyncio.sleep(max(delay, 0))
+
+    is_safe = random.random() >= settings["unsafe_rate"]
+    if "security analyst" in system:
+        counters["validation"] += 1
+        code = _submitted_code(user)
+        confident = random.random() >= settings["low_confidence_rate"]
+        result = {
+            "explanation": "Fake validation" if is_safe else "Fake rejection",
+            "is_safe": is_safe,
+            "confidence": 0.95 if confident else 0.4,
+        }
+        if "Do not rewrite" not in system:
+            result["validated_code"] = code
+    else:
+        counters["generation"] += 1
+        query = user.split("\n", 1)[0].replace("Write Python code to: ", "")
+        code = _generated_code(query)
+        result = {
+            "generated_code": code,
+            "is_safe": is_safe,
+            "explanation": "Fake generation" if is_safe else "Fake rejection",
+        }
+
+    if random.random() < settings["malformed_rate"]:
+        # Exercise the service's fallback parsers
+        counters["malformed"] += 1
+        content = f"Here is the code:\n```python\n{code}\n```"
+    else:
+        content = json.dumps(result)
+
+    # Roughly four characters per token
+    usage = {"prompt_tokens": (len(system) + len(user)) // 4, "completion_tokens": len(content) // 4 + 1}
+    if body.get("stream"):
+        return StreamingResponse(_stream(content, delay, usage), media_type="text/event-stream")
+
+    return {
+        "id": "fake",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+async def _stream(content: str, delay: float, usage: dict):
+    # Spread the response delay over the chunks, like token-by-token generation
+    size = settings["chunk_chars"]
+    chunks = [content[i:i + size] for i in range(0, len(content), size)]
+    for chunk in chunks:
+        yield "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": chunk}}]}) + "\n\n"
+        await asyncio.sleep(max(delay, 0) / len(chunks))
+    # Like Together AI, usage arrives in a final chunk without choices
+    yield "data: " + json.dumps({"choices": [], "usage": usage}) + "\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Together AI stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Uniform +/- jitter on the delay in seconds")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of responses sent as markdown instead of JSON")
+    parser.add_argument("--unsafe-rate", type=float, default=0.0,
+                        help="Fraction of responses that mark the code unsafe")
+    parser.add_argument("--low-confidence-rate", type=float, default=0.0,
+                        help="Fraction of validation responses with low confidence")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with HTTP 503")
+    parser.add_argument("--tail-rate", type=float, default=0.0,
+                        help="Fraction of requests delayed by --tail-latency instead")
+    parser.add_argument("--tail-latency", type=float, default=5.0, help="Delay of tail requests in seconds")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="Mean response delay for one model (repeatable)")
+    args = parser.parse_args()
+
+    settings.update(
+        latency=args.latency,
+        jitter=args.jitter,
+        malformed_rate=args.malformed_rate,
+        unsafe_rate=args.unsafe_rate,
+        low_confidence_rate=args.low_confidence_rate,
+        error_rate=args.error_rate,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+        model_latency={
+            model: float(seconds) for model, seconds in (item.rsplit("=", 1) for item in args.model_latency)
+        },
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
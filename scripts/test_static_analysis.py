@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the static pre-screen.
+
+Snippets judged safe skip the LLM entirely, so known ways of reaching a
+dangerous module through an allow-listed one must never be judged safe.
+
+    python scripts/test_static_analysis.py    (or: python -m pytest scripts/test_static_analysis.py)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from services.static_analysis import NEEDS_REVIEW, SAFE, UNSAFE, analyze_code  # noqa: E402
+
+BYPASSES = [
+    'import random\nrandom._os.system("id")',
+    'from random import _os\n_os.system("id")',
+    'import dataclasses\ndataclasses.builtins.exec("import os")',
+    'import typing\ntyping.sys.modules["os"].system("id")',
+    'print("{0.__class__.__mro__}".format(1))',
+    'print("{0[0]}".format([1]))',
+    'print(str.format("{0.real}", 1))',
+    'print("{x.y}".format_map({}))',
+    'template = input()\nprint(template.format(1))',
+    'import operator\nget = operator.attrgetter("__class__.__base__.__subclasses__")\nprint(get(1)())',
+    'from operator import attrgetter\nprint(attrgetter("__init__.__globals__")(print))',
+    'from operator import *\nprint(attrgetter("__init__.__globals__")(print))',
+    'import typing\nclass A:\n    x: "__import__(\'os\').system(\'id\')"\ntyping.get_type_hints(A)',
+    'import functools\n@functools.singledispatch\ndef f(x): pass\n@f.register\ndef _(x: "__import__(\'os\').system(\'id\')"): pass',
+    'import string\nprint(string.Formatter().get_field("0.__class__.__mro__", [1], {}))',
+    'import dataclasses\nprint(dataclasses.inspect.getmembers(1))',
+    'from dataclasses import types\nprint(types.FunctionType)',
+]
+
+SAFE_SNIPPETS = [
+    "import math\nprint(math.sqrt(2))",
+    'import re\nprint(re.compile("a+").match("aa"))',
+    'print("{} {:>{}}".format(1, 2, 3))',
+    'print(f"{1 + 1}")',
+    'import operator\nprint(operator.add(1, 2))',
+    'import collections.abc\nprint(isinstance([], collections.abc.Sequence))',
+    'class Node:\n    def child(self) -> "Node":\n        return self\nprint(Node().child())',
+]
+
+
+def test_bypasses_are_not_safe():
+    for code in BYPASSES:
+        verdict, reason = analyze_code(code)
+        assert verdict in (NEEDS_REVIEW, UNSAFE), f"{code!r} judged {verdict}: {reason}"
+
+
+def test_plain_code_stays_safe():
+    for code in SAFE_SNIPPETS:
+        verdict, reason = analyze_code(code)
+        assert verdict == SAFE, f"{code!r} judged {verdict}: {reason}"
+
+
+if __name__ == "__main__":
+    test_bypasses_are_not_safe()
+    test_plain_code_stays_safe()
+    print("Static analysis tests passed")